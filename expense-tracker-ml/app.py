@@ -1,34 +1,437 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, g, has_request_context
 from flask_cors import CORS
+import click
 import sqlite3
-import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.pipeline import Pipeline
-from sklearn.model_selection import cross_val_score
-from sklearn.preprocessing import LabelEncoder
+import base64
+import binascii
+import concurrent.futures
+import copy
+import functools
+import gzip
+import io
 import re
 import pickle
 import os
-from datetime import datetime
+import queue
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
 import json
+import math
+import csv
+from collections import OrderedDict, namedtuple
+
+import compact_model
+import metrics
+from import_expenses import (AMOUNT_SIGNS, PARSERS as STATEMENT_PARSERS, detect_format, import_expenses,
+                             parse_csv, parse_date)
+
+try:
+    import brotli
+except ImportError:  # Optional; responses fall back to gzip
+    brotli = None
+
+# scikit-learn and pandas take most of a cold start, so they are imported
+# where they are used: training, the online categorizer and Parquet export.
+# Serving predictions from the compact model artifact needs neither.
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'X-Next-Offset', 'Server-Timing'])
+
+# Instrumentation: latency histograms and counters served at /metrics, and
+# optionally a Server-Timing header breaking each response down by phase
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
+registry = metrics.Registry()
+REQUEST_COUNT = registry.counter(
+    'http_requests_total', 'HTTP requests handled, by route and status', ('method', 'route', 'status'))
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'Time to build each HTTP response', ('method', 'route'))
+PHASE_LATENCY = registry.histogram(
+    'expense_tracker_phase_duration_seconds', 'Time spent in instrumented internals, by phase', ('phase',))
+
+class PhaseTimer:
+    """Context manager timing one phase into PHASE_LATENCY and the request's Server-Timing"""
+    
+    __slots__ = ('phase', 'started')
+    
+    def __init__(self, phase):
+        self.phase = phase
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        if not METRICS_ENABLED:
+            return
+        elapsed = time.perf_counter() - self.started
+        PHASE_LATENCY.observe(elapsed, self.phase)
+        if SERVER_TIMING and has_request_context():
+            timings = g.setdefault('server_timing', {})
+            timings[self.phase] = timings.get(self.phase, 0.0) + elapsed
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count and time every response; add Server-Timing when enabled"""
+    started = g.pop('request_started', None)
+    if not METRICS_ENABLED or started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    # The URL rule, not the path, keeps label cardinality bounded
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_COUNT.inc(request.method, route, str(response.status_code))
+    REQUEST_LATENCY.observe(elapsed, request.method, route)
+    if SERVER_TIMING:
+        timings = g.pop('server_timing', {})
+        response.headers['Server-Timing'] = ', '.join(
+            [f'{phase};dur={seconds * 1000:.3f}' for phase, seconds in timings.items()]
+            + [f'total;dur={elapsed * 1000:.3f}'])
+    return response
 
 # Database setup
 DATABASE = 'expenses.db'
 
-def init_db():
-    """Initialize the database with required tables"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+# SQLite tuning applied to every connection: WAL lets readers proceed while a
+# write is in progress, and busy_timeout makes writers queue up instead of
+# failing with "database is locked"
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16000',  # ~16 MB page cache per connection
+    'PRAGMA busy_timeout=5000',
+)
+
+# Idle connections kept open per database for reuse across requests
+SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 8))
+
+# Group commit for POST /api/expenses: inserts are queued and committed
+# together by one writer thread, up to WRITE_QUEUE_MAX_ROWS at a time. The
+# rows queued while a commit runs form the next batch; a max wait above 0
+# also holds a batch open until it is full or its oldest row is that old,
+# for bigger batches where commits are slow (synchronous=FULL on a slow disk)
+WRITE_QUEUE = os.environ.get('WRITE_QUEUE', '0') == '1'
+WRITE_QUEUE_MAX_ROWS = int(os.environ.get('WRITE_QUEUE_MAX_ROWS', 500))
+WRITE_QUEUE_MAX_WAIT_MS = float(os.environ.get('WRITE_QUEUE_MAX_WAIT_MS', 0))
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor whose statement and fetch calls count towards the 'db' phase"""
+    
+    def execute(self, *args):
+        with PhaseTimer('db'):
+            return super().execute(*args)
+    
+    def executemany(self, *args):
+        with PhaseTimer('db'):
+            return super().executemany(*args)
+    
+    def fetchone(self):
+        with PhaseTimer('db'):
+            return super().fetchone()
+    
+    def fetchmany(self, *args):
+        with PhaseTimer('db'):
+            return super().fetchmany(*args)
+    
+    def fetchall(self):
+        with PhaseTimer('db'):
+            return super().fetchall()
+
+class TimedConnection(sqlite3.Connection):
+    """Connection handing out TimedCursors and timing its shortcut methods"""
+    
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+    
+    # Connection.execute runs the statement in C without calling
+    # TimedCursor.execute, so it is timed here
+    def execute(self, *args):
+        with PhaseTimer('db'):
+            return super().execute(*args)
     
-    # Create expenses table
+    def executemany(self, *args):
+        with PhaseTimer('db'):
+            return super().executemany(*args)
+    
+    def commit(self):
+        with PhaseTimer('db'):
+            return super().commit()
+
+def connect_db(database=None):
+    """Open a new configured connection to the database"""
+    conn = sqlite3.connect(database or DATABASE, check_same_thread=False, factory=TimedConnection)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+class ConnectionPool:
+    """Thread-safe pool of idle SQLite connections for one database file"""
+    
+    def __init__(self, database, max_idle):
+        self.database = database
+        self._idle = queue.LifoQueue(max_idle)
+    
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect_db(self.database)
+    
+    def release(self, conn):
+        # Never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _get_pool():
+    with _pools_lock:
+        if DATABASE not in _pools:
+            _pools[DATABASE] = ConnectionPool(DATABASE, SQLITE_POOL_SIZE)
+        return _pools[DATABASE]
+
+def get_db():
+    """Get the connection for the current request, taking it from the pool on first use"""
+    if 'db' not in g:
+        g.db_pool = _get_pool()
+        g.db = g.db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    """Return the request's connection to the pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        g.pop('db_pool').release(conn)
+
+INSERT_EXPENSE_SQL = '''
+    INSERT INTO expenses (description, amount, category, predicted_category, user_corrected, normalized_description)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+WRITE_BATCH_ROWS = registry.histogram(
+    'expense_tracker_write_batch_rows', 'Expenses committed per write queue transaction',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+class WriteQueue:
+    """Group commit of single expense inserts into one database.
+    
+    Each caller queues an INSERT_EXPENSE_SQL row and blocks; one writer
+    thread inserts everything queued in a single transaction, so a burst
+    of expenses costs one commit rather than one each. Callers return only
+    once their batch has committed, with the id their row was given.
+    """
+    
+    def __init__(self, database, max_rows, max_wait):
+        self.database = database
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.batches = 0
+        self.rows = 0
+        # (row, future, time queued), oldest first
+        self._pending = []
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+    
+    def insert(self, row):
+        """Queue a row and return its expense id once it is committed"""
+        future = concurrent.futures.Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Write queue is closed')
+            self._pending.append((row, future, time.monotonic()))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+                self._thread.start()
+            # The writer only needs waking to start a batch or to flush a full one
+            if len(self._pending) in (1, self.max_rows):
+                self._condition.notify_all()
+        return future.result()
+    
+    def close(self):
+        """Commit whatever is queued and stop the writer"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+    
+    def _next_batch(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending or self._closed)
+            # Hold the batch open until it is full or its oldest row is max_wait old
+            while self._pending and len(self._pending) < self.max_rows and not self._closed:
+                remaining = self._pending[0][2] + self.max_wait - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[:self.max_rows]
+            del self._pending[:self.max_rows]
+            return batch
+    
+    def _run(self):
+        conn = connect_db(self.database)
+        try:
+            while True:
+                batch = self._next_batch()
+                if not batch:
+                    return
+                try:
+                    self._write(conn, batch)
+                except Exception as e:
+                    # Never leave a caller waiting on a row the writer gave up on
+                    app.logger.exception('Write queue batch failed')
+                    for _, future, _ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            conn.close()
+    
+    def _write(self, conn, batch):
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(INSERT_EXPENSE_SQL, [row for row, _, _ in batch])
+            # The transaction holds the write lock, so the AUTOINCREMENT ids are contiguous
+            cursor.execute('SELECT last_insert_rowid()')
+            last_id = cursor.fetchone()[0]
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            # Retry row by row, so a bad row fails only its own caller
+            for row, future, _ in batch:
+                try:
+                    expense_id = conn.execute(INSERT_EXPENSE_SQL, row).lastrowid
+                    conn.commit()
+                except sqlite3.Error as e:
+                    conn.rollback()
+                    future.set_exception(e)
+                else:
+                    future.set_result(expense_id)
+            self._record(len(batch))
+            return
+    
+        for offset, (_, future, _) in enumerate(batch):
+            future.set_result(last_id - len(batch) + 1 + offset)
+        self._record(len(batch))
+    
+    def _record(self, rows):
+        self.batches += 1
+        self.rows += rows
+        if METRICS_ENABLED:
+            WRITE_BATCH_ROWS.observe(rows)
+
+_write_queues = {}
+
+def _get_write_queue():
+    with _pools_lock:
+        if DATABASE not in _write_queues:
+            _write_queues[DATABASE] = WriteQueue(DATABASE, WRITE_QUEUE_MAX_ROWS, WRITE_QUEUE_MAX_WAIT_MS / 1000)
+        return _write_queues[DATABASE]
+
+def _rebuild_analytics_rollups(cursor):
+    """Recompute the category and monthly rollups from the expenses table"""
+    cursor.execute('DELETE FROM category_totals')
+    cursor.execute('''
+        INSERT INTO category_totals (category, total, count, predicted_correctly)
+        SELECT category, SUM(amount), COUNT(*),
+               COALESCE(SUM(NOT user_corrected AND category = predicted_category), 0)
+        FROM expenses
+        GROUP BY category
+    ''')
+    cursor.execute('DELETE FROM monthly_totals')
     cursor.execute('''
+        INSERT INTO monthly_totals (month, total, count)
+        SELECT month, SUM(amount), COUNT(*)
+        FROM expenses
+        GROUP BY month
+    ''')
+
+# Start of the budget period containing a timestamp, per period type
+PERIOD_START_SQL = {
+    'monthly': "strftime('%Y-%m-01', {date})",
+    'weekly': "date({date}, 'weekday 0', '-6 days')",
+}
+
+# Trigger bodies updating period_totals for one expense row (NEW or OLD);
+# the period starts match PERIOD_START_SQL
+_PERIOD_TOTALS_ADD = '''
+            INSERT INTO period_totals (category, period, period_start, total, count)
+            VALUES ({row}.category, 'monthly', strftime('%Y-%m-01', {row}.date), {row}.amount, 1),
+                   ({row}.category, 'weekly', date({row}.date, 'weekday 0', '-6 days'), {row}.amount, 1)
+            ON CONFLICT (category, period, period_start) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;'''
+
+_PERIOD_TOTALS_SUBTRACT = '''
+            UPDATE period_totals SET
+                total = total - {row}.amount,
+                count = count - 1
+            WHERE category = {row}.category AND (
+                (period = 'monthly' AND period_start = strftime('%Y-%m-01', {row}.date)) OR
+                (period = 'weekly' AND period_start = date({row}.date, 'weekday 0', '-6 days')));
+            DELETE FROM period_totals WHERE category = {row}.category AND count = 0;'''
+
+def _rebuild_period_totals(cursor):
+    """Recompute the per-category budget period totals from the expenses table"""
+    cursor.execute('DELETE FROM period_totals')
+    for period, start_sql in PERIOD_START_SQL.items():
+        cursor.execute(f'''
+            INSERT INTO period_totals (category, period, period_start, total, count)
+            SELECT category, ?, {start_sql.format(date='date')}, SUM(amount), COUNT(*)
+            FROM expenses
+            GROUP BY 1, 3
+        ''', (period,))
+
+def _backfill_normalized_descriptions(cursor):
+    """Fill normalized_description for existing expenses with preprocess_text"""
+    # Registered on this connection only for the backfill; the app writes
+    # the column itself on insert, so the schema never depends on it
+    cursor.connection.create_function('preprocess_text', 1, preprocess_text, deterministic=True)
+    cursor.execute('UPDATE expenses SET normalized_description = preprocess_text(description)')
+
+# Trigger bodies keeping the search index in step with one expense row (NEW
+# or OLD); an external content index must be told the old values to remove
+_SEARCH_INDEX_ADD = '''
+            INSERT INTO expenses_fts (rowid, description, normalized_description)
+            VALUES ({row}.id, {row}.description, {row}.normalized_description);'''
+
+_SEARCH_INDEX_REMOVE = '''
+            INSERT INTO expenses_fts (expenses_fts, rowid, description, normalized_description)
+            VALUES ('delete', {row}.id, {row}.description, {row}.normalized_description);'''
+
+# Trigger body recording a user's category for a description in
+# merchant_categories; seq orders the changes for MerchantIndex.sync
+_MERCHANT_UPSERT = '''
+            INSERT INTO merchant_categories (normalized_description, category, seq)
+            VALUES ({row}.normalized_description, {row}.category,
+                    (SELECT COALESCE(MAX(seq), 0) + 1 FROM merchant_categories))
+            ON CONFLICT (normalized_description) DO UPDATE SET
+                category = excluded.category,
+                seq = excluded.seq
+            WHERE category <> excluded.category;'''
+
+# Schema migrations, applied in order. PRAGMA user_version records how many
+# have run, so existing databases are upgraded in place. Each step is an SQL
+# statement or a callable taking a cursor. Never edit a released migration;
+# append a new one instead.
+MIGRATIONS = [
+    ('initial schema', [
+        '''
         CREATE TABLE IF NOT EXISTS expenses (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             description TEXT NOT NULL,
@@ -38,97 +441,659 @@ def init_db():
             date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             user_corrected BOOLEAN DEFAULT FALSE
         )
-    ''')
-    
-    # Create budgets table
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS budgets (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             category TEXT UNIQUE NOT NULL,
             budget_amount REAL NOT NULL,
             created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    conn.commit()
+        ''',
+    ]),
+    ('expense indexes', [
+        # The rowid is implicitly the last column of every index, so these
+        # also cover the (date, id) keyset ordering
+        'CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses (date)',
+        'CREATE INDEX IF NOT EXISTS idx_expenses_category_date ON expenses (category, date)',
+        # Only corrected rows; serves retrain_model and ?user_corrected=true
+        'CREATE INDEX IF NOT EXISTS idx_expenses_corrected ON expenses (date) WHERE user_corrected = TRUE',
+    ]),
+    ('month column', [
+        # Monthly grouping reads an indexed column instead of calling strftime per row
+        "ALTER TABLE expenses ADD COLUMN month TEXT GENERATED ALWAYS AS (strftime('%Y-%m', date)) VIRTUAL",
+        'CREATE INDEX idx_expenses_month ON expenses (month, amount)',
+    ]),
+    ('analytics rollups', [
+        # Per-category and per-month totals kept current by triggers, so the
+        # dashboard reads O(categories + months) rows instead of every expense
+        '''
+        CREATE TABLE category_totals (
+            category TEXT PRIMARY KEY,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            predicted_correctly INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE monthly_totals (
+            month TEXT PRIMARY KEY,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TRIGGER expenses_rollup_insert AFTER INSERT ON expenses
+        BEGIN
+            INSERT INTO category_totals (category, total, count, predicted_correctly)
+            VALUES (NEW.category, NEW.amount, 1,
+                    COALESCE(NOT NEW.user_corrected AND NEW.category = NEW.predicted_category, 0))
+            ON CONFLICT (category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1,
+                predicted_correctly = predicted_correctly + excluded.predicted_correctly;
+            INSERT INTO monthly_totals (month, total, count)
+            VALUES (NEW.month, NEW.amount, 1)
+            ON CONFLICT (month) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER expenses_rollup_delete AFTER DELETE ON expenses
+        BEGIN
+            UPDATE category_totals SET
+                total = total - OLD.amount,
+                count = count - 1,
+                predicted_correctly = predicted_correctly
+                    - COALESCE(NOT OLD.user_corrected AND OLD.category = OLD.predicted_category, 0)
+            WHERE category = OLD.category;
+            DELETE FROM category_totals WHERE category = OLD.category AND count = 0;
+            UPDATE monthly_totals SET
+                total = total - OLD.amount,
+                count = count - 1
+            WHERE month = OLD.month;
+            DELETE FROM monthly_totals WHERE month = OLD.month AND count = 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER expenses_rollup_update
+        AFTER UPDATE OF amount, category, predicted_category, user_corrected, date ON expenses
+        BEGIN
+            UPDATE category_totals SET
+                total = total - OLD.amount,
+                count = count - 1,
+                predicted_correctly = predicted_correctly
+                    - COALESCE(NOT OLD.user_corrected AND OLD.category = OLD.predicted_category, 0)
+            WHERE category = OLD.category;
+            DELETE FROM category_totals WHERE category = OLD.category AND count = 0;
+            UPDATE monthly_totals SET
+                total = total - OLD.amount,
+                count = count - 1
+            WHERE month = OLD.month;
+            DELETE FROM monthly_totals WHERE month = OLD.month AND count = 0;
+            INSERT INTO category_totals (category, total, count, predicted_correctly)
+            VALUES (NEW.category, NEW.amount, 1,
+                    COALESCE(NOT NEW.user_corrected AND NEW.category = NEW.predicted_category, 0))
+            ON CONFLICT (category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1,
+                predicted_correctly = predicted_correctly + excluded.predicted_correctly;
+            INSERT INTO monthly_totals (month, total, count)
+            VALUES (NEW.month, NEW.amount, 1)
+            ON CONFLICT (month) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+        END
+        ''',
+        _rebuild_analytics_rollups,
+    ]),
+    ('import dedup hash', [
+        # Hash of (date, amount, description) for statement imports, so
+        # re-importing an overlapping statement skips rows already present
+        'ALTER TABLE expenses ADD COLUMN import_hash TEXT',
+        'CREATE UNIQUE INDEX idx_expenses_import_hash ON expenses (import_hash) WHERE import_hash IS NOT NULL',
+    ]),
+    ('budget periods', [
+        "ALTER TABLE budgets ADD COLUMN period TEXT NOT NULL DEFAULT 'monthly' CHECK (period IN ('monthly', 'weekly'))",
+        'ALTER TABLE budgets ADD COLUMN rollover BOOLEAN NOT NULL DEFAULT FALSE',
+        # Spend per category per budget period (weeks start on Monday), kept
+        # current by triggers so budget status is one lookup per category
+        '''
+        CREATE TABLE period_totals (
+            category TEXT NOT NULL,
+            period TEXT NOT NULL,
+            period_start TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (category, period, period_start)
+        ) WITHOUT ROWID
+        ''',
+        f'''
+        CREATE TRIGGER expenses_period_insert AFTER INSERT ON expenses
+        BEGIN
+            {_PERIOD_TOTALS_ADD.format(row='NEW')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER expenses_period_delete AFTER DELETE ON expenses
+        BEGIN
+            {_PERIOD_TOTALS_SUBTRACT.format(row='OLD')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER expenses_period_update AFTER UPDATE OF amount, category, date ON expenses
+        BEGIN
+            {_PERIOD_TOTALS_SUBTRACT.format(row='OLD')}
+            {_PERIOD_TOTALS_ADD.format(row='NEW')}
+        END
+        ''',
+        _rebuild_period_totals,
+    ]),
+    ('data version', [
+        # Counters bumped by writes to expenses, so caches built from the
+        # table can tell, across workers, whether they are still current:
+        # version changes on every write, rewrites only on updates and
+        # deletes, which a cache cannot catch up on by reading new ids
+        '''
+        CREATE TABLE data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            rewrites INTEGER NOT NULL
+        )
+        ''',
+        'INSERT INTO data_version (id, version, rewrites) VALUES (1, 0, 0)',
+        '''
+        CREATE TRIGGER expenses_version_insert AFTER INSERT ON expenses
+        BEGIN
+            UPDATE data_version SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER expenses_version_update AFTER UPDATE ON expenses
+        BEGIN
+            UPDATE data_version SET version = version + 1, rewrites = rewrites + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER expenses_version_delete AFTER DELETE ON expenses
+        BEGIN
+            UPDATE data_version SET version = version + 1, rewrites = rewrites + 1;
+        END
+        ''',
+    ]),
+    ('response validators', [
+        # A random epoch makes ETags from a recreated database differ from
+        # ones handed out before, even at the same version
+        "ALTER TABLE data_version ADD COLUMN epoch TEXT NOT NULL DEFAULT ''",
+        'UPDATE data_version SET epoch = lower(hex(randomblob(8)))',
+        '''
+        CREATE TRIGGER budgets_version_insert AFTER INSERT ON budgets
+        BEGIN
+            UPDATE data_version SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER budgets_version_update AFTER UPDATE ON budgets
+        BEGIN
+            UPDATE data_version SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER budgets_version_delete AFTER DELETE ON budgets
+        BEGIN
+            UPDATE data_version SET version = version + 1;
+        END
+        ''',
+    ]),
+    ('description search', [
+        # preprocess_text(description), so searches can also match the
+        # standardized merchant terms; written by the app on insert
+        'ALTER TABLE expenses ADD COLUMN normalized_description TEXT',
+        _backfill_normalized_descriptions,
+        # External content: the index holds only terms and reads the text
+        # back from expenses; the prefix indexes serve short prefix queries
+        '''
+        CREATE VIRTUAL TABLE expenses_fts USING fts5(
+            description, normalized_description,
+            content='expenses', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        ''',
+        "INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')",
+        f'''
+        CREATE TRIGGER expenses_search_insert AFTER INSERT ON expenses
+        BEGIN
+            {_SEARCH_INDEX_ADD.format(row='NEW')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER expenses_search_delete AFTER DELETE ON expenses
+        BEGIN
+            {_SEARCH_INDEX_REMOVE.format(row='OLD')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER expenses_search_update AFTER UPDATE OF description, normalized_description ON expenses
+        BEGIN
+            {_SEARCH_INDEX_REMOVE.format(row='OLD')}
+            {_SEARCH_INDEX_ADD.format(row='NEW')}
+        END
+        ''',
+    ]),
+    ('merchant categories', [
+        # The category a user last gave each description, so a description
+        # seen before is categorized without the model
+        '''
+        CREATE TABLE merchant_categories (
+            normalized_description TEXT PRIMARY KEY,
+            category TEXT NOT NULL,
+            seq INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX idx_merchant_categories_seq ON merchant_categories (seq)',
+        # Latest correction of each description; SQLite takes the bare
+        # category column from the row holding MAX(id)
+        '''
+        INSERT INTO merchant_categories (normalized_description, category, seq)
+        SELECT normalized_description, category, ROW_NUMBER() OVER (ORDER BY last_id)
+        FROM (
+            SELECT normalized_description, category, MAX(id) AS last_id
+            FROM expenses
+            WHERE user_corrected = TRUE AND normalized_description <> ''
+            GROUP BY normalized_description
+        )
+        ''',
+        # Corrections on insert, and any category a user sets afterwards,
+        # including one that puts back the prediction
+        f'''
+        CREATE TRIGGER expenses_merchant_insert AFTER INSERT ON expenses
+        WHEN NEW.user_corrected AND NEW.normalized_description <> ''
+        BEGIN
+            {_MERCHANT_UPSERT.format(row='NEW')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER expenses_merchant_update AFTER UPDATE OF category ON expenses
+        WHEN NEW.category IS NOT OLD.category AND NEW.normalized_description <> ''
+        BEGIN
+            {_MERCHANT_UPSERT.format(row='NEW')}
+        END
+        ''',
+    ]),
+]
+
+def rebuild_rollups(conn):
+    """Repair the rollup tables by recomputing them in one transaction"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        cursor = conn.cursor()
+        _rebuild_analytics_rollups(cursor)
+        _rebuild_period_totals(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def check_rollups(conn):
+    """Compare the rollups against a full recompute; returns a list of mismatches"""
+    # (table, fixed columns, key columns, stored rows, recomputed rows); rows
+    # start with the key columns and are compared on them as a tuple
+    checks = [
+        ('category_totals', {}, ('category',),
+         'SELECT category, total, count, predicted_correctly FROM category_totals',
+         '''SELECT category, SUM(amount), COUNT(*),
+                  COALESCE(SUM(NOT user_corrected AND category = predicted_category), 0)
+           FROM expenses GROUP BY category'''),
+        ('monthly_totals', {}, ('month',),
+         'SELECT month, total, count FROM monthly_totals',
+         'SELECT month, SUM(amount), COUNT(*) FROM expenses GROUP BY month'),
+    ]
+    for period, start_sql in PERIOD_START_SQL.items():
+        checks.append(
+            ('period_totals', {'period': period}, ('category', 'period_start'),
+             f"SELECT category, period_start, total, count FROM period_totals WHERE period = '{period}'",
+             f"SELECT category, {start_sql.format(date='date')}, SUM(amount), COUNT(*) FROM expenses GROUP BY 1, 2"))
+    mismatches = []
+    for table, fixed, key_columns, stored_sql, expected_sql in checks:
+        size = len(key_columns)
+        stored = {row[:size]: row[size:] for row in conn.execute(stored_sql)}
+        expected = {row[:size]: row[size:] for row in conn.execute(expected_sql)}
+        for key in sorted(set(stored) | set(expected), key=str):
+            have, want = stored.get(key), expected.get(key)
+            # Totals are maintained by repeated float additions; allow rounding noise
+            if have is None or want is None or abs(have[0] - want[0]) > 1e-6 or have[1:] != want[1:]:
+                mismatches.append({'table': table, **fixed, **dict(zip(key_columns, key)),
+                                   'stored': have, 'expected': want})
+    return mismatches
+
+def migrate_db(conn):
+    """Apply any pending migrations; returns the resulting schema version"""
+    # BEGIN IMMEDIATE takes the write lock up front, so concurrent workers
+    # starting at the same time migrate one after another
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        cursor = conn.cursor()
+        for description, steps in MIGRATIONS[version:]:
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            version += 1
+            cursor.execute(f'PRAGMA user_version = {version}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return version
+
+def init_db():
+    """Initialize the database, creating or upgrading its schema"""
+    conn = connect_db()
+    migrate_db(conn)
     conn.close()
 
+# Common replacements to standardize terms - much more comprehensive
+MERCHANT_REPLACEMENTS = {
+    # Food related
+    'mcdonalds': 'fast food restaurant', 'mcdonald': 'fast food restaurant',
+    'kfc': 'fast food restaurant', 'burger king': 'fast food restaurant',
+    'taco bell': 'fast food restaurant', 'chipotle': 'fast food restaurant',
+    'subway sandwich': 'fast food restaurant', 'pizza hut': 'pizza restaurant',
+    'dominos': 'pizza restaurant', 'domino': 'pizza restaurant',
+    'starbucks': 'coffee shop', 'dunkin': 'coffee shop', 'tim hortons': 'coffee shop',
+    'walmart grocery': 'grocery store', 'target grocery': 'grocery store',
+    'whole foods': 'grocery store', 'trader joe': 'grocery store', 'trader joes': 'grocery store',
+    'kroger': 'grocery store', 'safeway': 'grocery store',
+    'restaurant': 'restaurant meal', 'bar': 'bar drinks',
+    
+    # Transport related
+    'uber': 'rideshare transport', 'lyft': 'rideshare transport',
+    'taxi': 'taxi transport', 'cab': 'taxi transport',
+    'shell': 'gas station fuel', 'bp': 'gas station fuel',
+    'exxon': 'gas station fuel', 'chevron': 'gas station fuel',
+    'parking': 'parking fee', 'metro': 'public transport',
+    'subway card': 'public transport', 'bus': 'public transport',
+    'flight': 'airline transport', 'airline': 'airline transport',
+    
+    # Shopping related
+    'amazon': 'online shopping', 'ebay': 'online shopping',
+    'target shopping': 'retail shopping', 'walmart shopping': 'retail shopping',
+    'best buy': 'electronics shopping', 'apple store': 'electronics shopping',
+    'home depot': 'hardware shopping', 'lowes': 'hardware shopping',
+    'cvs': 'pharmacy shopping', 'walgreens': 'pharmacy shopping',
+    'costco': 'wholesale shopping', 'ikea': 'furniture shopping',
+    
+    # Entertainment related
+    'netflix': 'streaming entertainment', 'hulu': 'streaming entertainment',
+    'disney plus': 'streaming entertainment', 'spotify': 'music streaming',
+    'youtube premium': 'streaming entertainment', 'movie': 'movie entertainment',
+    'cinema': 'movie entertainment', 'concert': 'music entertainment',
+    'gym': 'fitness entertainment', 'gaming': 'video game entertainment',
+    
+    # Bills related
+    'electric': 'electricity bill', 'internet': 'internet bill',
+    'wifi': 'internet bill', 'phone': 'phone bill', 'cell': 'phone bill',
+    'rent': 'rent payment', 'mortgage': 'mortgage payment',
+    'insurance': 'insurance payment', 'utility': 'utility bill',
+    
+    # Healthcare related
+    'doctor': 'medical healthcare', 'physician': 'medical healthcare',
+    'hospital': 'medical healthcare', 'pharmacy': 'prescription healthcare',
+    'dental': 'dental healthcare', 'dentist': 'dental healthcare',
+    'medical': 'medical healthcare', 'health': 'medical healthcare'
+}
+
+# Built once at import time. Longer keys come first in the alternation so the
+# longest term wins ('trader joes' over 'trader joe'), and the word boundaries
+# stop keys from matching inside other words ('cab' in 'cable', 'bar' in
+# 'barnes'). Each match is rewritten exactly once, so replacement values are
+# never substituted again ('bar' inside 'bar drinks').
+_MERCHANT_PATTERN = re.compile(
+    r'\b(?:' + '|'.join(
+        re.escape(key) for key in sorted(MERCHANT_REPLACEMENTS, key=len, reverse=True)
+    ) + r')\b'
+)
+_NON_ALPHANUMERIC = re.compile(r'[^a-zA-Z0-9\s]')
+
+def _replace_merchant(match):
+    return MERCHANT_REPLACEMENTS[match.group(0)]
+
+def preprocess_text(text):
+    """Lowercase, drop punctuation and standardize merchant names and common terms"""
+    if not text:
+        return ""
+    
+    # Convert to lowercase
+    text = text.lower().strip()
+    
+    # Remove special characters but keep spaces
+    text = _NON_ALPHANUMERIC.sub(' ', text)
+    
+    # Remove extra whitespaces
+    text = ' '.join(text.split())
+    
+    # Standardize merchant names and common terms in a single pass
+    return _MERCHANT_PATTERN.sub(_replace_merchant, text)
+
+class PredictionCache:
+    """Bounded LRU cache of class probabilities keyed on preprocessed text.
+    
+    Entries belong to one model version; the first lookup with a newer
+    version drops everything cached for the old model.
+    """
+    
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _check_version(self, version):
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+    
+    def get(self, key, version):
+        with self._lock:
+            self._check_version(version)
+            probabilities = self._entries.get(key)
+            if probabilities is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return probabilities
+    
+    def put(self, key, version, probabilities):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            # A result computed by a model that has since been replaced is dropped
+            if version != self._version:
+                return
+            self._entries[key] = probabilities
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'model_version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+class MerchantIndex:
+    """Category of every description a user has corrected, by its preprocessed text.
+    
+    An in-memory copy of the merchant_categories table, which triggers keep
+    current from the expenses table. The first sync loads it in one pass;
+    later ones read only the entries changed since, found by their
+    increasing seq, so corrections made by any process show up here. A
+    plain dict keeps lookups O(1); category names are interned, so each
+    entry costs its key and a pointer.
+    """
+    
+    def __init__(self, sync_interval=1.0):
+        # Seconds between syncs that are not forced; None syncs only when forced
+        self.sync_interval = sync_interval
+        self.hits = 0
+        self.misses = 0
+        self._categories = {}
+        self._seq = 0
+        self._epoch = None
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._categories)
+    
+    def lookup(self, keys):
+        """Learned category for each preprocessed description, None where there is none"""
+        categories = [self._categories.get(key) for key in keys]
+        found = len(categories) - categories.count(None)
+        with self._lock:
+            self.hits += found
+            self.misses += len(categories) - found
+        return categories
+    
+    def sync(self, conn, force=False):
+        """Read the entries changed since the last sync; skipped until sync_interval has passed unless forced"""
+        now = time.monotonic()
+        if not force and self._epoch is not None and (self.sync_interval is None or now < self._next_sync):
+            return
+        with self._lock:
+            self._next_sync = now + (self.sync_interval or 0.0)
+            epoch = conn.execute('SELECT epoch FROM data_version').fetchone()[0]
+            if epoch == self._epoch:
+                categories, seq = self._categories, self._seq
+                rows = conn.execute('''
+                    SELECT normalized_description, category, seq FROM merchant_categories
+                    WHERE seq > ?
+                    ORDER BY seq
+                ''', (seq,))
+                for key, category, seq in rows:
+                    categories[key] = sys.intern(category)
+            else:
+                # A different or recreated database: load a new dict in one
+                # scan in key order, and swap it in once complete. Entries
+                # written after MAX(seq) is read are read again next sync.
+                seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM merchant_categories').fetchone()[0]
+                rows = conn.execute('SELECT normalized_description, category FROM merchant_categories')
+                categories = {key: sys.intern(category) for key, category in rows}
+            self._categories, self._seq, self._epoch = categories, seq, epoch
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._categories),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+def build_pipeline(spec):
+    """Create the unfitted TF-IDF + linear classifier pipeline a spec describes.
+    
+    A spec is a dict like ExpenseCategorizer.default_pipeline; every such
+    pipeline can be exported as a compact artifact.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.pipeline import Pipeline
+    
+    classifiers = {'logistic_regression': LogisticRegression, 'multinomial_nb': MultinomialNB}
+    vectorizer = dict(spec['vectorizer'], ngram_range=tuple(spec['vectorizer']['ngram_range']))
+    return Pipeline([
+        ('tfidf', TfidfVectorizer(**vectorizer)),
+        ('classifier', classifiers[spec['classifier']](**spec['classifier_params']))
+    ])
+
+# Everything a prediction needs from one model, replaced as a unit
+ModelSnapshot = namedtuple('ModelSnapshot', ['model', 'version', 'trained_at'])
+
 class ExpenseCategorizer:
-    def __init__(self):
-        self.model = None
+    """Categorizer safe to share between request threads.
+    
+    Predictions read self._snapshot once and never take a lock. Anything
+    that replaces the model (training, loading, reloading) holds
+    _train_lock, so at most one of them runs at a time.
+    """
+    
+    # Predictions less confident than this are answered as 'Other'
+    min_confidence = 0.3
+    
+    # What train_model fits until evaluate_models.py promotes something else;
+    # the spec is saved with every model, so retrains keep the promoted one
+    default_pipeline = {
+        'vectorizer': {
+            'max_features': 2000,
+            'lowercase': True,
+            'ngram_range': [1, 2],  # Use both unigrams and bigrams
+            'stop_words': 'english',
+            'min_df': 1,
+            'max_df': 0.95
+        },
+        'classifier': 'logistic_regression',
+        'classifier_params': {
+            'random_state': 42,
+            'max_iter': 1000,
+            'C': 1.0,
+            'class_weight': 'balanced'  # Handle class imbalance
+        }
+    }
+    
+    def __init__(self, cache_size=10000, reload_interval=1.0):
+        self._snapshot = ModelSnapshot(None, 0, None)
+        self._train_lock = threading.RLock()
+        # Seconds between checks for a model published by another process;
+        # None never checks, 0 checks before every prediction
+        self.reload_interval = reload_interval
+        self._loaded_stamp = None
+        self._next_reload_check = 0.0
+        self.cache = PredictionCache(cache_size)
+        # Descriptions users have corrected, answered without the model;
+        # synced from the database by the app
+        self.merchants = MerchantIndex(reload_interval)
+        self.training_seconds = None
         self.categories = ['Food', 'Transport', 'Entertainment', 'Shopping', 'Bills', 'Healthcare', 'Other']
-        self.model_path = 'models/expense_model.pkl'
+        # Directory of versioned compact artifacts (see compact_model.py)
+        self.model_path = 'models/expense_model'
+    
+    @property
+    def model(self):
+        return self._snapshot.model
+    
+    @property
+    def model_version(self):
+        return self._snapshot.version
+    
+    @property
+    def trained_at(self):
+        return self._snapshot.trained_at
         
     def preprocess_text(self, text):
         """Enhanced text preprocessing"""
-        if not text:
-            return ""
-            
-        # Convert to lowercase
-        text = text.lower().strip()
-        
-        # Remove special characters but keep spaces
-        text = re.sub(r'[^a-zA-Z0-9\s]', ' ', text)
-        
-        # Remove extra whitespaces
-        text = re.sub(r'\s+', ' ', text).strip()
-        
-        # Common replacements to standardize terms - much more comprehensive
-        replacements = {
-            # Food related
-            'mcdonalds': 'fast food restaurant', 'mcdonald': 'fast food restaurant',
-            'kfc': 'fast food restaurant', 'burger king': 'fast food restaurant',
-            'taco bell': 'fast food restaurant', 'chipotle': 'fast food restaurant',
-            'subway sandwich': 'fast food restaurant', 'pizza hut': 'pizza restaurant',
-            'dominos': 'pizza restaurant', 'domino': 'pizza restaurant',
-            'starbucks': 'coffee shop', 'dunkin': 'coffee shop', 'tim hortons': 'coffee shop',
-            'walmart grocery': 'grocery store', 'target grocery': 'grocery store',
-            'whole foods': 'grocery store', 'trader joe': 'grocery store',
-            'kroger': 'grocery store', 'safeway': 'grocery store',
-            'restaurant': 'restaurant meal', 'bar': 'bar drinks',
-            
-            # Transport related
-            'uber': 'rideshare transport', 'lyft': 'rideshare transport',
-            'taxi': 'taxi transport', 'cab': 'taxi transport',
-            'shell': 'gas station fuel', 'bp': 'gas station fuel',
-            'exxon': 'gas station fuel', 'chevron': 'gas station fuel',
-            'parking': 'parking fee', 'metro': 'public transport',
-            'subway card': 'public transport', 'bus': 'public transport',
-            'flight': 'airline transport', 'airline': 'airline transport',
-            
-            # Shopping related
-            'amazon': 'online shopping', 'ebay': 'online shopping',
-            'target shopping': 'retail shopping', 'walmart shopping': 'retail shopping',
-            'best buy': 'electronics shopping', 'apple store': 'electronics shopping',
-            'home depot': 'hardware shopping', 'lowes': 'hardware shopping',
-            'cvs': 'pharmacy shopping', 'walgreens': 'pharmacy shopping',
-            'costco': 'wholesale shopping', 'ikea': 'furniture shopping',
-            
-            # Entertainment related
-            'netflix': 'streaming entertainment', 'hulu': 'streaming entertainment',
-            'disney plus': 'streaming entertainment', 'spotify': 'music streaming',
-            'youtube premium': 'streaming entertainment', 'movie': 'movie entertainment',
-            'cinema': 'movie entertainment', 'concert': 'music entertainment',
-            'gym': 'fitness entertainment', 'gaming': 'video game entertainment',
-            
-            # Bills related
-            'electric': 'electricity bill', 'internet': 'internet bill',
-            'wifi': 'internet bill', 'phone': 'phone bill', 'cell': 'phone bill',
-            'rent': 'rent payment', 'mortgage': 'mortgage payment',
-            'insurance': 'insurance payment', 'utility': 'utility bill',
-            
-            # Healthcare related
-            'doctor': 'medical healthcare', 'physician': 'medical healthcare',
-            'hospital': 'medical healthcare', 'pharmacy': 'prescription healthcare',
-            'dental': 'dental healthcare', 'dentist': 'dental healthcare',
-            'medical': 'medical healthcare', 'health': 'medical healthcare'
-        }
-        
-        for key, value in replacements.items():
-            if key in text:
-                text = text.replace(key, value)
-                
-        return text
+        return preprocess_text(text)
         
     def prepare_initial_data(self):
         """Create comprehensive initial training data"""
@@ -229,8 +1194,11 @@ class ExpenseCategorizer:
         ]
         return training_data
     
-    def train_model(self, additional_data=None):
-        """Train the categorization model with improved features"""
+    def train_model(self, additional_data=None, spec=None):
+        """Train the categorization model with improved features.
+        
+        spec is the pipeline configuration to fit, by default pipeline_spec().
+        """
         # Get initial training data
         training_data = self.prepare_initial_data()
         
@@ -242,93 +1210,847 @@ class ExpenseCategorizer:
         descriptions = [self.preprocess_text(item[0]) for item in training_data]
         categories = [item[1] for item in training_data]
         
-        # Create and train the model with better parameters
-        self.model = Pipeline([
-            ('tfidf', TfidfVectorizer(
-                max_features=2000,
-                lowercase=True,
-                ngram_range=(1, 2),  # Use both unigrams and bigrams
+        with self._train_lock:
+            started = time.perf_counter()
+            
+            # Create and train the model with better parameters
+            with PhaseTimer('train'):
+                model = self._build_pipeline(spec)
+                model.fit(descriptions, categories)
+            
+            # Save the model, getting back the form used for predictions
+            with PhaseTimer('save'):
+                model = self._save_model(model, training_rows=len(training_data), pipeline_spec=spec)
+            
+            # Swap in the fitted model with a single assignment so in-flight
+            # predictions never see a half-trained pipeline
+            self._install_model(model, datetime.now())
+            self.training_seconds = time.perf_counter() - started
+    
+    def _save_model(self, model, pipeline_spec=None, **meta):
+        """Publish a fitted pipeline as a new compact artifact version and map it"""
+        # Record the configuration it was built from, for the next retrain
+        compact_model.save_artifact(model, self.model_path, pipeline_spec=pipeline_spec or self.pipeline_spec(), **meta)
+        # What gets mapped is at least as new as the stamp, as in load_model
+        self._loaded_stamp = self._model_stamp()
+        return compact_model.load_artifact(self.model_path)
+    
+    def _read_model(self):
+        """Load the published model as (model, trained_at), or None if there is none"""
+        model = compact_model.load_artifact(self.model_path)
+        if model is None:
+            # Convert a pickled pipeline left by an older release, once
+            legacy_path = self.model_path + '.pkl'
+            if not os.path.exists(legacy_path):
+                return None
+            with open(legacy_path, 'rb') as f:
+                model = self._save_model(pickle.load(f))
+        return model, model.trained_at
+    
+    def _install_model(self, model, trained_at):
+        """Make a fitted model the one used for predictions; call with _train_lock held"""
+        self._snapshot = ModelSnapshot(model, self._snapshot.version + 1, trained_at)
+    
+    def pipeline_spec(self):
+        """Configuration of the model to train: the published model's, else default_pipeline"""
+        model = self.model or compact_model.load_artifact(self.model_path)
+        return (getattr(model, 'meta', None) or {}).get('pipeline_spec', self.default_pipeline)
+    
+    def _build_pipeline(self, spec=None):
+        """Create the unfitted pipeline to train, from spec or else pipeline_spec()"""
+        return build_pipeline(spec or self.pipeline_spec())
+    
+    def learn_corrections(self, corrections):
+        """Take (description, category) corrections into account.
+        
+        Returns True when a full retrain is needed for them to take effect.
+        """
+        return bool(corrections)
+    
+    def _stamp_path(self):
+        """File that changes identity whenever a new model is published"""
+        return os.path.join(self.model_path, compact_model.POINTER_FILE)
+    
+    def _model_stamp(self):
+        # Publishing replaces the file, so (inode, mtime) changes with every version
+        try:
+            stat = os.stat(self._stamp_path())
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+    
+    def load_model(self):
+        """Load the trained model"""
+        with self._train_lock:
+            # Stamp first: a version published while loading is picked up next check
+            self._loaded_stamp = self._model_stamp()
+            with PhaseTimer('load'):
+                loaded = self._read_model()
+            if loaded is None:
+                return False
+            self._install_model(*loaded)
+            return True
+    
+    def _ensure_model(self):
+        """Load the saved model, training one first if none exists.
+        
+        Also picks up models published by other worker processes, checking
+        at most once every reload_interval seconds with a single stat call.
+        """
+        if self._snapshot.model is None:
+            with self._train_lock:
+                # Concurrent first requests queue here; only the first loads or trains
+                if self._snapshot.model is None and not self.load_model():
+                    self.train_model()
+        elif self.reload_interval is not None:
+            now = time.monotonic()
+            if now < self._next_reload_check:
+                return
+            self._next_reload_check = now + self.reload_interval
+            # If a retrain or reload is already running, keep predicting with
+            # the current model rather than wait; the next check retries
+            if self._model_stamp() != self._loaded_stamp and self._train_lock.acquire(blocking=False):
+                try:
+                    self.load_model()
+                except Exception:
+                    self._loaded_stamp = None
+                    app.logger.exception('Reloading the published model failed')
+                finally:
+                    self._train_lock.release()
+    
+    def predict_category(self, description):
+        """Predict category for a given description with improved accuracy"""
+        return self.predict_categories([description])[0]
+    
+    def predict_categories(self, descriptions):
+        """Predict categories for many descriptions with one vectorized call"""
+        return [(category, confidence) for category, confidence, _ in self.predict_with_source(descriptions)]
+    
+    def predict_with_source(self, descriptions):
+        """Predict (category, confidence, source) for many descriptions.
+        
+        source is 'merchant' for a description a user has corrected before,
+        answered from self.merchants with confidence 1.0, and 'model' for
+        the rest, which go through the model in one vectorized call.
+        """
+        if not descriptions:
+            return []
+        
+        with PhaseTimer('preprocess'):
+            processed_descriptions = [self.preprocess_text(description) for description in descriptions]
+        
+        predictions = [
+            None if category is None else (category, 1.0, 'merchant')
+            for category in self.merchants.lookup(processed_descriptions)
+        ]
+        missing = [index for index, prediction in enumerate(predictions) if prediction is None]
+        if not missing:
+            return predictions
+        
+        classes, probabilities = self._predict_proba([processed_descriptions[index] for index in missing])
+        best = probabilities.argmax(axis=1)
+        confidences = probabilities[np.arange(len(best)), best]
+        labels = classes[best]
+        
+        # If confidence is too low, suggest 'Other' category
+        for index, label, confidence in zip(missing, labels, confidences):
+            predictions[index] = ('Other' if confidence < self.min_confidence else str(label), float(confidence), 'model')
+        return predictions
+    
+    def predict_top_k(self, description, top_k=3):
+        """Predict a category along with the top-k ranked alternatives"""
+        with PhaseTimer('preprocess'):
+            processed_description = self.preprocess_text(description)
+        
+        # A corrected description has a single answer
+        category, = self.merchants.lookup([processed_description])
+        if category is not None:
+            return {
+                'category': category,
+                'confidence': 1.0,
+                'source': 'merchant',
+                'alternatives': [{'category': category, 'probability': 1.0}]
+            }
+        
+        classes, probabilities = self._predict_proba([processed_description])
+        probabilities = probabilities[0]
+        ranked = np.argsort(probabilities)[::-1][:max(1, top_k)]
+        confidence = float(probabilities[ranked[0]])
+        
+        return {
+            'category': 'Other' if confidence < self.min_confidence else str(classes[ranked[0]]),
+            'confidence': confidence,
+            'source': 'model',
+            'alternatives': [
+                {'category': str(classes[index]), 'probability': float(probabilities[index])}
+                for index in ranked
+            ]
+        }
+    
+    def _predict_proba(self, processed_descriptions):
+        """Class probabilities for preprocessed descriptions, using the cache where possible"""
+        self._ensure_model()
+        
+        # One read of the snapshot: the model and the version its results
+        # are cached under always belong together
+        model, version, _ = self._snapshot
+        
+        probabilities = np.empty((len(processed_descriptions), len(model.classes_)))
+        missing = []
+        for index, text in enumerate(processed_descriptions):
+            cached = self.cache.get(text, version)
+            if cached is None:
+                missing.append(index)
+            else:
+                probabilities[index] = cached
+        
+        # One transform and one decision function over the whole TF-IDF matrix
+        # for everything not cached; label and confidence both come from these rows
+        if missing:
+            with PhaseTimer('vectorize'):
+                features = self._vectorize(model, [processed_descriptions[index] for index in missing])
+            with PhaseTimer('classify'):
+                computed = self._classify(model, features)
+            for index, row in zip(missing, computed):
+                probabilities[index] = row
+                self.cache.put(processed_descriptions[index], version, row.copy())
+        
+        return model.classes_, probabilities
+    
+    def _vectorize(self, model, texts):
+        """Feature matrix of preprocessed texts"""
+        return model.transform(texts)
+    
+    def _classify(self, model, features):
+        """Class probabilities for a feature matrix from _vectorize"""
+        return model.predict_proba_transformed(features)
+
+class OnlineExpenseCategorizer(ExpenseCategorizer):
+    """Categorizer that learns each correction incrementally.
+    
+    A stateless HashingVectorizer feeds an SGDClassifier, so a correction is
+    a single partial_fit step whose cost does not depend on how many
+    corrections came before. A full refit from the database every
+    refit_every corrections keeps accuracy from drifting.
+    
+    Updated models are published at most once every save_delay seconds,
+    so other workers pick them up on their next reload check; None keeps
+    them in this process until the next refit.
+    """
+    
+    # Corrections are rare compared to the seed data; weight them up so one
+    # correction visibly moves the decision boundary
+    correction_weight = 5.0
+    
+    def __init__(self, refit_every=1000, cache_size=10000, reload_interval=1.0, save_delay=None):
+        super().__init__(cache_size, reload_interval)
+        self.model_path = 'models/expense_model_online.pkl'
+        self.refit_every = refit_every
+        self.corrections_since_refit = 0
+        self.save_delay = save_delay
+        # Set while the installed model has updates that are not published yet
+        self._unsaved = False
+        self._save_timer = None
+    
+    def _build_pipeline(self, spec=None):
+        """Create the unfitted hashing + SGD pipeline; specs describe TF-IDF models and don't apply"""
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.linear_model import SGDClassifier
+        from sklearn.pipeline import Pipeline
+        
+        return Pipeline([
+            ('hashing', HashingVectorizer(
+                n_features=2 ** 16,
+                ngram_range=(1, 2),
                 stop_words='english',
-                min_df=1,
-                max_df=0.95
+                alternate_sign=False
             )),
-            ('classifier', LogisticRegression(
-                random_state=42,
+            ('classifier', SGDClassifier(
+                loss='log_loss',  # Needed for predict_proba
+                alpha=1e-4,
                 max_iter=1000,
-                C=1.0,
-                class_weight='balanced'  # Handle class imbalance
+                tol=None,
+                random_state=42
             ))
         ])
-        
-        self.model.fit(descriptions, categories)
-        
-        # Save the model
-        os.makedirs('models', exist_ok=True)
-        with open(self.model_path, 'wb') as f:
-            pickle.dump(self.model, f)
     
-    def load_model(self):
-        """Load the trained model"""
+    def train_model(self, additional_data=None):
+        """Fully refit the model from the seed data plus all corrections"""
+        with self._train_lock:
+            super().train_model(additional_data)
+            self.corrections_since_refit = 0
+    
+    # partial_fit needs the scikit-learn estimator, so this mode keeps a pickle
+    def _save_model(self, model, **meta):
+        # Write then rename, so readers never load a half-written pickle
+        directory = os.path.dirname(self.model_path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(prefix='.' + os.path.basename(self.model_path), dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(model, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, self.model_path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        # Don't reload what was just written
+        self._loaded_stamp = self._model_stamp()
+        self._unsaved = False
+        return model
+    
+    def save_pending(self):
+        """Publish the installed model if it has updates that are not published yet"""
+        with self._train_lock:
+            self._save_timer = None
+            if self._unsaved:
+                self._save_model(self.model)
+    
+    def _schedule_save(self):
+        """Publish the updated model after save_delay; call with _train_lock held"""
+        self._unsaved = True
+        if self.save_delay is not None and self._save_timer is None:
+            # Updates arriving in the meantime go out with the same save
+            self._save_timer = threading.Timer(self.save_delay, self._save_in_background)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+    
+    def _save_in_background(self):
+        try:
+            self.save_pending()
+        except Exception:
+            app.logger.exception('Publishing the online model failed')
+    
+    def _stamp_path(self):
+        return self.model_path
+    
+    def _vectorize(self, model, texts):
+        return model.named_steps['hashing'].transform(texts)
+    
+    def _classify(self, model, features):
+        return model.named_steps['classifier'].predict_proba(features)
+    
+    def _read_model(self):
         try:
             with open(self.model_path, 'rb') as f:
-                self.model = pickle.load(f)
-            return True
+                model = pickle.load(f)
         except FileNotFoundError:
-            return False
+            return None
+        return model, datetime.fromtimestamp(os.path.getmtime(self.model_path))
     
-    def predict_category(self, description):
-        """Predict category for a given description with improved accuracy"""
-        if self.model is None:
-            if not self.load_model():
-                self.train_model()
+    def learn_corrections(self, corrections):
+        """Apply corrections with one partial_fit step.
         
-        # Preprocess the input
-        processed_description = self.preprocess_text(description)
+        Returns True once enough corrections have accumulated for a full refit.
+        """
+        if not corrections:
+            return False
+        self._ensure_model()
         
-        # Make prediction
-        prediction = self.model.predict([processed_description])[0]
-        probabilities = self.model.predict_proba([processed_description])[0]
-        confidence = max(probabilities)
+        descriptions = [self.preprocess_text(description) for description, _ in corrections]
+        categories = [category for _, category in corrections]
         
-        # If confidence is too low, suggest 'Other' category
-        if confidence < 0.3:
-            return 'Other', confidence
+        from sklearn.pipeline import Pipeline
         
-        return prediction, confidence
+        # Shares the trainer lock: an update racing a refit would otherwise
+        # be applied to the old model and overwrite the refit
+        with self._train_lock:
+            model = self.model
+            # Update a copy so in-flight predictions keep a consistent model.
+            # partial_fit only writes the weights in place, so only they are
+            # copied; everything else is shared with the installed classifier
+            classifier = copy.copy(model.named_steps['classifier'])
+            classifier.coef_ = classifier._standard_coef = classifier.coef_.copy()
+            classifier.intercept_ = classifier._standard_intercept = classifier.intercept_.copy()
+            classifier.set_params(learning_rate='constant', eta0=0.5)
+            with PhaseTimer('partial_fit'):
+                classifier.partial_fit(
+                    model.named_steps['hashing'].transform(descriptions),
+                    categories,
+                    sample_weight=[self.correction_weight] * len(corrections)
+                )
+            self._install_model(
+                Pipeline([('hashing', model.named_steps['hashing']), ('classifier', classifier)]),
+                datetime.now()
+            )
+            self._schedule_save()
+            self.corrections_since_refit += len(corrections)
+            return self.corrections_since_refit >= self.refit_every
+
+# 'batch' retrains from scratch on corrections, 'online' learns them incrementally
+CATEGORIZER_MODE = os.environ.get('CATEGORIZER_MODE', 'batch')
+ONLINE_REFIT_EVERY = int(os.environ.get('ONLINE_REFIT_EVERY', 1000))
+# Upper bound on how long other workers wait for an online correction
+ONLINE_SAVE_SECONDS = float(os.environ.get('ONLINE_SAVE_SECONDS', 1.0))
+# Maximum number of cached predictions; 0 disables the cache
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 10000))
+# Upper bound on how stale a worker's model can be after another worker retrains
+MODEL_RELOAD_SECONDS = float(os.environ.get('MODEL_RELOAD_SECONDS', 1.0))
 
 # Initialize categorizer
-categorizer = ExpenseCategorizer()
+if CATEGORIZER_MODE == 'online':
+    categorizer = OnlineExpenseCategorizer(refit_every=ONLINE_REFIT_EVERY, cache_size=PREDICTION_CACHE_SIZE,
+                                           reload_interval=MODEL_RELOAD_SECONDS, save_delay=ONLINE_SAVE_SECONDS)
+else:
+    categorizer = ExpenseCategorizer(cache_size=PREDICTION_CACHE_SIZE, reload_interval=MODEL_RELOAD_SECONDS)
+
+def sync_merchants(conn, force=False):
+    """Catch the categorizer's merchant index up with corrections from any process.
+    
+    Unforced calls read the database at most once per reload interval;
+    force after committing corrections, so the next prediction uses them.
+    """
+    categorizer.merchants.sync(conn, force)
+
+def data_version(conn):
+    """(version, rewrites, epoch); version changes on every write to expenses or budgets"""
+    return conn.execute('SELECT version, rewrites, epoch FROM data_version').fetchone()
+
+# Serialized bodies of cached GET responses kept per process; 0 disables
+# the cache and the ETags
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 256))
+# Smaller bodies are sent uncompressed; the headers would eat the savings
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESSIBLE_TYPES = {'application/json', 'application/x-ndjson', 'text/html', 'text/csv', 'text/plain'}
+
+# Supported Content-Encodings, most preferred first
+CONTENT_ENCODERS = {'gzip': lambda body: gzip.compress(body, compresslevel=6)}
+if brotli is not None:
+    CONTENT_ENCODERS = {'br': lambda body: brotli.compress(body, quality=5), **CONTENT_ENCODERS}
+
+RESPONSE_CACHE_RESULTS = registry.counter(
+    'expense_tracker_response_cache_total', 'Cached GET responses by outcome', ('result',))
+
+CachedResponse = namedtuple('CachedResponse', ['tag', 'status', 'headers', 'bodies'])
+
+# (database, path with query string) -> CachedResponse, least recently used first
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+def _content_encoding(size):
+    """The encoding to send a body of this size in, or None for identity"""
+    if size < COMPRESS_MIN_BYTES:
+        return None
+    return request.accept_encodings.best_match(list(CONTENT_ENCODERS))
+
+def cached_response(by_day=False):
+    """Serve a GET endpoint with an ETag derived from the data version.
+    
+    A matching If-None-Match gets a bodiless 304 without running the view,
+    and the serialized (and compressed) body is reused until the next
+    write. by_day is for endpoints whose default output depends on today.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not RESPONSE_CACHE_SIZE:
+                return view(*args, **kwargs)
+            
+            # Read before the view runs, so a write racing it can only make the
+            # cached body look older than it is
+            conn = get_db()
+            version, _, epoch = data_version(conn)
+            tag = f'{epoch}-{version}'
+            if by_day:
+                tag += '-' + conn.execute("SELECT date('now')").fetchone()[0]
+            
+            if request.if_none_match.contains_weak(tag):
+                RESPONSE_CACHE_RESULTS.inc('not_modified')
+                response = app.response_class(status=304)
+            else:
+                key = (DATABASE, request.full_path)
+                with _response_cache_lock:
+                    cached = _response_cache.get(key)
+                    if cached is not None and cached.tag == tag:
+                        _response_cache.move_to_end(key)
+                RESPONSE_CACHE_RESULTS.inc('hit' if cached is not None and cached.tag == tag else 'miss')
+                
+                if cached is None or cached.tag != tag:
+                    response = app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    headers = [(name, value) for name, value in response.headers if name != 'Content-Length']
+                    cached = CachedResponse(tag, response.status_code, headers, {None: response.get_data()})
+                    with _response_cache_lock:
+                        _response_cache[key] = cached
+                        _response_cache.move_to_end(key)
+                        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+                            _response_cache.popitem(last=False)
+                
+                # Each encoding is compressed once per version, on first request
+                encoding = _content_encoding(len(cached.bodies[None]))
+                body = cached.bodies.get(encoding)
+                if body is None:
+                    body = cached.bodies[encoding] = CONTENT_ENCODERS[encoding](cached.bodies[None])
+                response = app.response_class(body, status=cached.status, headers=cached.headers)
+                if encoding:
+                    response.headers['Content-Encoding'] = encoding
+            
+            response.set_etag(tag, weak=True)
+            # Browsers may keep the body but must revalidate it on every use
+            response.headers['Cache-Control'] = 'no-cache'
+            response.vary.add('Accept-Encoding')
+            return response
+        return wrapper
+    return decorator
+
+@app.after_request
+def compress_response(response):
+    """Compress large bodies the client accepts compressed, unless already encoded"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    encoding = _content_encoding(len(body))
+    if encoding:
+        response.set_data(CONTENT_ENCODERS[encoding](body))
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+# Fields a client may select with ?fields= on GET /api/expenses
+EXPENSE_FIELDS = ('id', 'description', 'amount', 'category', 'predicted_category', 'date', 'user_corrected')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(date, expense_id):
+    """Opaque keyset cursor pointing just past the given row"""
+    return base64.urlsafe_b64encode(json.dumps([date, expense_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        date, expense_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError('Invalid cursor')
+    if not isinstance(expense_id, int):
+        raise ValueError('Invalid cursor')
+    return date, expense_id
+
+def _parse_expense_fields(args):
+    """Columns selected with ?fields=, all of EXPENSE_FIELDS by default"""
+    fields = args.get('fields')
+    fields = [field.strip() for field in fields.split(',')] if fields else list(EXPENSE_FIELDS)
+    if not fields or any(field not in EXPENSE_FIELDS for field in fields):
+        raise ValueError(f"fields must be a subset of {', '.join(EXPENSE_FIELDS)}")
+    return fields
+
+def _parse_expense_filters(args):
+    """Translate query parameters into SQL conditions for the expenses listing"""
+    conditions = []
+    params = []
+    
+    if args.get('category'):
+        conditions.append('category = ?')
+        params.append(args['category'])
+    
+    # date_from and date_to are inclusive calendar days (YYYY-MM-DD)
+    for name, condition in (('date_from', 'date >= ?'), ('date_to', "date < date(?, '+1 day')")):
+        if args.get(name):
+            datetime.strptime(args[name], '%Y-%m-%d')
+            conditions.append(condition)
+            params.append(args[name])
+    
+    for name, condition in (('min_amount', 'amount >= ?'), ('max_amount', 'amount <= ?')):
+        if args.get(name):
+            conditions.append(condition)
+            params.append(float(args[name]))
+    
+    if args.get('user_corrected'):
+        value = args['user_corrected'].lower()
+        if value not in ('true', 'false', '1', '0'):
+            raise ValueError('user_corrected must be true or false')
+        # A literal comparison lets the planner use the partial index on corrected rows
+        conditions.append('user_corrected = TRUE' if value in ('true', '1') else 'NOT user_corrected')
+    
+    if args.get('cursor'):
+        conditions.append('(date, id) < (?, ?)')
+        params.extend(decode_cursor(args['cursor']))
+    
+    return conditions, params
+
 @app.route('/api/expenses', methods=['GET'])
+@cached_response()
 def get_expenses():
-    """Get all expenses"""
-    conn = sqlite3.connect(DATABASE)
+    """Get a page of expenses, newest first.
+    
+    Supports limit, cursor (taken from the X-Next-Cursor header of the
+    previous page), category, date_from, date_to, min_amount, max_amount,
+    user_corrected and a comma-separated fields projection.
+    """
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    try:
+        fields = _parse_expense_fields(request.args)
+        conditions, params = _parse_expense_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT id, description, amount, category, predicted_category, 
-               date, user_corrected FROM expenses 
-        ORDER BY date DESC
-    ''')
+    # Keyset pagination on (date, id) keeps every page an index range scan,
+    # however deep the cursor is; one extra row tells us if there is a next page
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    cursor.execute(f'''
+        SELECT {', '.join(fields)}, date, id FROM expenses
+        {where}
+        ORDER BY date DESC, id DESC
+        LIMIT ?
+    ''', params + [limit + 1])
+    rows = cursor.fetchall()
     
-    expenses = []
-    for row in cursor.fetchall():
-        expenses.append({
-            'id': row[0],
-            'description': row[1],
-            'amount': row[2],
-            'category': row[3],
-            'predicted_category': row[4],
-            'date': row[5],
-            'user_corrected': row[6]
-        })
+    expenses = [dict(zip(fields, row)) for row in rows[:limit]]
     
-    conn.close()
-    return jsonify(expenses)
+    response = jsonify(expenses)
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        response.headers['X-Next-Cursor'] = encode_cursor(last[-2], last[-1])
+    return response
+
+# A search term is a "quoted phrase" or a bare word; a trailing * makes it a prefix
+_SEARCH_TERM = re.compile(r'"([^"]*)"(\*?)|(\S+)')
+_WORD_CHARACTER = re.compile(r'[^\W_]')
+# Relevance, lower is better; a match in the description itself counts
+# double one in the normalized text
+SEARCH_RANK = 'bm25(expenses_fts, 2.0, 1.0)'
+
+def _fts_string(text, prefix):
+    """FTS5 string literal; the tokenizer splits it into a phrase"""
+    return '"' + text.replace('"', '""') + '"' + ('*' if prefix else '')
+
+def build_search_query(q, normalized=False):
+    """Translate a search box query into an FTS5 MATCH expression.
+    
+    Every term must match. Terms are always quoted, so user input never
+    reaches the FTS5 query syntax itself. With normalized, a term may
+    instead match the preprocessed description, in its preprocessed form,
+    e.g. mcdonalds finds every 'fast food restaurant'. Raises ValueError
+    if the query has no searchable words.
+    """
+    terms = []
+    for phrase, phrase_prefix, word in _SEARCH_TERM.findall(q):
+        text = word.rstrip('*') if word else phrase
+        prefix = bool(phrase_prefix) or word.endswith('*')
+        if not _WORD_CHARACTER.search(text):
+            continue
+        term = f'description : {_fts_string(text, prefix)}'
+        normalized_text = categorizer.preprocess_text(text) if normalized else ''
+        if normalized_text:
+            term = f'({term} OR normalized_description : {_fts_string(normalized_text, prefix)})'
+        terms.append(term)
+    if not terms:
+        raise ValueError('q must contain at least one word to search for')
+    return ' AND '.join(terms)
+
+@app.route('/api/expenses/search', methods=['GET'])
+@cached_response()
+def search_expenses():
+    """Full-text search over expense descriptions.
+    
+    q takes words, "quoted phrases" and prefix* terms; normalized=true also
+    matches the preprocessed descriptions. Takes the filters and fields of
+    GET /api/expenses. Results are ranked best match first and paged with
+    offset (X-Next-Offset), or with sort=date newest first and paged with
+    cursor (X-Next-Cursor).
+    """
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    sort = request.args.get('sort', 'rank')
+    if sort not in ('rank', 'date'):
+        return jsonify({'error': 'sort must be rank or date'}), 400
+    if sort == 'rank' and request.args.get('cursor'):
+        return jsonify({'error': 'cursor only applies to sort=date; use offset'}), 400
+    normalized = request.args.get('normalized', 'false').lower()
+    if normalized not in ('true', 'false', '1', '0'):
+        return jsonify({'error': 'normalized must be true or false'}), 400
+    
+    try:
+        match = build_search_query(request.args.get('q', ''), normalized in ('true', '1'))
+        fields = _parse_expense_fields(request.args)
+        conditions, params = _parse_expense_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Every match is scored before the best can be picked, so rank order
+    # pages by offset; date order pages by the (date, id) keyset
+    columns = ', '.join(f'expenses.{field}' for field in fields)
+    if sort == 'rank' and not conditions:
+        # Unfiltered, the page is picked inside the index and only its rows
+        # are joined with expenses
+        sql = f'''
+            SELECT {columns}, expenses.date, expenses.id
+            FROM (
+                SELECT rowid, {SEARCH_RANK} AS score FROM expenses_fts
+                WHERE expenses_fts MATCH ?
+                ORDER BY score, rowid DESC
+                LIMIT ? OFFSET ?
+            ) AS matches
+            JOIN expenses ON expenses.id = matches.rowid
+            ORDER BY matches.score, expenses.id DESC
+        '''
+    else:
+        order = f'{SEARCH_RANK}, expenses.id DESC' if sort == 'rank' else 'expenses.date DESC, expenses.id DESC'
+        # CROSS JOIN keeps the index as the outer loop; the planner may
+        # otherwise walk a filter's index and rerun the MATCH for every row
+        sql = f'''
+            SELECT {columns}, expenses.date, expenses.id
+            FROM expenses_fts
+            CROSS JOIN expenses ON expenses.id = expenses_fts.rowid
+            WHERE {' AND '.join(['expenses_fts MATCH ?'] + conditions)}
+            ORDER BY {order}
+            LIMIT ? OFFSET ?
+        '''
+    cursor = get_db().cursor()
+    cursor.execute(sql, [match] + params + [limit + 1, offset if sort == 'rank' else 0])
+    rows = cursor.fetchall()
+    
+    response = jsonify([dict(zip(fields, row)) for row in rows[:limit]])
+    if len(rows) > limit:
+        if sort == 'rank':
+            response.headers['X-Next-Offset'] = str(offset + limit)
+        else:
+            last = rows[limit - 1]
+            response.headers['X-Next-Cursor'] = encode_cursor(last[-2], last[-1])
+    return response
+
+# Rows fetched from SQLite per step while exporting, and rows per Parquet row group
+EXPORT_FETCH_SIZE = 1000
+PARQUET_ROW_GROUP_SIZE = 50000
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+def _iter_export_batches(query, params):
+    """Yield lists of rows from a dedicated pooled connection, fetchmany at a time"""
+    pool = _get_pool()
+    conn = pool.acquire()
+    try:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                return
+            yield rows
+    finally:
+        # Runs when the client disconnects too, since the response closes the generator
+        pool.release(conn)
+
+def _export_ndjson(fields, batches):
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(fields, row))) + '\n' for row in rows)
+
+def _export_csv(fields, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+class _ParquetSink(io.RawIOBase):
+    """Write-only file that hands out what was written so far, for streaming"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _export_parquet(fields, batches, pa, pq):
+    import pandas as pd
+
+    types = {
+        'id': pa.int64(), 'amount': pa.float64(), 'user_corrected': pa.bool_(),
+        'description': pa.string(), 'category': pa.string(),
+        'predicted_category': pa.string(), 'date': pa.string(),
+    }
+    schema = pa.schema([(field, types[field]) for field in fields])
+    sink = _ParquetSink()
+    writer = pq.ParquetWriter(sink, schema)
+
+    def write_row_group(rows):
+        frame = pd.DataFrame.from_records(rows, columns=fields)
+        if 'user_corrected' in frame:
+            frame['user_corrected'] = frame['user_corrected'].astype(bool)
+        writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+
+    # Columnar output needs whole row groups, so buffer up to one at a time
+    pending = []
+    for rows in batches:
+        pending.extend(rows)
+        if len(pending) >= PARQUET_ROW_GROUP_SIZE:
+            write_row_group(pending)
+            pending = []
+            yield sink.drain()
+    if pending:
+        write_row_group(pending)
+    writer.close()
+    yield sink.drain()
+
+@app.route('/api/expenses/export', methods=['GET'])
+def export_expenses():
+    """Stream every matching expense as NDJSON, CSV or Parquet, newest first.
+
+    Takes the same filters and fields projection as GET /api/expenses.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_MIMETYPES)}"}), 400
+
+    try:
+        fields = _parse_expense_fields(request.args)
+        conditions, params = _parse_expense_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    batches = _iter_export_batches(f'''
+        SELECT {', '.join(fields)} FROM expenses
+        {where}
+        ORDER BY date DESC, id DESC
+    ''', params)
+
+    if export_format == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            return jsonify({'error': 'Parquet export requires pyarrow'}), 501
+        body = _export_parquet(fields, batches, pa, pq)
+    elif export_format == 'csv':
+        body = _export_csv(fields, batches)
+    else:
+        body = _export_ndjson(fields, batches)
+
+    response = app.response_class(body, mimetype=EXPORT_MIMETYPES[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=expenses.{export_format}'
+    return response
 
 @app.route('/api/expenses', methods=['POST'])
 def add_expense():
@@ -338,29 +2060,33 @@ def add_expense():
     amount = float(data.get('amount', 0))
     user_category = data.get('category')
     
+    conn = get_db()
+    sync_merchants(conn)
+    
     # Predict category
-    predicted_category, confidence = categorizer.predict_category(description)
+    (predicted_category, confidence, source), = categorizer.predict_with_source([description])
     
     # Use user category if provided, otherwise use prediction
     final_category = user_category if user_category else predicted_category
     user_corrected = bool(user_category and user_category != predicted_category)
     
     # Save to database
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO expenses (description, amount, category, predicted_category, user_corrected)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (description, amount, final_category, predicted_category, user_corrected))
-    
-    expense_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    row = (description, amount, final_category, predicted_category, user_corrected,
+           categorizer.preprocess_text(description))
+    if WRITE_QUEUE:
+        # Committed together with other requests' expenses
+        expense_id = _get_write_queue().insert(row)
+    else:
+        cursor = conn.cursor()
+        cursor.execute(INSERT_EXPENSE_SQL, row)
+        expense_id = cursor.lastrowid
+        conn.commit()
     
-    # Retrain model if user corrected
+    # Learn from the correction, retraining in the background if needed
     if user_corrected:
-        retrain_model()
+        sync_merchants(conn, force=True)
+        if categorizer.learn_corrections([(description, final_category)]):
+            trainer.schedule()
     
     return jsonify({
         'id': expense_id,
@@ -369,24 +2095,181 @@ def add_expense():
         'category': final_category,
         'predicted_category': predicted_category,
         'confidence': confidence,
+        'prediction_source': source,
         'user_corrected': user_corrected
     })
 
+def _parse_batch_item(item):
+    """(description, amount, category, date) of one batch item; raises ValueError if it is malformed"""
+    description = item.get('description', '')
+    if not isinstance(description, str):
+        raise ValueError('description must be a string')
+    
+    amount = item.get('amount', 0)
+    if isinstance(amount, bool) or not isinstance(amount, (int, float, str)):
+        raise ValueError('amount must be a number')
+    try:
+        amount = float(amount)
+    except ValueError:
+        raise ValueError('amount must be a number')
+    if not math.isfinite(amount):
+        raise ValueError('amount must be a number')
+    
+    # Stored as 'YYYY-MM-DD HH:MM:SS' like CURRENT_TIMESTAMP, so the month
+    # column and the budget period triggers can read it
+    date = item.get('date')
+    if date is not None:
+        if not isinstance(date, str):
+            raise ValueError('date must be a string')
+        try:
+            date = datetime.fromisoformat(date).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            # Statement-style dates such as 01/05/2024
+            date = parse_date(date)
+    
+    category = item.get('category')
+    if category is not None and not isinstance(category, str):
+        raise ValueError('category must be a string')
+    
+    return description, amount, category, date
+
+@app.route('/api/expenses/batch', methods=['POST'])
+def add_expenses_batch():
+    """Add many expenses at once from a JSON array or an NDJSON stream"""
+    if request.mimetype == 'application/x-ndjson':
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8')
+        items = []
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                return jsonify({'error': 'Item is not valid JSON', 'index': len(items)}), 400
+    else:
+        items = request.get_json(silent=True)
+    
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return jsonify({'error': 'Expected a JSON array or NDJSON stream of expense objects'}), 400
+    
+    # Validate everything before writing anything, so a bad item fails the whole batch cleanly
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append(_parse_batch_item(item))
+        except ValueError as e:
+            return jsonify({'error': f'Invalid expense: {e}', 'index': index}), 400
+    
+    conn = get_db()
+    sync_merchants(conn)
+    
+    # Predict every category in a single vectorized pass
+    predictions = categorizer.predict_with_source([description for description, _, _, _ in parsed])
+    
+    rows = []
+    expenses = []
+    corrections = []
+    for (description, amount, user_category, date), (predicted_category, confidence, source) in zip(parsed, predictions):
+        final_category = user_category if user_category else predicted_category
+        user_corrected = bool(user_category and user_category != predicted_category)
+        if user_corrected:
+            corrections.append((description, final_category))
+        
+        rows.append((description, amount, final_category, predicted_category,
+                     user_corrected, date, categorizer.preprocess_text(description)))
+        expenses.append({
+            'description': description,
+            'amount': amount,
+            'category': final_category,
+            'predicted_category': predicted_category,
+            'confidence': confidence,
+            'prediction_source': source,
+            'user_corrected': user_corrected
+        })
+    
+    # Save everything in one transaction
+    cursor = conn.cursor()
+    
+    cursor.executemany('''
+        INSERT INTO expenses
+            (description, amount, category, predicted_category, user_corrected, date, normalized_description)
+        VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+    ''', rows)
+    
+    # The transaction holds the write lock, so the AUTOINCREMENT ids are contiguous
+    cursor.execute('SELECT last_insert_rowid()')
+    last_id = cursor.fetchone()[0]
+    conn.commit()
+    
+    for offset, expense in enumerate(expenses):
+        expense['id'] = last_id - len(expenses) + 1 + offset
+    
+    # Learn from all corrections together, retraining at most once for the batch
+    if corrections:
+        sync_merchants(conn, force=True)
+    if categorizer.learn_corrections(corrections):
+        trainer.schedule(len(corrections))
+    
+    return jsonify({
+        'inserted': len(expenses),
+        'corrections': len(corrections),
+        'expenses': expenses
+    })
+
+@app.route('/api/import', methods=['POST'])
+def import_statement():
+    """Import a CSV, OFX or QIF bank statement uploaded as 'file' or as the raw body.
+    
+    sign= is the sign of spending in a CSV amount column: 'positive' (the
+    default, as written by /api/expenses/export) or 'negative'.
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        raw_stream, filename = upload.stream, upload.filename
+    else:
+        raw_stream, filename = request.stream, None
+    
+    statement_format = request.args.get('format') or detect_format(filename)
+    if statement_format not in STATEMENT_PARSERS:
+        return jsonify({'error': f"format must be one of {', '.join(sorted(STATEMENT_PARSERS))}"}), 400
+    amount_sign = request.args.get('sign', 'positive')
+    if amount_sign not in AMOUNT_SIGNS:
+        return jsonify({'error': f"sign must be one of {', '.join(AMOUNT_SIGNS)}"}), 400
+    parse = STATEMENT_PARSERS[statement_format]
+    if parse is parse_csv:
+        parse = functools.partial(parse_csv, amount_sign=amount_sign)
+    
+    # Parse, categorize and insert chunk by chunk straight off the upload stream
+    stream = io.TextIOWrapper(raw_stream, encoding='utf-8-sig', newline='')
+    try:
+        stats = import_expenses(
+            get_db(), categorizer, parse(stream),
+            progress=lambda stats: app.logger.info('Import progress: %s', stats)
+        )
+    except (ValueError, KeyError, csv.Error) as e:
+        return jsonify({'error': f'Could not parse statement: {e}'}), 400
+    
+    # One deferred retrain for the whole statement
+    if stats['corrections']:
+        trainer.schedule(stats['corrections'])
+    
+    return jsonify(stats)
+
 @app.route('/api/expenses/<int:expense_id>', methods=['PUT'])
 def update_expense(expense_id):
     """Update an expense category"""
     data = request.json
     new_category = data.get('category')
     
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get current expense
-    cursor.execute('SELECT predicted_category FROM expenses WHERE id = ?', (expense_id,))
+    cursor.execute('SELECT description, predicted_category FROM expenses WHERE id = ?', (expense_id,))
     result = cursor.fetchone()
     
     if result:
-        predicted_category = result[0]
+        description, predicted_category = result
         user_corrected = new_category != predicted_category
         
         cursor.execute('''
@@ -396,39 +2279,97 @@ def update_expense(expense_id):
         ''', (new_category, user_corrected, expense_id))
         
         conn.commit()
+        # Any category set here is the user's, even one matching the prediction
+        sync_merchants(conn, force=True)
         
-        if user_corrected:
-            retrain_model()
+        if user_corrected and categorizer.learn_corrections([(description, new_category)]):
+            trainer.schedule()
     
-    conn.close()
     return jsonify({'success': True})
 
+@app.route('/api/predict', methods=['GET'])
+def predict():
+    """Predict a category for a description without saving an expense"""
+    description = request.args.get('q', '')
+    top_k = request.args.get('top_k', 3, type=int)
+    
+    sync_merchants(get_db())
+    prediction = categorizer.predict_top_k(description, top_k)
+    prediction['description'] = description
+    return jsonify(prediction)
+
+@app.route('/api/model/status', methods=['GET'])
+def get_model_status():
+    """Get the version and training state of the categorization model"""
+    return jsonify({
+        'mode': CATEGORIZER_MODE,
+        'model_version': categorizer.model_version,
+        # Published version of the compact artifact; None in online mode
+        'artifact_version': getattr(categorizer.model, 'version', None),
+        'trained_at': categorizer.trained_at.isoformat() if categorizer.trained_at else None,
+        'training_seconds': categorizer.training_seconds,
+        'pending_corrections': trainer.pending_corrections,
+        'training': trainer.training,
+        'debounce_seconds': trainer.debounce_seconds
+    })
+
+@app.route('/api/model/cache', methods=['GET'])
+def get_cache_stats():
+    """Get hit/miss/eviction counters for the prediction cache and the merchant index"""
+    return jsonify({**categorizer.cache.stats(), 'merchants': categorizer.merchants.stats()})
+
+# Read when /metrics is scraped, so they cost nothing between scrapes
+registry.gauge('expense_tracker_model_version', 'In-process model version, bumped on every install',
+               callback=lambda: categorizer.model_version)
+registry.gauge('expense_tracker_model_artifact_version', 'Published compact artifact version in use',
+               callback=lambda: getattr(categorizer.model, 'version', None))
+registry.gauge('expense_tracker_model_training_seconds', 'Duration of the last training run',
+               callback=lambda: categorizer.training_seconds)
+registry.gauge('expense_tracker_pending_corrections', 'Corrections waiting for a background retrain',
+               callback=lambda: trainer.pending_corrections)
+registry.gauge('expense_tracker_training', '1 while a background retrain is running',
+               callback=lambda: trainer.training)
+registry.counter('expense_tracker_prediction_cache_lookups_total', 'Prediction cache lookups, by result', ('result',),
+                 callback=lambda: {('hit',): categorizer.cache.hits, ('miss',): categorizer.cache.misses})
+registry.counter('expense_tracker_prediction_cache_evictions_total', 'Entries evicted from the prediction cache',
+                 callback=lambda: categorizer.cache.evictions)
+registry.gauge('expense_tracker_merchant_index_size', 'Corrected descriptions answered without the model',
+               callback=lambda: len(categorizer.merchants))
+registry.counter('expense_tracker_merchant_index_lookups_total', 'Merchant index lookups, by result', ('result',),
+                 callback=lambda: {('hit',): categorizer.merchants.hits, ('miss',): categorizer.merchants.misses})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Metrics in the Prometheus text exposition format"""
+    return app.response_class(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/categories', methods=['GET'])
+@cached_response()
 def get_categories():
     """Get all available categories"""
     return jsonify(categorizer.categories)
 
 @app.route('/api/analytics', methods=['GET'])
+@cached_response()
 def get_analytics():
     """Get expense analytics"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Category totals
+    # Category totals, read from the rollup maintained on write
     cursor.execute('''
-        SELECT category, SUM(amount) as total
-        FROM expenses
-        GROUP BY category
+        SELECT category, total, count, predicted_correctly
+        FROM category_totals
         ORDER BY total DESC
     ''')
     
-    category_data = [{'category': row[0], 'total': row[1]} for row in cursor.fetchall()]
+    rows = cursor.fetchall()
+    category_data = [{'category': row[0], 'total': row[1], 'count': row[2]} for row in rows]
     
     # Monthly spending
     cursor.execute('''
-        SELECT strftime('%Y-%m', date) as month, SUM(amount) as total
-        FROM expenses
-        GROUP BY strftime('%Y-%m', date)
+        SELECT month, total
+        FROM monthly_totals
         ORDER BY month DESC
         LIMIT 12
     ''')
@@ -452,25 +2393,99 @@ def get_analytics():
             'date': row[3]
         })
     
-    conn.close()
-    
     return jsonify({
         'categories': category_data,
         'monthly': monthly_data,
         'recent': recent_expenses,
-        'total_expenses': sum(item['total'] for item in category_data)
+        'total_expenses': sum(item['total'] for item in category_data),
+        'expense_count': sum(item['count'] for item in category_data),
+        'predicted_correctly': sum(row[3] for row in rows)
     })
 
+# Expense frames for /api/analytics/insights per database, as
+# (data version, frame, {query parameters: response})
+_insight_frames = {}
+_insight_frames_lock = threading.Lock()
+INSIGHT_RESULTS_CACHED = 32
+
+def _insight_frame(conn):
+    """The expenses loaded for insights, brought up to date only after the table changes"""
+    # Read the version before loading, so a write racing the load at worst
+    # causes one extra reload rather than stale results
+    version = data_version(conn)
+    with _insight_frames_lock:
+        cached = _insight_frames.get(DATABASE)
+        if cached is None or cached[0] != version:
+            # Deferred so pandas is only imported by workers that serve insights
+            import insights
+            
+            with PhaseTimer('insights_load'):
+                if cached is not None and cached[0][1:] == version[1:] and len(cached[1]):
+                    # Only inserts since the last load (same rewrites, same
+                    # database epoch): read just the new ids
+                    frame = insights.extend_expenses(cached[1], insights.load_expenses(conn, int(cached[1]['id'].max())))
+                else:
+                    frame = insights.load_expenses(conn)
+            cached = _insight_frames[DATABASE] = (version, frame, {})
+    return cached
+
+@app.route('/api/analytics/insights', methods=['GET'])
+@cached_response(by_day=True)
+def get_insights():
+    """Rolling spend, month-over-month changes, outliers and recurring charges"""
+    args = request.args
+    try:
+        days = int(args.get('days', 90))
+        months = int(args.get('months', 6))
+        z_threshold = float(args.get('z', 3.0))
+        limit = int(args.get('limit', 20))
+        as_of = args.get('date')
+        if as_of:
+            datetime.strptime(as_of, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'days, months and limit must be integers, z a number and date YYYY-MM-DD'}), 400
+    if not (1 <= days <= 3660 and 1 <= months <= 120 and 0 <= limit <= 1000 and z_threshold > 0):
+        return jsonify({'error': 'days must be 1-3660, months 1-120, limit 0-1000 and z positive'}), 400
+    
+    conn = get_db()
+    # Expense dates are stored in UTC, so "today" comes from SQLite too
+    as_of = as_of or conn.execute("SELECT date('now')").fetchone()[0]
+    _, frame, results = _insight_frame(conn)
+    
+    key = (as_of, days, months, z_threshold, limit)
+    result = results.get(key)
+    if result is None:
+        import insights
+        
+        with PhaseTimer('insights'):
+            result = insights.compute_insights(frame, as_of, days, months, z_threshold, limit)
+        if len(results) >= INSIGHT_RESULTS_CACHED:
+            results.clear()
+        results[key] = result
+    
+    return jsonify(result)
+
+BUDGET_PERIODS = tuple(PERIOD_START_SQL)
+
+def _period_range(period, day):
+    """First day of the budget period containing day, and of the period after it"""
+    if period == 'weekly':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+    start = day.replace(day=1)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
 @app.route('/api/budgets', methods=['GET'])
+@cached_response()
 def get_budgets():
     """Get all budgets"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT category, budget_amount FROM budgets')
-    budgets = [{'category': row[0], 'budget': row[1]} for row in cursor.fetchall()]
+    cursor.execute('SELECT category, budget_amount, period, rollover FROM budgets')
+    budgets = [{'category': row[0], 'budget': row[1], 'period': row[2], 'rollover': bool(row[3])}
+               for row in cursor.fetchall()]
     
-    conn.close()
     return jsonify(budgets)
 
 @app.route('/api/budgets', methods=['POST'])
@@ -479,23 +2494,114 @@ def set_budget():
     data = request.json
     category = data.get('category')
     budget_amount = float(data.get('budget', 0))
+    period = data.get('period', 'monthly')
+    if period not in BUDGET_PERIODS:
+        return jsonify({'error': f"period must be one of: {', '.join(BUDGET_PERIODS)}"}), 400
+    rollover = bool(data.get('rollover', False))
     
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
+    # An upsert keeps created_date, which decides whether there is anything to roll over
     cursor.execute('''
-        INSERT OR REPLACE INTO budgets (category, budget_amount)
-        VALUES (?, ?)
-    ''', (category, budget_amount))
+        INSERT INTO budgets (category, budget_amount, period, rollover)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (category) DO UPDATE SET
+            budget_amount = excluded.budget_amount,
+            period = excluded.period,
+            rollover = excluded.rollover
+    ''', (category, budget_amount, period, rollover))
     
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True})
 
-def retrain_model():
-    """Retrain the model with corrected data"""
-    conn = sqlite3.connect(DATABASE)
+@app.route('/api/budgets/status', methods=['GET'])
+@cached_response(by_day=True)
+def get_budget_status():
+    """Spend against each budget in its current period, with burn rate and projection.
+    
+    Rollover carries a single period: what was left (or overspent) in the
+    period before this one, named by carried_over_from. It is not a running
+    balance over every earlier period.
+    """
+    conn = get_db()
+    
+    # Expense dates are stored in UTC, so "today" comes from SQLite too
+    try:
+        today = datetime.strptime(request.args.get('date') or conn.execute("SELECT date('now')").fetchone()[0],
+                                  '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'date must be YYYY-MM-DD'}), 400
+    
+    periods = {}
+    for period in BUDGET_PERIODS:
+        start, end = _period_range(period, today)
+        previous_start, _ = _period_range(period, start - timedelta(days=1))
+        periods[period] = (start, end, previous_start)
+    
+    # One primary-key lookup into period_totals per budget for each of the
+    # current and previous periods; the expenses table is not read
+    rows = conn.execute('''
+        SELECT b.category, b.budget_amount, b.period, b.rollover, b.created_date,
+               COALESCE(this_period.total, 0), COALESCE(last_period.total, 0)
+        FROM budgets b
+        LEFT JOIN period_totals this_period ON this_period.category = b.category AND this_period.period = b.period
+            AND this_period.period_start = CASE b.period WHEN 'weekly' THEN :week ELSE :month END
+        LEFT JOIN period_totals last_period ON last_period.category = b.category AND last_period.period = b.period
+            AND last_period.period_start = CASE b.period WHEN 'weekly' THEN :previous_week ELSE :previous_month END
+        ORDER BY b.category
+    ''', {
+        'week': periods['weekly'][0].isoformat(),
+        'month': periods['monthly'][0].isoformat(),
+        'previous_week': periods['weekly'][2].isoformat(),
+        'previous_month': periods['monthly'][2].isoformat(),
+    }).fetchall()
+    
+    budgets = []
+    for category, budget, period, rollover, created_date, spent, previous_spent in rows:
+        start, end, previous_start = periods[period]
+        # Whatever was left (or overspent) last period carries into this one,
+        # provided the budget already existed then
+        carries_over = bool(rollover) and (created_date or '') < start.isoformat()
+        carried_over = budget - previous_spent if carries_over else 0.0
+        available = budget + carried_over
+        days_elapsed = (today - start).days + 1
+        days_in_period = (end - start).days
+        burn_rate = spent / days_elapsed
+        projected_spend = burn_rate * days_in_period
+        
+        if spent > available:
+            status = 'over'
+        elif projected_spend > available:
+            status = 'at_risk'
+        else:
+            status = 'on_track'
+        
+        budgets.append({
+            'category': category,
+            'period': period,
+            'period_start': start.isoformat(),
+            'period_end': (end - timedelta(days=1)).isoformat(),
+            'budget': budget,
+            'carried_over': round(carried_over, 2),
+            # Start of the one period carried over, None without rollover
+            'carried_over_from': previous_start.isoformat() if carries_over else None,
+            'available': round(available, 2),
+            'spent': round(spent, 2),
+            'remaining': round(available - spent, 2),
+            'days_elapsed': days_elapsed,
+            'days_in_period': days_in_period,
+            'burn_rate': round(burn_rate, 2),
+            'projected_spend': round(projected_spend, 2),
+            'projected_overspend': round(max(projected_spend - available, 0.0), 2),
+            'status': status,
+        })
+    
+    return jsonify({'date': today.isoformat(), 'budgets': budgets})
+
+def load_corrections(conn):
+    """(description, category) of every expense a user corrected, the data models are retrained on"""
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -503,13 +2609,138 @@ def retrain_model():
         WHERE user_corrected = TRUE
     ''')
     
-    corrected_data = [(row[0], row[1]) for row in cursor.fetchall()]
+    return [(row[0], row[1]) for row in cursor.fetchall()]
+
+def retrain_model():
+    """Retrain the model with corrected data"""
+    with PhaseTimer('retrain'):
+        conn = connect_db()
+        corrected_data = load_corrections(conn)
+        conn.close()
+        
+        if corrected_data:
+            categorizer.train_model(corrected_data)
+
+class BackgroundTrainer:
+    """Coalesce user corrections and retrain the model off the request thread"""
+    
+    def __init__(self, train, debounce_seconds):
+        self.train = train
+        self.debounce_seconds = debounce_seconds
+        self.pending_corrections = 0
+        self.training = False
+        self._last_correction = 0.0
+        self._condition = threading.Condition()
+        self._thread = None
+    
+    def schedule(self, corrections=1):
+        """Record corrections; a retrain starts once they stop arriving for the debounce window"""
+        with self._condition:
+            self.pending_corrections += corrections
+            self._last_correction = time.monotonic()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='background-trainer', daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+    
+    def wait_idle(self, timeout=None):
+        """Block until no corrections are pending and no retrain is running"""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self.pending_corrections and not self.training, timeout)
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.pending_corrections > 0)
+                
+                # Debounce: keep waiting while corrections are still coming in
+                while True:
+                    remaining = self._last_correction + self.debounce_seconds - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                
+                self.pending_corrections = 0
+                self.training = True
+            
+            try:
+                self.train()
+            except Exception:
+                app.logger.exception('Background retrain failed')
+            finally:
+                with self._condition:
+                    self.training = False
+                    self._condition.notify_all()
+
+# Seconds without new corrections before a background retrain starts
+RETRAIN_DEBOUNCE_SECONDS = float(os.environ.get('RETRAIN_DEBOUNCE_SECONDS', 5))
+
+trainer = BackgroundTrainer(retrain_model, RETRAIN_DEBOUNCE_SECONDS)
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the analytics rollup tables from the expenses table"""
+    init_db()
+    conn = connect_db()
+    rebuild_rollups(conn)
     conn.close()
+    click.echo('Rollups rebuilt')
+
+@app.cli.command('check-rollups')
+def check_rollups_command():
+    """Compare the analytics rollups against a full recompute"""
+    init_db()
+    conn = connect_db()
+    mismatches = check_rollups(conn)
+    conn.close()
+    for mismatch in mismatches:
+        click.echo(json.dumps(mismatch))
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} rollup rows out of date; run rebuild-rollups')
+    click.echo('Rollups are consistent')
+
+# Run in a fresh interpreter by profile_startup; prints one JSON line of timings
+_STARTUP_PROBE = '''
+import json, sys, time
+timings = {}
+started = last = time.perf_counter()
+def mark(phase):
+    global last
+    now = time.perf_counter()
+    timings[phase] = (now - last) * 1000
+    last = now
+import flask, flask_cors; mark('import flask')
+import numpy; mark('import numpy')
+import app; mark('import app')
+app.categorizer.load_model(); mark('load model')
+app.categorizer.predict_category('Starbucks coffee'); mark('first prediction')
+timings['time to first prediction'] = (last - started) * 1000
+print(json.dumps({'timings': timings, 'heavy_modules': [m for m in ('sklearn', 'pandas', 'scipy') if m in sys.modules]}))
+'''
+
+def profile_startup(runs=5):
+    """Print a cold-start breakdown, the median over several fresh interpreters"""
+    import subprocess
     
-    if corrected_data:
-        categorizer.train_model(corrected_data)
+    here = os.path.dirname(os.path.abspath(__file__))
+    reports = [
+        json.loads(subprocess.run([sys.executable, '-c', _STARTUP_PROBE], cwd=here, check=True,
+                                  capture_output=True, text=True).stdout.splitlines()[-1])
+        for _ in range(runs)
+    ]
+    print(f"Cold start, median of {runs} fresh processes (model: {categorizer.model_path})")
+    for phase in reports[0]['timings']:
+        samples = sorted(report['timings'][phase] for report in reports)
+        print(f"  {phase:<26} {samples[len(samples) // 2]:8.1f} ms")
+    print(f"  heavy modules imported: {', '.join(reports[0]['heavy_modules']) or 'none'}")
+    return reports
 
 if __name__ == '__main__':
+    if '--profile-startup' in sys.argv[1:]:
+        profile_startup()
+        sys.exit()
+    
     init_db()
     
     # Train initial model if it doesn't exist
@@ -0,0 +1,446 @@
+"""
+ASGI entry point: the expense tracker served from an event loop
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001
+
+Connections, request bodies and responses are handled on the event loop.
+The Flask views run on a bounded thread pool, so SQLite I/O never blocks
+the loop, and CPU-bound work leaves the view threads as well:
+categorization goes to an inference pool (processes, or threads on a
+single core) and retrains to a separate, lower-priority process, so read
+endpoints keep their latency while a retrain runs.
+
+Every pool applies backpressure. Once a pool holds its queue depth of
+jobs, new requests get 503 with Retry-After instead of queueing without
+bound. A request with no response within its timeout gets 504. Settings
+come from the environment:
+
+    ASGI_VIEW_THREADS      threads running Flask views (32)
+    ASGI_QUEUE_DEPTH       requests queued or running before 503s (256)
+    ASGI_TIMEOUT           seconds until a view must start responding (30)
+    INFERENCE_POOL         'process' or 'thread' (process on multi-core hosts;
+                           always thread with CATEGORIZER_MODE=online)
+    INFERENCE_WORKERS      inference pool size (CPU count, at most 4)
+    INFERENCE_QUEUE_DEPTH  predictions queued or running before 503s (64)
+    INFERENCE_TIMEOUT      seconds a prediction may take before 504 (5)
+    TRAINING_POOL          'process' retrains in a child process; 'thread'
+                           keeps the in-process background trainer
+    TRAINING_NICE          CPU niceness added to the training process (10)
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import io
+import json
+import multiprocessing
+import os
+import sys
+import threading
+
+from flask import jsonify
+
+import app as app_module
+
+VIEW_THREADS = int(os.environ.get('ASGI_VIEW_THREADS', 32))
+VIEW_QUEUE_DEPTH = int(os.environ.get('ASGI_QUEUE_DEPTH', 256))
+VIEW_TIMEOUT = float(os.environ.get('ASGI_TIMEOUT', 30))
+INFERENCE_POOL = os.environ.get('INFERENCE_POOL', 'process' if (os.cpu_count() or 1) > 1 else 'thread')
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', min(4, os.cpu_count() or 1)))
+INFERENCE_QUEUE_DEPTH = int(os.environ.get('INFERENCE_QUEUE_DEPTH', 64))
+INFERENCE_TIMEOUT = float(os.environ.get('INFERENCE_TIMEOUT', 5))
+TRAINING_POOL = os.environ.get('TRAINING_POOL', 'process')
+TRAINING_NICE = int(os.environ.get('TRAINING_NICE', 10))
+
+# Pools by name, for the in-flight gauge
+_pools = {}
+
+POOL_IN_FLIGHT = app_module.registry.gauge(
+    'expense_tracker_pool_in_flight', 'Jobs queued or running, by pool', ('pool',),
+    callback=lambda: {(name,): pool.in_flight for name, pool in list(_pools.items())})
+POOL_REJECTED = app_module.registry.counter(
+    'expense_tracker_pool_rejected_total', 'Jobs refused because the pool was at its queue depth', ('pool',))
+POOL_TIMEOUTS = app_module.registry.counter(
+    'expense_tracker_pool_timeouts_total', 'Jobs that were not answered within the timeout', ('pool',))
+
+
+class PoolOverloaded(Exception):
+    """A pool already holds its queue depth of jobs"""
+
+
+class PoolTimeout(Exception):
+    """A pooled job did not finish within the pool's timeout"""
+
+
+@app_module.app.errorhandler(PoolOverloaded)
+def pool_overloaded(error):
+    return jsonify({'error': str(error)}), 503, {'Retry-After': '1'}
+
+
+@app_module.app.errorhandler(PoolTimeout)
+def pool_timeout(error):
+    return jsonify({'error': str(error)}), 504
+
+
+class BoundedPool:
+    """An executor that refuses jobs beyond a queue depth and bounds how long callers wait"""
+
+    def __init__(self, name, executor, depth, timeout=None):
+        self.name = name
+        self.executor = executor
+        self.depth = depth
+        self.timeout = timeout
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        _pools[name] = self
+
+    def submit(self, fn, *args):
+        """Queue fn(*args); raises PoolOverloaded when the pool is full"""
+        with self._lock:
+            if self.in_flight >= self.depth:
+                POOL_REJECTED.inc(self.name)
+                raise PoolOverloaded(f'The {self.name} pool is at its queue depth of {self.depth}; retry shortly')
+            self.in_flight += 1
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # The slot is held until the job ends, even if its caller gave up on it,
+        # so abandoned work still counts against the queue depth
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn, *args):
+        """Run fn(*args) on the pool and wait for its result"""
+        future = self.submit(fn, *args)
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            POOL_TIMEOUTS.inc(self.name)
+            raise PoolTimeout(f'The {self.name} pool did not answer within {self.timeout}s') from None
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if _pools.get(self.name) is self:
+            del _pools[self.name]
+
+    def _release(self, future=None):
+        with self._lock:
+            self.in_flight -= 1
+
+
+# The categorizer that actually predicts in this process. In the server,
+# app.categorizer is replaced by a PooledCategorizer wrapping it.
+_categorizer = None
+# A pool process's own connection, for syncing its merchant index; threads
+# share the server's categorizer, which the views keep in sync
+_connection = None
+
+
+def _init_worker(database, model_path, nice=0):
+    """Pool process initializer: use the server's database and model"""
+    global _categorizer, _connection
+    if nice:
+        os.nice(nice)
+    app_module.DATABASE = database
+    _categorizer = app_module.categorizer
+    _categorizer.model_path = model_path
+    _categorizer.load_model()
+    _connection = app_module.connect_db()
+
+
+def _sync_merchants():
+    if _connection is not None:
+        _categorizer.merchants.sync(_connection)
+
+
+def _predict_categories(descriptions):
+    _sync_merchants()
+    return _categorizer.predict_categories(descriptions)
+
+
+def _predict_with_source(descriptions):
+    _sync_merchants()
+    return _categorizer.predict_with_source(descriptions)
+
+
+def _predict_top_k(description, top_k):
+    _sync_merchants()
+    return _categorizer.predict_top_k(description, top_k)
+
+
+def _retrain():
+    app_module.retrain_model()
+
+
+class PooledCategorizer:
+    """Stands in for app.categorizer, running every prediction on the inference pool"""
+
+    def __init__(self, categorizer, pool):
+        self._categorizer = categorizer
+        self._pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self._categorizer, name)
+
+    def predict_category(self, description):
+        return self.predict_categories([description])[0]
+
+    def predict_categories(self, descriptions):
+        return self._pool.run(_predict_categories, list(descriptions))
+
+    def predict_with_source(self, descriptions):
+        return self._pool.run(_predict_with_source, list(descriptions))
+
+    def predict_top_k(self, description, top_k=3):
+        return self._pool.run(_predict_top_k, description, top_k)
+
+
+class _RequestBody(io.RawIOBase):
+    """wsgi.input for a view thread, receiving the ASGI request body from the loop as it is read"""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b''
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                self._more = False
+            else:
+                self._buffer = message.get('body', b'')
+                self._more = message.get('more_body', False)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI strings carry the raw bytes as latin-1
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class _Exchange:
+    """The response to one request: written by its view thread, sent on the loop"""
+
+    def __init__(self, loop, send):
+        self.loop = loop
+        self.send = send
+        # Resolved once the view starts responding
+        self.started = loop.create_future()
+        self._begun = False
+        self._abandoned = False
+        self._lock = threading.Lock()
+
+    def emit(self, message):
+        """Send a message from the view thread; False once the request was answered with a timeout"""
+        with self._lock:
+            if self._abandoned:
+                return False
+            if not self._begun:
+                self._begun = True
+                self.loop.call_soon_threadsafe(self.started.set_result, None)
+        asyncio.run_coroutine_threadsafe(self.send(message), self.loop).result()
+        return True
+
+    def abandon(self):
+        """Stop the view thread from responding, unless it already began; True if it had not"""
+        with self._lock:
+            if not self._begun:
+                self._abandoned = True
+            return self._abandoned
+
+
+def _run_view(environ, exchange):
+    """Run the Flask app for one request on a view thread, streaming its response"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    def start():
+        response['sent'] = True
+        return exchange.emit({'type': 'http.response.start', 'status': response['status'],
+                              'headers': response['headers']})
+
+    result = app_module.app(environ, start_response)
+    try:
+        for chunk in result:
+            if not chunk:
+                continue
+            if 'sent' not in response and not start():
+                return
+            if not exchange.emit({'type': 'http.response.body', 'body': chunk, 'more_body': True}):
+                return
+        if 'sent' not in response and not start():
+            return
+        exchange.emit({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        close = getattr(result, 'close', None)
+        if close is not None:
+            close()
+
+
+async def _send_error(send, status, message, headers=()):
+    body = json.dumps({'error': message}).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                            *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class AsgiApp:
+    """The Flask app behind an ASGI interface, with CPU-bound work on bounded pools"""
+
+    def __init__(self, view_threads=VIEW_THREADS, queue_depth=VIEW_QUEUE_DEPTH, timeout=VIEW_TIMEOUT,
+                 inference_pool=INFERENCE_POOL, inference_workers=INFERENCE_WORKERS,
+                 inference_queue_depth=INFERENCE_QUEUE_DEPTH, inference_timeout=INFERENCE_TIMEOUT,
+                 training_pool=TRAINING_POOL, training_nice=TRAINING_NICE):
+        if inference_pool not in ('process', 'thread') or training_pool not in ('process', 'thread'):
+            raise ValueError("Pools must be 'process' or 'thread'")
+        self.view_threads = view_threads
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.inference_pool = inference_pool
+        self.inference_workers = inference_workers
+        self.inference_queue_depth = inference_queue_depth
+        self.inference_timeout = inference_timeout
+        self.training_pool = training_pool
+        self.training_nice = training_nice
+        self.views = self.inference = self.training = None
+        self._start_lock = threading.Lock()
+
+    def startup(self):
+        """Prepare the database and model, then move categorization and retrains onto their pools"""
+        global _categorizer
+        with self._start_lock:
+            if self.views is not None:
+                return
+            app_module.init_db()
+            categorizer = _categorizer = app_module.categorizer
+            if not categorizer.load_model():
+                categorizer.train_model()
+
+            # Spawned rather than forked: the server process already runs threads
+            context = multiprocessing.get_context('spawn')
+            # The online categorizer learns corrections in this process's memory,
+            # so its predictions have to run here too, where they see them
+            if self.inference_pool == 'process' and app_module.CATEGORIZER_MODE == 'batch':
+                executor = concurrent.futures.ProcessPoolExecutor(
+                    self.inference_workers, mp_context=context, initializer=_init_worker,
+                    initargs=(app_module.DATABASE, categorizer.model_path))
+            else:
+                executor = concurrent.futures.ThreadPoolExecutor(self.inference_workers, thread_name_prefix='inference')
+            self.inference = BoundedPool('inference', executor, self.inference_queue_depth, self.inference_timeout)
+            app_module.categorizer = PooledCategorizer(categorizer, self.inference)
+
+            # The online categorizer learns in memory, so only batch retrains can move out
+            if self.training_pool == 'process' and app_module.CATEGORIZER_MODE == 'batch':
+                executor = concurrent.futures.ProcessPoolExecutor(
+                    1, mp_context=context, initializer=_init_worker,
+                    initargs=(app_module.DATABASE, categorizer.model_path, self.training_nice))
+                # The background trainer runs one retrain at a time and waits for it;
+                # this process reloads the published model like any other worker
+                self.training = BoundedPool('training', executor, depth=1)
+                app_module.trainer.train = functools.partial(self.training.run, _retrain)
+
+            self.views = BoundedPool(
+                'views', concurrent.futures.ThreadPoolExecutor(self.view_threads, thread_name_prefix='asgi-view'),
+                self.queue_depth)
+
+    def shutdown(self):
+        """Stop the pools and give the app back its own categorizer and trainer"""
+        with self._start_lock:
+            for pool in (self.views, self.inference, self.training):
+                if pool is not None:
+                    pool.shutdown()
+            if isinstance(app_module.categorizer, PooledCategorizer):
+                app_module.categorizer = _categorizer
+            app_module.trainer.train = app_module.retrain_model
+            self.views = self.inference = self.training = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            await send({'type': 'websocket.close'})
+
+    async def _lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await loop.run_in_executor(None, self.startup)
+                except Exception as exc:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(exc)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await loop.run_in_executor(None, self.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        if self.views is None:
+            # Servers run without lifespan events start up on the first request
+            await loop.run_in_executor(None, self.startup)
+
+        exchange = _Exchange(loop, send)
+        environ = _environ(scope, io.BufferedReader(_RequestBody(receive, loop)))
+        try:
+            work = asyncio.wrap_future(self.views.submit(_run_view, environ, exchange))
+        except PoolOverloaded as exc:
+            await _send_error(send, 503, str(exc), [(b'retry-after', b'1')])
+            return
+
+        done, _ = await asyncio.wait({work, exchange.started}, timeout=self.timeout,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        if not done and exchange.abandon():
+            # The view keeps its thread until it finishes, but its response is dropped
+            POOL_TIMEOUTS.inc('views')
+            await _send_error(send, 504, f'No response within {self.timeout}s')
+            return
+        await work
+
+
+app = AsgiApp()
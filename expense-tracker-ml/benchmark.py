@@ -0,0 +1,1202 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the expense categorizer
+
+Runs offline against synthetic corpora and the Flask test client:
+
+    python benchmark.py predict --rows 5000
+    python benchmark.py suite --sizes 1000,100000 --output after.json
+    python benchmark.py compare before.json after.json
+"""
+
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import random
+import resource
+import subprocess
+import statistics
+import re
+import shutil
+import sqlite3
+import sys
+import os
+import platform
+import pickle
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+# Add the current directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as app_module
+from app import ExpenseCategorizer, OnlineExpenseCategorizer, MERCHANT_REPLACEMENTS
+
+# Raw merchant strings roughly as they show up on card statements
+MERCHANTS = [
+    "STARBUCKS STORE #{n}", "McDonald's #{n}", "UBER *TRIP HELP.UBER.COM",
+    "LYFT *RIDE {n}", "SHELL OIL {n}", "CHEVRON {n}", "AMAZON MKTPLACE PMTS",
+    "Amazon.com*{n}", "NETFLIX.COM", "Spotify USA", "WHOLE FOODS MKT #{n}",
+    "TRADER JOE'S #{n}", "KROGER #{n}", "Target {n}", "WALGREENS #{n}",
+    "CVS/PHARMACY #{n}", "COMCAST CABLE COMM", "Verizon Wireless", "PG&E electric",
+    "City Parking Garage", "Metro transit card", "Delta Air Lines flight",
+    "Dr. Smith dental office", "Mercy Hospital", "Best Buy {n}", "IKEA {n}",
+    "Home Depot #{n}", "Planet Fitness gym", "AMC cinema {n}", "Rent payment",
+    "Pizza Hut #{n}", "Chipotle {n}", "Barnes & Noble", "Costco gas",
+]
+PREFIXES = ["", "", "POS DEBIT ", "CHECKCARD ", "PURCHASE AUTHORIZED ON 03/14 ", "ACH "]
+SUFFIXES = ["", "", " SEATTLE WA", " NEW YORK NY", " - monthly", " lunch", " card {n}"]
+
+
+def generate_descriptions(count, seed=42):
+    """Generate synthetic card-statement style expense descriptions"""
+    rng = random.Random(seed)
+    descriptions = []
+    for _ in range(count):
+        n = rng.randint(100, 99999)
+        description = rng.choice(PREFIXES) + rng.choice(MERCHANTS) + rng.choice(SUFFIXES)
+        descriptions.append(description.format(n=n))
+    return descriptions
+
+
+def legacy_preprocess_text(text):
+    """The original per-call replacement loop, kept as a comparison baseline"""
+    if not text:
+        return ""
+    text = text.lower().strip()
+    text = re.sub(r'[^a-zA-Z0-9\s]', ' ', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    replacements = dict(MERCHANT_REPLACEMENTS)
+    for key, value in replacements.items():
+        if key in text:
+            text = text.replace(key, value)
+    return text
+
+
+def _time_call(func, items):
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return time.perf_counter() - start
+
+
+def _percentile(samples, percent):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def legacy_predict_category(categorizer, description):
+    """The original predict + predict_proba double call, kept as a comparison baseline.
+
+    Each call transforms the description again; both go straight to the
+    model, bypassing the prediction cache.
+    """
+    processed_description = categorizer.preprocess_text(description)
+    prediction = categorizer.model.predict([processed_description])[0]
+    probabilities = categorizer.model.predict_proba([processed_description])[0]
+    confidence = max(probabilities)
+    if confidence < 0.3:
+        return 'Other', confidence
+    return prediction, confidence
+
+
+def _latencies(func, items):
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def benchmark_preprocess(rows=100_000):
+    """Compare the compiled single-pass normalizer against the legacy loop"""
+    categorizer = ExpenseCategorizer()
+    descriptions = generate_descriptions(rows)
+
+    legacy_seconds = _time_call(legacy_preprocess_text, descriptions)
+    compiled_seconds = _time_call(categorizer.preprocess_text, descriptions)
+
+    print(f"preprocess_text on {rows:,} descriptions")
+    print("-" * 60)
+    print(f"legacy loop:     {legacy_seconds:8.3f}s  ({rows / legacy_seconds:>12,.0f} desc/s)")
+    print(f"compiled regex:  {compiled_seconds:8.3f}s  ({rows / compiled_seconds:>12,.0f} desc/s)")
+    print(f"speedup:         {legacy_seconds / compiled_seconds:8.2f}x")
+    return {
+        'rows': rows,
+        'legacy_seconds': legacy_seconds,
+        'compiled_seconds': compiled_seconds,
+    }
+
+
+def benchmark_predict(rows=5_000):
+    """Per-call predict_category latency: double transform vs single predict_proba"""
+    # Without the prediction cache every call transforms, so this measures
+    # one transform against two rather than cache hits on repeated descriptions
+    categorizer = ExpenseCategorizer(cache_size=0, reload_interval=None)
+    categorizer.predict_category('warm up')
+    descriptions = generate_descriptions(rows)
+
+    legacy = _latencies(lambda d: legacy_predict_category(categorizer, d), descriptions)
+    single = _latencies(categorizer.predict_category, descriptions)
+
+    print(f"predict_category latency over {rows:,} descriptions")
+    print("-" * 60)
+    for name, samples in (('predict + predict_proba', legacy), ('single predict_proba', single)):
+        print(f"{name:<24} p50 {statistics.median(samples) * 1000:7.3f}ms"
+              f"  p99 {_percentile(samples, 99) * 1000:7.3f}ms")
+    print(f"median speedup:          {statistics.median(legacy) / statistics.median(single):7.2f}x")
+    return {
+        'rows': rows,
+        'legacy_p50_ms': statistics.median(legacy) * 1000,
+        'single_p50_ms': statistics.median(single) * 1000,
+        'single_p99_ms': _percentile(single, 99) * 1000,
+    }
+
+
+def benchmark_train(rows=100_000):
+    """train_model time as the number of stored corrections grows"""
+    categories = ExpenseCategorizer().categories
+    rng = random.Random(11)
+    corrections = [(description, rng.choice(categories)) for description in generate_descriptions(rows)]
+
+    print("train_model time by correction count")
+    print("-" * 60)
+    results = {}
+    count = 0
+    with tempfile.TemporaryDirectory() as model_dir:
+        categorizer = ExpenseCategorizer()
+        categorizer.model_path = os.path.join(model_dir, 'expense_model')
+        categorizer._build_pipeline()  # Import scikit-learn outside the timings
+        while count <= rows:
+            seconds = _time_call(lambda _: categorizer.train_model(corrections[:count]), [None])
+            results[count] = {'seconds': seconds}
+            print(f"{count:>10,} corrections  {seconds:8.3f}s")
+            count = count * 10 if count else 1_000
+    return results
+
+
+def benchmark_online(rows=100_000):
+    """Per-correction partial_fit latency as the correction history grows"""
+    categories = ExpenseCategorizer().categories
+    descriptions = generate_descriptions(rows)
+    rng = random.Random(7)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        # Never refit, so every sample is an incremental update
+        categorizer = OnlineExpenseCategorizer(refit_every=rows + 1)
+        categorizer.model_path = os.path.join(model_dir, 'expense_model_online.pkl')
+        categorizer.train_model()
+
+        samples = _latencies(
+            lambda d: categorizer.learn_corrections([(d, rng.choice(categories))]), descriptions)
+
+    print(f"online learn_corrections latency over {rows:,} corrections")
+    print("-" * 60)
+    results = {'rows': rows, 'checkpoints': {}}
+    checkpoint = 100
+    while checkpoint <= rows:
+        # Latency of the 100 corrections leading up to each checkpoint
+        window = samples[checkpoint - 100:checkpoint]
+        p50, p99 = statistics.median(window) * 1000, _percentile(window, 99) * 1000
+        print(f"after {checkpoint:>8,} corrections  p50 {p50:7.3f}ms  p99 {p99:7.3f}ms")
+        results['checkpoints'][checkpoint] = {'p50_ms': p50, 'p99_ms': p99}
+        checkpoint *= 10
+    return results
+
+
+class _UnpooledConnections:
+    """Pre-pooling behaviour: a fresh, default-configured connection per request"""
+
+    def acquire(self):
+        return sqlite3.connect(app_module.DATABASE, check_same_thread=False)
+
+    def release(self, conn):
+        conn.close()
+
+
+def _run_load(seconds, threads):
+    """Hammer a mixed read/write workload from several threads for a fixed time"""
+    counts = {'requests': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(seed):
+        client = app_module.app.test_client()
+        rng = random.Random(seed)
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            choice = rng.random()
+            if choice < 0.4:
+                resp = client.get('/api/analytics')
+            elif choice < 0.7:
+                resp = client.get('/api/budgets')
+            elif choice < 0.9:
+                resp = client.post('/api/expenses', json={'description': 'Coffee', 'amount': 3.5})
+            else:
+                resp = client.post('/api/budgets', json={'category': 'Food', 'budget': rng.randint(100, 500)})
+            done += 1
+            errors += resp.status_code != 200
+        with lock:
+            counts['requests'] += done
+            counts['errors'] += errors
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return counts
+
+
+def benchmark_load(rows=1_000, seconds=5, threads=8):
+    """Requests per second under concurrent load, per-request connections vs the pool"""
+    app_module.app.logger.disabled = True
+    app_module.categorizer.predict_category('warm up')
+    original_connect, original_get_pool = app_module.connect_db, app_module._get_pool
+    results = {}
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        for mode in ('per-request connect', 'pooled + WAL'):
+            app_module.DATABASE = os.path.join(data_dir, f"{mode.split()[0]}.db")
+            if mode == 'per-request connect':
+                unpooled = _UnpooledConnections()
+                app_module.connect_db = lambda database=None: sqlite3.connect(database or app_module.DATABASE)
+                app_module._get_pool = lambda: unpooled
+            else:
+                app_module.connect_db, app_module._get_pool = original_connect, original_get_pool
+
+            app_module.init_db()
+            client = app_module.app.test_client()
+            client.post('/api/expenses/batch', json=[
+                {'description': d, 'amount': 10} for d in generate_descriptions(rows)])
+
+            counts = _run_load(seconds, threads)
+            results[mode] = {**counts, 'rps': counts['requests'] / seconds}
+
+    app_module.connect_db, app_module._get_pool = original_connect, original_get_pool
+
+    print(f"mixed load, {threads} threads for {seconds}s on {rows:,} seeded expenses")
+    print("-" * 60)
+    for mode, result in results.items():
+        print(f"{mode:<20} {result['rps']:8.0f} req/s  ({result['errors']} errors)")
+    return results
+
+
+def _seed_expenses(rows, seed=42):
+    """Bulk insert synthetic expenses straight into app_module.DATABASE"""
+    rng = random.Random(seed)
+    categories = ExpenseCategorizer().categories
+    conn = app_module.connect_db()
+    conn.executemany('''
+        INSERT INTO expenses
+            (description, amount, category, predicted_category, user_corrected, date, normalized_description)
+        VALUES (?, ?, ?, ?, ?, datetime('2020-01-01', ? || ' minutes'), ?)
+    ''', (
+        (description, round(rng.uniform(1, 500), 2), rng.choice(categories), rng.choice(categories),
+         rng.random() < 0.05, rng.randint(0, 60 * 24 * 365 * 4), app_module.preprocess_text(description))
+        for description in generate_descriptions(rows, seed)
+    ))
+    conn.commit()
+    conn.close()
+
+
+def benchmark_pagination(rows=100_000, page_size=100):
+    """GET /api/expenses page latency as the keyset cursor goes deeper"""
+    with tempfile.TemporaryDirectory() as data_dir:
+        app_module.DATABASE = os.path.join(data_dir, 'expenses.db')
+        app_module.init_db()
+        _seed_expenses(rows)
+        client = app_module.app.test_client()
+
+        samples = []
+        cursor = None
+        while True:
+            query = {'limit': page_size}
+            if cursor:
+                query['cursor'] = cursor
+            start = time.perf_counter()
+            resp = client.get('/api/expenses', query_string=query)
+            samples.append(time.perf_counter() - start)
+            cursor = resp.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+
+    print(f"keyset pagination over {rows:,} expenses, {page_size} per page")
+    print("-" * 60)
+    results = {'rows': rows, 'pages': len(samples), 'checkpoints': {}}
+    page = 1
+    while page <= len(samples):
+        window = samples[page - 1:page + 9]
+        print(f"page {page:>6,}  median {statistics.median(window) * 1000:7.3f}ms")
+        results['checkpoints'][page] = {'median_ms': statistics.median(window) * 1000}
+        page *= 10
+    return results
+
+
+def benchmark_analytics(rows=1_000_000):
+    """GET /api/analytics latency as the expenses table grows"""
+    print("/api/analytics latency by table size")
+    print("-" * 60)
+    results = {}
+    size = 1_000
+    with tempfile.TemporaryDirectory() as data_dir:
+        while size <= rows:
+            app_module.DATABASE = os.path.join(data_dir, f'expenses-{size}.db')
+            app_module.init_db()
+            _seed_expenses(size)
+            client = app_module.app.test_client()
+            samples = _latencies(lambda _: client.get('/api/analytics'), range(50))
+            results[size] = {'median_ms': statistics.median(samples) * 1000}
+            print(f"{size:>10,} expenses  median {results[size]['median_ms']:7.3f}ms")
+            size *= 10
+    return results
+
+
+def benchmark_insights(rows=1_000_000):
+    """GET /api/analytics/insights latency as the expenses table grows.
+
+    cold loads the table and computes; compute reuses the loaded frame with
+    new parameters; cached repeats a request; append follows a new expense.
+    """
+    print("/api/analytics/insights latency by table size")
+    print("-" * 60)
+    results = {}
+    size = 1_000
+    with tempfile.TemporaryDirectory() as data_dir:
+        while size <= rows:
+            app_module.DATABASE = os.path.join(data_dir, f'expenses-{size}.db')
+            app_module.init_db()
+            _seed_expenses(size)
+            client = app_module.app.test_client()
+
+            def timed(query):
+                start = time.perf_counter()
+                assert client.get('/api/analytics/insights?date=2023-12-31&' + query).status_code == 200
+                return (time.perf_counter() - start) * 1000
+
+            result = results[size] = {'cold_ms': timed('days=90')}
+            result['compute_ms'] = statistics.median(timed(f'days={days}') for days in range(30, 35))
+            result['cached_ms'] = statistics.median(timed('days=30') for _ in range(20))
+            appended = []
+            for n in range(3):
+                client.post('/api/expenses/batch', json=[{'description': f'Coffee {n}', 'amount': 4.5, 'category': 'Food'}])
+                appended.append(timed('days=90'))
+            result['append_ms'] = statistics.median(appended)
+            print(f"{size:>10,} expenses  cold {result['cold_ms']:8.1f}ms  compute {result['compute_ms']:7.1f}ms  "
+                  f"cached {result['cached_ms']:6.2f}ms  after insert {result['append_ms']:7.1f}ms")
+            size *= 10
+    return results
+
+
+# Search queries from selective to broad: (label, query string). Each
+# synthetic merchant name is in about 3% of descriptions; store numbers
+# are nearly unique
+SEARCH_QUERIES = (
+    ('store number', 'q=43210'),
+    ('word', 'q=netflix'),
+    ('common word', 'q=amazon'),
+    ('prefix', 'q=walg*'),
+    ('phrase', 'q="whole foods"'),
+    ('normalized', 'q=mcdonalds&normalized=true'),
+    ('filtered', 'q=amazon&category=Shopping&date_from=2022-01-01&date_to=2022-06-30'),
+    ('by date', 'q=amazon&sort=date'),
+    ('deep page', 'q=amazon&offset=5000'),
+)
+
+
+def benchmark_search(rows=1_000_000):
+    """GET /api/expenses/search latency as the expenses table grows, response cache off"""
+    print("/api/expenses/search median latency by table size")
+    print("-" * 60)
+    saved = app_module.RESPONSE_CACHE_SIZE
+    app_module.RESPONSE_CACHE_SIZE = 0
+    results = {}
+    size = 1_000
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            while size <= rows:
+                app_module.DATABASE = os.path.join(data_dir, f'expenses-{size}.db')
+                app_module.init_db()
+                _seed_expenses(size)
+                client = app_module.app.test_client()
+                results[size] = {}
+                for label, query in SEARCH_QUERIES:
+                    url = f'/api/expenses/search?limit=20&{query}'
+                    samples = _latencies(lambda _: client.get(url), range(20))
+                    results[size][f'{label}_ms'] = statistics.median(samples) * 1000
+                print(f"{size:>10,} expenses  " + "  ".join(
+                    f"{label} {results[size][f'{label}_ms']:.2f}ms" for label, _ in SEARCH_QUERIES))
+                size *= 10
+    finally:
+        app_module.RESPONSE_CACHE_SIZE = saved
+    return results
+
+
+# What index.html requests on every page load and after every add
+DASHBOARD_REQUESTS = (
+    '/api/categories',
+    '/api/expenses?limit=10&fields=description,amount,category,date,user_corrected',
+    '/api/analytics',
+)
+
+
+def benchmark_dashboard(rows=100_000, refreshes=50):
+    """Bytes transferred and server CPU per dashboard refresh.
+
+    plain disables the response cache and compression (the old behaviour);
+    cached serves gzip bodies from the cache; revalidated sends the ETags
+    from the previous refresh, as a browser does, and gets 304s.
+    """
+    print(f"Dashboard refresh over {rows:,} expenses ({len(DASHBOARD_REQUESTS)} requests)")
+    print("-" * 60)
+    results = {}
+    saved = app_module.RESPONSE_CACHE_SIZE, app_module.COMPRESS_MIN_BYTES
+    with tempfile.TemporaryDirectory() as data_dir:
+        app_module.DATABASE = os.path.join(data_dir, 'expenses.db')
+        app_module.init_db()
+        _seed_expenses(rows)
+        client = app_module.app.test_client()
+        modes = (('plain', 0, float('inf'), False), ('cached', saved[0], saved[1], False),
+                 ('revalidated', saved[0], saved[1], True))
+        try:
+            for mode, cache_size, compress_min, revalidate in modes:
+                app_module.RESPONSE_CACHE_SIZE, app_module.COMPRESS_MIN_BYTES = cache_size, compress_min
+                etags = {}
+                transferred = []
+                cpu = []
+                for _ in range(refreshes + 1):
+                    size = 0
+                    start = time.process_time()
+                    for url in DASHBOARD_REQUESTS:
+                        headers = {'Accept-Encoding': 'gzip, deflate, br'}
+                        if revalidate and url in etags:
+                            headers['If-None-Match'] = etags[url]
+                        response = client.get(url, headers=headers)
+                        etags[url] = response.headers.get('ETag')
+                        size += len(response.data)
+                    cpu.append(time.process_time() - start)
+                    transferred.append(size)
+                # The first refresh only fills the caches
+                results[mode] = {
+                    'bytes_per_refresh': statistics.median(transferred[1:]),
+                    'cpu_ms_per_refresh': statistics.median(cpu[1:]) * 1000,
+                }
+                print(f"{mode:<12} {results[mode]['bytes_per_refresh']:>9,.0f} bytes  "
+                      f"{results[mode]['cpu_ms_per_refresh']:7.3f}ms CPU per refresh")
+        finally:
+            app_module.RESPONSE_CACHE_SIZE, app_module.COMPRESS_MIN_BYTES = saved
+    return results
+
+
+def _wsgi_load(clients, urls, done):
+    """A threaded WSGI server's worth of load: a thread and test client per connection"""
+    latencies = []
+
+    def connection(offset):
+        client = app_module.app.test_client()
+        samples = []
+        for url in itertools.islice(itertools.cycle(urls), offset, None):
+            if done():
+                break
+            start = time.perf_counter()
+            client.get(url)
+            samples.append(time.perf_counter() - start)
+        latencies.extend(samples)
+
+    threads = [threading.Thread(target=connection, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+async def _asgi_load(asgi_app, clients, urls, done):
+    """The same load as concurrent connections to an ASGI app on one event loop"""
+    latencies = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    async def connection(offset):
+        for url in itertools.islice(itertools.cycle(urls), offset, None):
+            if done():
+                break
+            path, _, query = url.partition('?')
+            scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(), 'headers': []}
+            start = time.perf_counter()
+            await asgi_app(scope, receive, send)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(connection(n) for n in range(clients)))
+    return latencies
+
+
+def benchmark_serving(rows=20_000, clients=16, seconds=3.0):
+    """Read throughput and latency under concurrent load, idle and during a retrain.
+
+    wsgi runs every connection on its own thread with the retrain in-process,
+    like the threaded development server; asgi serves from an event loop
+    through asgi.AsgiApp with its default pools. Half the seeded expenses
+    are marked as corrections so the retrain takes a few seconds.
+    """
+    import asgi
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    urls = list(DASHBOARD_REQUESTS) + [
+        '/api/predict?q=' + urllib.parse.quote(description) for description in generate_descriptions(500, seed=3)
+    ]
+    print(f"Read load from {clients} connections over {rows:,} expenses, {rows // 2:,} corrections")
+    print("-" * 60)
+    results = {}
+    saved = app_module.categorizer
+    with tempfile.TemporaryDirectory() as data_dir:
+        app_module.DATABASE = os.path.join(data_dir, 'expenses.db')
+        app_module.init_db()
+        _seed_expenses(rows)
+        conn = app_module.connect_db()
+        conn.execute('UPDATE expenses SET user_corrected = TRUE WHERE id % 2 = 0')
+        conn.commit()
+        conn.close()
+        shutil.copytree(os.path.join(here, 'models', 'expense_model'), os.path.join(data_dir, 'expense_model'))
+
+        try:
+            for mode in ('wsgi', 'asgi'):
+                app_module.categorizer = ExpenseCategorizer(cache_size=app_module.PREDICTION_CACHE_SIZE)
+                app_module.categorizer.model_path = os.path.join(data_dir, 'expense_model')
+                app_module.categorizer.load_model()
+                app_module.categorizer._build_pipeline()  # Import scikit-learn outside the timings
+                if mode == 'asgi':
+                    asgi_app = asgi.AsgiApp()
+                    asgi_app.startup()
+                    if asgi_app.training is not None:
+                        asgi_app.training.executor.submit(int).result()  # Start the training process
+                    load = lambda done: asyncio.run(_asgi_load(asgi_app, clients, urls, done))
+                else:
+                    load = lambda done: _wsgi_load(clients, urls, done)
+
+                results[mode] = {}
+                deadline = time.perf_counter() + seconds
+                retrain = threading.Thread(target=app_module.trainer.train)
+                for phase, done in (('idle', lambda: time.perf_counter() > deadline),
+                                    ('retraining', lambda: not retrain.is_alive())):
+                    if phase == 'retraining':
+                        retrain.start()
+                    start = time.perf_counter()
+                    samples = load(done)
+                    elapsed = time.perf_counter() - start
+                    results[mode][phase] = {
+                        'rps': len(samples) / elapsed,
+                        'p50_ms': statistics.median(samples) * 1000,
+                        'p99_ms': _percentile(samples, 99) * 1000,
+                    }
+                    print(f"{mode:<5} {phase:<11} {results[mode][phase]['rps']:8.0f} req/s  "
+                          f"p50 {results[mode][phase]['p50_ms']:7.2f}ms  p99 {results[mode][phase]['p99_ms']:8.2f}ms"
+                          + (f"  (retrain {elapsed:.1f}s)" if phase == 'retraining' else ''))
+                if mode == 'asgi':
+                    asgi_app.shutdown()
+        finally:
+            app_module.categorizer = saved
+    return results
+
+
+def write_statement(path, rows, seed=42):
+    """Write a synthetic CSV bank statement with the given number of rows"""
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Transaction Date', 'Description', 'Amount'])
+        for start in range(0, rows, 100_000):
+            for description in generate_descriptions(min(100_000, rows - start), seed + start):
+                day = rng.randint(0, 3 * 365)
+                writer.writerow([f"{1 + day % 12:02d}/{1 + day % 28:02d}/{2021 + day // 365}",
+                                 description, f"{rng.uniform(1, 500):.2f}"])
+
+
+def benchmark_import(rows=1_000_000):
+    """Import a synthetic statement through the CLI; rows/s and peak RSS"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as data_dir:
+        statement = os.path.join(data_dir, 'statement.csv')
+        write_statement(statement, rows)
+        size_mb = os.path.getsize(statement) / 1e6
+
+        # A fresh process, so ru_maxrss is the importer's own peak
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(here, 'import_expenses.py'), statement,
+                        '--database', os.path.join(data_dir, 'expenses.db')],
+                       cwd=here, check=True, stdout=subprocess.DEVNULL)
+        seconds = time.perf_counter() - start
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    print(f"import of a {rows:,}-row ({size_mb:.0f} MB) CSV statement")
+    print("-" * 60)
+    print(f"wall time:  {seconds:8.1f}s  ({rows / seconds:,.0f} rows/s, including startup)")
+    print(f"peak RSS:   {peak_rss_mb:8.1f} MB")
+    return {'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds, 'peak_rss_mb': peak_rss_mb}
+
+def _legacy_export(client):
+    """What exporting meant before: every row as one list of dicts, one JSON body"""
+    conn = app_module.connect_db()
+    rows = conn.execute(f"SELECT {', '.join(app_module.EXPENSE_FIELDS)} FROM expenses ORDER BY date DESC, id DESC").fetchall()
+    conn.close()
+    body = json.dumps([dict(zip(app_module.EXPENSE_FIELDS, row)) for row in rows])
+    yield body.encode()
+
+
+def _streamed_export(client, export_format):
+    resp = client.get('/api/expenses/export', query_string={'format': export_format})
+    yield from resp.response
+    resp.close()
+
+
+def benchmark_export(rows=1_000_000):
+    """Full-table export: time to first byte, total time and peak Python memory"""
+    with tempfile.TemporaryDirectory() as data_dir:
+        app_module.DATABASE = os.path.join(data_dir, 'expenses.db')
+        app_module.init_db()
+        _seed_expenses(rows)
+        client = app_module.app.test_client()
+
+        runs = {
+            'legacy json': lambda: _legacy_export(client),
+            'ndjson': lambda: _streamed_export(client, 'ndjson'),
+            'csv': lambda: _streamed_export(client, 'csv'),
+            'parquet': lambda: _streamed_export(client, 'parquet'),
+        }
+        results = {}
+        for name, run in runs.items():
+            tracemalloc.start()
+            start = time.perf_counter()
+            first_byte = None
+            size = 0
+            for chunk in run():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - start
+                size += len(chunk)
+            seconds = time.perf_counter() - start
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+            results[name] = {'first_byte_ms': first_byte * 1000, 'seconds': seconds,
+                             'megabytes': size / 1e6, 'peak_mb': peak_mb}
+
+    print(f"export of {rows:,} expenses (peak = Python heap, via tracemalloc)")
+    print("-" * 60)
+    for name, result in results.items():
+        print(f"{name:<12} first byte {result['first_byte_ms']:9.1f}ms  total {result['seconds']:6.1f}s  "
+              f"{result['megabytes']:6.0f} MB out  peak {result['peak_mb']:7.1f} MB")
+    return results
+
+
+# What a cold start cost with eager imports and a pickled Pipeline
+_LEGACY_STARTUP_PROBE = """
+import pickle, sys, time
+started = time.perf_counter()
+import flask, flask_cors, numpy, pandas
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.model_selection import cross_val_score
+with open(sys.argv[1], 'rb') as f:
+    model = pickle.load(f)
+model.predict_proba(['coffee shop'])
+print((time.perf_counter() - started) * 1000)
+"""
+
+
+def benchmark_startup(runs=5):
+    """Time to first prediction in a fresh process, legacy pickle vs compact artifact"""
+    categorizer = ExpenseCategorizer()
+    pipeline = categorizer._build_pipeline()
+    training_data = categorizer.prepare_initial_data()
+    pipeline.fit([categorizer.preprocess_text(d) for d, _ in training_data], [c for _, c in training_data])
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        pickle_path = os.path.join(model_dir, 'expense_model.pkl')
+        with open(pickle_path, 'wb') as f:
+            pickle.dump(pipeline, f)
+        legacy = sorted(
+            float(subprocess.run([sys.executable, '-c', _LEGACY_STARTUP_PROBE, pickle_path],
+                                 check=True, capture_output=True, text=True).stdout)
+            for _ in range(runs)
+        )[runs // 2]
+
+    reports = app_module.profile_startup(runs)
+    compact = sorted(report['timings']['time to first prediction'] for report in reports)[runs // 2]
+    print("-" * 60)
+    print(f"legacy pickle + eager imports  {legacy:8.1f} ms")
+    print(f"compact artifact, lazy imports {compact:8.1f} ms  ({legacy / compact:.1f}x faster)")
+    return {'legacy_ms': legacy, 'compact_ms': compact}
+
+
+def _model_worker(model_dir, reload_interval, events, stop):
+    """Stand-in for a web worker: predicts every few ms, reports model version changes"""
+    categorizer = ExpenseCategorizer(cache_size=0, reload_interval=reload_interval)
+    categorizer.model_path = model_dir
+    version = None
+    while not stop.is_set():
+        categorizer.predict_category('Costco gas')
+        if categorizer.model.version != version:
+            version = categorizer.model.version
+            events.put((os.getpid(), version, time.time()))
+        time.sleep(0.005)
+
+
+def _memory_kb(pid, model_dir):
+    """(Pss of the whole process, Rss and Pss of the mapped model files) in kB"""
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        total_pss = next(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+    model_rss = model_pss = 0
+    in_model = False
+    with open(f'/proc/{pid}/smaps') as f:
+        for line in f:
+            fields = line.split()
+            if '-' in fields[0] and len(fields) >= 5:
+                in_model = len(fields) == 6 and fields[5].startswith(model_dir)
+            elif in_model and fields[0] == 'Rss:':
+                model_rss += int(fields[1])
+            elif in_model and fields[0] == 'Pss:':
+                model_pss += int(fields[1])
+    return total_pss, model_rss, model_pss
+
+
+def benchmark_workers(workers=8, reload_interval=1.0):
+    """Model memory across worker processes and time for all of them to see a new version"""
+    import multiprocessing
+
+    context = multiprocessing.get_context('spawn')
+    print(f"model sharing across spawned workers (reload interval {reload_interval}s)")
+    print("-" * 60)
+    results = {}
+    count = 1
+    with tempfile.TemporaryDirectory() as data_dir:
+        model_dir = os.path.join(data_dir, 'expense_model')
+        publisher = ExpenseCategorizer()
+        publisher.model_path = model_dir
+        publisher.train_model()
+
+        while count <= workers:
+            events, stop = context.Queue(), context.Event()
+            processes = [context.Process(target=_model_worker, args=(model_dir, reload_interval, events, stop))
+                         for _ in range(count)]
+            for process in processes:
+                process.start()
+            version = publisher.model.version
+            seen = set()
+            while len(seen) < count:
+                pid, worker_version, _ = events.get(timeout=60)
+                if worker_version == version:
+                    seen.add(pid)
+
+            memory = [_memory_kb(process.pid, model_dir) for process in processes]
+            total_pss = sum(m[0] for m in memory) / 1024
+            model_rss = sum(m[1] for m in memory) / len(memory)
+            model_pss = sum(m[2] for m in memory)
+
+            # Publish a new version and wait for every worker to switch
+            publisher.train_model()
+            published = os.stat(os.path.join(model_dir, 'CURRENT')).st_mtime
+            delays = {}
+            while len(delays) < count:
+                pid, worker_version, seen_at = events.get(timeout=60)
+                if worker_version == publisher.model.version:
+                    delays[pid] = seen_at - published
+
+            stop.set()
+            for process in processes:
+                process.join()
+
+            results[count] = {'total_pss_mb': total_pss, 'model_rss_kb_per_worker': model_rss,
+                              'model_pss_kb_total': model_pss, 'max_convergence_s': max(delays.values())}
+            print(f"{count:>2} workers  total PSS {total_pss:7.1f} MB  model RSS/worker {model_rss:5.0f} kB  "
+                  f"model PSS total {model_pss:5.0f} kB  all on new model after {max(delays.values()):.2f}s")
+            count *= 2
+    return results
+
+
+def benchmark_metrics(rows=5_000):
+    """Per-request cost of instrumentation: off, /metrics only, and with Server-Timing"""
+    app_module.app.logger.disabled = True
+    modes = {'off': (False, False), 'metrics': (True, False), 'metrics + Server-Timing': (True, True)}
+    descriptions = generate_descriptions(rows)
+    results = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        app_module.DATABASE = os.path.join(data_dir, 'expenses.db')
+        app_module.init_db()
+        _seed_expenses(1_000)
+        client = app_module.app.test_client()
+        client.get('/api/predict', query_string={'q': 'warm up'})
+
+        # Interleave the modes so drift affects them all alike
+        samples = {mode: [] for mode in modes}
+        for index, description in enumerate(descriptions):
+            for mode, (enabled, server_timing) in modes.items():
+                app_module.METRICS_ENABLED, app_module.SERVER_TIMING = enabled, server_timing
+                start = time.perf_counter()
+                if index % 2:
+                    client.get('/api/expenses', query_string={'limit': 20})
+                else:
+                    client.get('/api/predict', query_string={'q': f'{description} {mode}'})
+                samples[mode].append(time.perf_counter() - start)
+        app_module.METRICS_ENABLED, app_module.SERVER_TIMING = True, False
+
+    print(f"instrumentation overhead over {rows:,} requests per mode (predict + expenses page)")
+    print("-" * 60)
+    baseline = statistics.median(samples['off'])
+    for mode, mode_samples in samples.items():
+        p50 = statistics.median(mode_samples)
+        results[mode] = {'p50_ms': p50 * 1000, 'p99_ms': _percentile(mode_samples, 99) * 1000}
+        print(f"{mode:<24} p50 {p50 * 1000:7.3f}ms  p99 {results[mode]['p99_ms']:7.3f}ms  "
+              f"({(p50 / baseline - 1) * 100:+5.1f}%)")
+    return results
+
+
+def benchmark_merchants(rows=300_000, samples=5_000):
+    """Merchant index over rows corrected descriptions: load time, memory, and prediction latency"""
+    with tempfile.TemporaryDirectory() as data_dir:
+        app_module.DATABASE = os.path.join(data_dir, 'expenses.db')
+        app_module.init_db()
+        categories = ExpenseCategorizer().categories
+        descriptions = [f'{description} {n}' for n, description in enumerate(generate_descriptions(rows))]
+        conn = app_module.connect_db()
+        conn.executemany('''
+            INSERT INTO expenses (description, amount, category, predicted_category, user_corrected, normalized_description)
+            VALUES (?, 10, ?, 'Other', TRUE, ?)
+        ''', ((description, categories[n % len(categories)], app_module.preprocess_text(description))
+              for n, description in enumerate(descriptions)))
+        conn.commit()
+
+        # Prediction cache off, so misses pay for the model every time
+        categorizer = ExpenseCategorizer(cache_size=0)
+        categorizer.predict_category('warm up')
+        start = time.perf_counter()
+        categorizer.merchants.sync(conn)
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        categorizer.merchants.sync(conn, force=True)
+        sync_ms = (time.perf_counter() - start) * 1000
+
+        tracemalloc.start()
+        index = app_module.MerchantIndex()
+        index.sync(conn)
+        memory_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del index
+        conn.close()
+
+    rng = random.Random(42)
+    hits = _latencies(categorizer.predict_category, rng.sample(descriptions, min(samples, rows)))
+    misses = _latencies(categorizer.predict_category, generate_descriptions(samples, seed=7))
+
+    print(f"merchant index over {rows:,} corrected descriptions")
+    print("-" * 60)
+    print(f"full load {load_seconds:.2f}s  incremental sync {sync_ms:.3f}ms  "
+          f"memory {memory_bytes / 2 ** 20:.1f} MB ({memory_bytes / rows:.0f} bytes per entry)")
+    for name, latencies in (('merchant hit', hits), ('model', misses)):
+        print(f"{name:<14} p50 {statistics.median(latencies) * 1000:7.3f}ms"
+              f"  p99 {_percentile(latencies, 99) * 1000:7.3f}ms")
+    return {
+        'rows': rows,
+        'load_seconds': load_seconds,
+        'sync_ms': sync_ms,
+        'memory_mb': memory_bytes / 2 ** 20,
+        'hit_p50_ms': statistics.median(hits) * 1000,
+        'model_p50_ms': statistics.median(misses) * 1000,
+    }
+
+
+def benchmark_evaluate(rows=100_000, folds=5, workers=None):
+    """Model selection over the default grid: per-candidate cross-validation vs evaluate_models with cached features"""
+    import numpy as np
+    from sklearn.model_selection import cross_val_score
+
+    import evaluate_models
+
+    categorizer = ExpenseCategorizer()
+    descriptions = generate_descriptions(rows)
+    # The bundled model's answers with 5% of them flipped, so candidates differ
+    rng = random.Random(5)
+    labels = [category if rng.random() >= 0.05 else rng.choice(categorizer.categories)
+              for category, _ in categorizer.predict_categories(descriptions)]
+    texts = [categorizer.preprocess_text(description) for description in descriptions]
+    specs = evaluate_models.candidate_specs(categorizer.default_pipeline)
+    pipelines = {name: app_module.build_pipeline(spec) for name, spec in specs.items()}
+    workers = workers or os.cpu_count()
+
+    # Every candidate re-tokenizes every fold, one fit at a time
+    folds_by_row = evaluate_models.assign_folds(labels, folds)
+    splits = [(np.flatnonzero(folds_by_row != fold), np.flatnonzero(folds_by_row == fold)) for fold in range(folds)]
+    start = time.perf_counter()
+    for pipeline in pipelines.values():
+        cross_val_score(pipeline, texts, labels, cv=splits)
+    baseline_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        summaries = evaluate_models.evaluate(texts, labels, pipelines, specs, folds, workers, cache_dir)
+        cold_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        evaluate_models.evaluate(texts, labels, pipelines, specs, folds, workers, cache_dir)
+        warm_seconds = time.perf_counter() - start
+
+    print(f"{len(specs)} candidates x {folds} folds on {rows:,} rows, {workers} workers")
+    print("-" * 60)
+    print(f"cross_val_score per candidate  {baseline_seconds:8.1f}s")
+    print(f"evaluate_models, cold cache    {cold_seconds:8.1f}s  {baseline_seconds / cold_seconds:5.1f}x")
+    print(f"evaluate_models, warm cache    {warm_seconds:8.1f}s  {baseline_seconds / warm_seconds:5.1f}x")
+    print(f"best: {summaries[0]['name']} ({summaries[0]['accuracy']:.2%})")
+    return {
+        'rows': rows,
+        'workers': workers,
+        'baseline_seconds': baseline_seconds,
+        'cold_seconds': cold_seconds,
+        'warm_seconds': warm_seconds,
+    }
+
+
+def _insert_load(insert, clients, seconds):
+    """Call insert(row) from clients threads for a fixed time; returns (latencies, errors)"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client(number):
+        samples = []
+        failed = 0
+        n = 0
+        while time.perf_counter() < deadline:
+            description = f'Webhook charge {number}-{n}'
+            start = time.perf_counter()
+            try:
+                insert((description, 12.5, 'Shopping', 'Shopping', False, app_module.preprocess_text(description)))
+            except sqlite3.OperationalError:
+                # busy_timeout ran out waiting for the write lock
+                failed += 1
+            else:
+                samples.append(time.perf_counter() - start)
+            n += 1
+        with lock:
+            latencies.extend(samples)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(errors)
+
+
+def benchmark_writes(clients=64, seconds=3.0):
+    """Single-expense inserts from concurrent clients: a commit per row vs the group-commit write queue"""
+    pragmas = app_module.SQLITE_PRAGMAS
+    results = {}
+    print(f"single-expense inserts from {clients} clients, {seconds:.0f}s each "
+          f"(queue: {app_module.WRITE_QUEUE_MAX_ROWS} rows / {app_module.WRITE_QUEUE_MAX_WAIT_MS:g}ms)")
+    print("-" * 60)
+    # NORMAL is what the app runs with; FULL also syncs the WAL on every commit
+    for synchronous in ('NORMAL', 'FULL'):
+        app_module.SQLITE_PRAGMAS = tuple(
+            f'PRAGMA synchronous={synchronous}' if pragma.startswith('PRAGMA synchronous') else pragma
+            for pragma in pragmas)
+        try:
+            for mode in ('per_row', 'queue'):
+                with tempfile.TemporaryDirectory() as data_dir:
+                    app_module.DATABASE = os.path.join(data_dir, 'expenses.db')
+                    app_module.init_db()
+                    if mode == 'queue':
+                        queue = app_module.WriteQueue(app_module.DATABASE, app_module.WRITE_QUEUE_MAX_ROWS,
+                                                      app_module.WRITE_QUEUE_MAX_WAIT_MS / 1000)
+                        latencies, errors = _insert_load(queue.insert, clients, seconds)
+                        queue.close()
+                    else:
+                        pool = app_module.ConnectionPool(app_module.DATABASE, clients)
+
+                        def insert(row):
+                            conn = pool.acquire()
+                            try:
+                                conn.execute(app_module.INSERT_EXPENSE_SQL, row)
+                                conn.commit()
+                            finally:
+                                pool.release(conn)
+
+                        latencies, errors = _insert_load(insert, clients, seconds)
+                name = f'{mode}_{synchronous.lower()}'
+                results[name] = {
+                    'rows_per_second': len(latencies) / seconds,
+                    'errors': errors,
+                    'p50_ms': statistics.median(latencies) * 1000,
+                    'p99_ms': _percentile(latencies, 99) * 1000,
+                }
+                print(f"{name:<16} {len(latencies) / seconds:>9,.0f} rows/s  p50 {results[name]['p50_ms']:7.2f}ms"
+                      f"  p99 {results[name]['p99_ms']:7.2f}ms  {errors:,} locked")
+        finally:
+            app_module.SQLITE_PRAGMAS = pragmas
+    return results
+
+
+BENCHMARKS = {
+    'preprocess': benchmark_preprocess,
+    'predict': benchmark_predict,
+    'merchants': benchmark_merchants,
+    'train': benchmark_train,
+    'evaluate': benchmark_evaluate,
+    'online': benchmark_online,
+    'load': benchmark_load,
+    'writes': benchmark_writes,
+    'pagination': benchmark_pagination,
+    'analytics': benchmark_analytics,
+    'insights': benchmark_insights,
+    'search': benchmark_search,
+    'dashboard': benchmark_dashboard,
+    'serving': benchmark_serving,
+    'import': benchmark_import,
+    'export': benchmark_export,
+    'startup': benchmark_startup,
+    'workers': benchmark_workers,
+    'metrics': benchmark_metrics,
+}
+
+
+# Benchmarks run by `suite`. 'each' runs once per size; 'sweep' runs once
+# with the largest size and reports every size up to it by itself; 'once'
+# runs with its own defaults.
+SUITE = {
+    'preprocess': 'each',
+    'predict': 'each',
+    'merchants': 'each',
+    'train': 'sweep',
+    'analytics': 'sweep',
+    'insights': 'sweep',
+    'search': 'sweep',
+    'dashboard': 'each',
+    'import': 'each',
+    'export': 'each',
+    'metrics': 'once',
+}
+DEFAULT_SUITE_SIZES = (1_000, 100_000, 1_000_000)
+
+# Metric names that are costs (lower is better) or rates (higher is better);
+# anything else (row counts, sizes) is context and never flagged
+_LOWER_IS_BETTER = re.compile(r'(_ms|seconds|_s|_mb|_kb|_kb_total|_kb_per_worker)$')
+_HIGHER_IS_BETTER = re.compile(r'(per_second|rps)$')
+
+
+def _environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit or None,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def run_suite(sizes=DEFAULT_SUITE_SIZES):
+    """Run every SUITE benchmark over the synthetic corpus sizes"""
+    results = {}
+    for name, mode in SUITE.items():
+        if mode == 'sweep':
+            print("=" * 60)
+            results[name] = {'sweep': BENCHMARKS[name](max(sizes))}
+        elif mode == 'once':
+            print("=" * 60)
+            results[name] = BENCHMARKS[name]()
+        else:
+            results[name] = {}
+            for size in sizes:
+                print("=" * 60)
+                results[name][size] = BENCHMARKS[name](size)
+    print("=" * 60)
+    return results
+
+
+def _flatten(results, prefix=''):
+    for key, value in results.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from _flatten(value, path + '.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, key, value
+
+
+def compare(baseline, current, threshold=0.2):
+    """Metrics that got worse than baseline by more than threshold (a fraction)"""
+    baseline_metrics = {path: value for path, _, value in _flatten(baseline['results'])}
+    regressions = []
+    for path, key, value in _flatten(current['results']):
+        old = baseline_metrics.get(path)
+        if not old or not isinstance(key, str):
+            continue
+        if _LOWER_IS_BETTER.search(key):
+            change = value / old - 1
+        elif _HIGHER_IS_BETTER.search(key):
+            change = old / value - 1 if value else float('inf')
+        else:
+            continue
+        if change > threshold:
+            regressions.append({'metric': path, 'baseline': old, 'current': value, 'worse_by': change})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['suite', 'compare'],
+                        help="benchmark to run, 'suite' for all of them, or 'compare' for two result files")
+    parser.add_argument('files', nargs='*', help='for compare: baseline.json current.json')
+    parser.add_argument('--rows', type=int, help='number of synthetic rows (default depends on benchmark)')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SUITE_SIZES)),
+                        help='comma-separated corpus sizes for suite (default: %(default)s)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='for compare: flag metrics worse by more than this fraction (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.benchmark == 'compare':
+        if len(args.files) != 2:
+            parser.error('compare needs a baseline and a current results file')
+        with open(args.files[0]) as f:
+            baseline = json.load(f)
+        with open(args.files[1]) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']:.4g} -> "
+                  f"{regression['current']:.4g} ({regression['worse_by']:+.0%})")
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%} "
+              f"({baseline['environment'].get('commit')} -> {current['environment'].get('commit')})")
+        return 1 if regressions else 0
+
+    if args.benchmark == 'suite':
+        results = run_suite(tuple(int(size) for size in args.sizes.split(',')))
+    else:
+        print("=" * 60)
+        results = BENCHMARKS[args.benchmark](args.rows) if args.rows else BENCHMARKS[args.benchmark]()
+        print("=" * 60)
+        results = {args.benchmark: results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': _environment(), 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
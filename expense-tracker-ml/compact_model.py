@@ -0,0 +1,263 @@
+"""
+Compact, versioned model artifact for fast inference
+
+A fitted TF-IDF + LogisticRegression (or MultinomialNB) pipeline is
+reduced to its arrays (vocabulary, idf weights, coefficients and
+intercepts) saved as .npy
+files, plus the tokenizer settings in meta.json. Loading memory-maps the
+arrays, so there is no unpickling, no scikit-learn import, and forked
+workers share the same pages.
+
+Layout of an artifact directory:
+
+    models/expense_model/
+        CURRENT          name of the active version, e.g. "v3"
+        v3/meta.json
+        v3/terms.npy     vocabulary, sorted
+        v3/idf.npy       idf weight per term
+        v3/coef.npy      (terms x classes) coefficients
+        v3/intercept.npy
+
+A new version is written to a temporary directory, renamed into place
+and only then published by replacing CURRENT, so readers never see a
+partial artifact.
+"""
+
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+ARTIFACT_FORMAT = 1
+POINTER_FILE = 'CURRENT'
+# Older versions kept around for rollback
+KEEP_VERSIONS = 3
+
+
+class CompactModel:
+    """Inference-only TF-IDF + linear softmax classifier on numpy arrays.
+
+    Exposes classes_, predict and predict_proba like the scikit-learn
+    pipeline it was exported from, and returns the same probabilities.
+    Terms are looked up by binary search in the mapped vocabulary rather
+    than through a per-process dict, so every worker reads the same pages.
+    """
+
+    def __init__(self, terms, idf, coef, intercept, meta):
+        self.meta = meta
+        self.version = meta['version']
+        self.trained_at = datetime.fromisoformat(meta['created_at'])
+        self.classes_ = np.array(meta['classes'])
+        self.terms = terms
+        self.idf = idf
+        self.coef = coef
+        self.intercept = intercept
+        self._token_pattern = re.compile(meta['token_pattern'])
+        self._stop_words = frozenset(meta['stop_words'])
+        self._ngram_range = tuple(meta['ngram_range'])
+        self._lowercase = meta['lowercase']
+
+    def _terms(self, text):
+        """Word n-grams of a document, built the way TfidfVectorizer builds them"""
+        if self._lowercase:
+            text = text.lower()
+        tokens = [token for token in self._token_pattern.findall(text) if token not in self._stop_words]
+        min_n, max_n = self._ngram_range
+        for n in range(min_n, min(max_n, len(tokens)) + 1):
+            for start in range(len(tokens) - n + 1):
+                yield ' '.join(tokens[start:start + n])
+
+    def transform(self, texts):
+        """TF-IDF features as (row count, rows, columns, weights) of the non-zero entries"""
+        rows = []
+        terms = []
+        for row, text in enumerate(texts):
+            document = list(self._terms(text))
+            rows.extend([row] * len(document))
+            terms.extend(document)
+        if not terms:
+            return len(texts), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+
+        # Vocabulary lookup for every term of every text in one search
+        terms = np.array(terms)
+        columns = np.searchsorted(self.terms, terms)
+        columns[columns == len(self.terms)] = 0
+        known = self.terms[columns] == terms
+
+        # Term counts per (text, column), then TF-IDF weights with l2 rows
+        keys, counts = np.unique(np.array(rows)[known] * len(self.terms) + columns[known], return_counts=True)
+        rows, columns = np.divmod(keys, len(self.terms))
+        weights = counts * self.idf[columns]
+        weights /= np.sqrt(np.bincount(rows, weights ** 2))[rows]
+        return len(texts), rows, columns, weights
+
+    def decision_function_transformed(self, features):
+        count, rows, columns, weights = features
+        scores = np.tile(self.intercept, (count, 1))
+        np.add.at(scores, rows, weights[:, None] * self.coef[columns])
+        return scores
+
+    def predict_proba_transformed(self, features):
+        """Softmax over the class scores of already transformed features"""
+        scores = self.decision_function_transformed(features)
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+
+    def decision_function(self, texts):
+        return self.decision_function_transformed(self.transform(texts))
+
+    def predict_proba(self, texts):
+        return self.predict_proba_transformed(self.transform(texts))
+
+    def predict(self, texts):
+        return self.classes_[self.decision_function(texts).argmax(axis=1)]
+
+
+def current_version(directory):
+    """Name of the published version in an artifact directory, or None"""
+    try:
+        with open(os.path.join(directory, POINTER_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_artifact(directory):
+    """Memory-map the published version of an artifact; None if there is none"""
+    version = current_version(directory)
+    if version is None:
+        return None
+    path = os.path.join(directory, version)
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f'Unsupported model artifact format in {path}: {meta.get("format")}')
+    arrays = {
+        name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+        for name in ('terms', 'idf', 'coef', 'intercept')
+    }
+    return CompactModel(meta=meta, **arrays)
+
+
+def _version_number(name):
+    return int(name[1:]) if re.fullmatch(r'v\d+', name) else None
+
+
+def _linear_weights(classifier):
+    """(features x classes) coefficients and intercepts whose softmax is the classifier's predict_proba"""
+    if hasattr(classifier, 'feature_log_prob_'):
+        # Multinomial naive Bayes: log prior plus features times log likelihoods
+        return classifier.feature_log_prob_.T, classifier.class_log_prior_
+    if classifier.coef_.shape[0] != len(classifier.classes_):
+        raise ValueError('Only multinomial classifiers can be exported')
+    return classifier.coef_.T, classifier.intercept_
+
+
+def _export(pipeline):
+    """Arrays and tokenizer settings of a fitted pipeline, checking it can be exported"""
+    vectorizer, classifier = pipeline.steps[0][1], pipeline.steps[-1][1]
+    if vectorizer.norm != 'l2' or vectorizer.sublinear_tf or not vectorizer.use_idf:
+        raise ValueError('Only l2-normalized, linear-tf TF-IDF features can be exported')
+    if vectorizer.analyzer != 'word' or vectorizer.strip_accents or vectorizer.preprocessor or vectorizer.tokenizer:
+        raise ValueError('Only the default word analyzer can be exported')
+    coef, intercept = _linear_weights(classifier)
+
+    stop_words = vectorizer.get_stop_words()
+    arrays = {
+        # Columns of the TF-IDF matrix follow the sorted vocabulary
+        'terms': np.array(vectorizer.get_feature_names_out(), dtype=str),
+        'idf': vectorizer.idf_.astype(np.float64),
+        'coef': np.ascontiguousarray(coef, dtype=np.float64),
+        'intercept': np.asarray(intercept, dtype=np.float64),
+    }
+    meta = {
+        'classes': [str(label) for label in classifier.classes_],
+        'token_pattern': vectorizer.token_pattern,
+        'lowercase': vectorizer.lowercase,
+        'ngram_range': list(vectorizer.ngram_range),
+        'stop_words': sorted(stop_words) if stop_words else [],
+    }
+    return arrays, meta
+
+
+def to_compact(pipeline):
+    """The in-memory CompactModel a fitted pipeline would be saved as, e.g. to time it"""
+    arrays, meta = _export(pipeline)
+    return CompactModel(meta={'format': ARTIFACT_FORMAT, 'version': 0,
+                              'created_at': datetime.now().isoformat(), **meta}, **arrays)
+
+
+def save_artifact(pipeline, directory, **extra_meta):
+    """Export a fitted TF-IDF + linear classifier pipeline as a new version.
+
+    Returns the version number that was published.
+    """
+    arrays, exported_meta = _export(pipeline)
+
+    os.makedirs(directory, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=directory)
+    try:
+        # mkdtemp is private to its owner; workers may run as another user
+        os.chmod(staging, 0o755)
+        for name, array in arrays.items():
+            _write(os.path.join(staging, f'{name}.npy'), lambda f: np.save(f, array))
+
+        # Claim the next free version; another process may be publishing too
+        existing = [_version_number(name) for name in os.listdir(directory)]
+        number = max([n for n in existing if n is not None], default=0) + 1
+        while True:
+            meta = {
+                'format': ARTIFACT_FORMAT,
+                'version': number,
+                'created_at': datetime.now().isoformat(),
+                **exported_meta,
+                **extra_meta,
+            }
+            _write(os.path.join(staging, 'meta.json'), lambda f: f.write(json.dumps(meta, indent=2).encode()))
+            try:
+                os.rename(staging, os.path.join(directory, f'v{number}'))
+                break
+            except OSError:
+                if not os.path.isdir(os.path.join(directory, f'v{number}')):
+                    raise
+                number += 1
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    _publish(directory, f'v{number}')
+    _prune(directory, number)
+    return number
+
+
+def _write(path, write):
+    """Write a file through write(f) and fsync it, so a rename never publishes unwritten data"""
+    with open(path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _publish(directory, version):
+    """Atomically point CURRENT at a version"""
+    fd, temporary = tempfile.mkstemp(prefix='.pointer-', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(f'{version}\n'.encode())
+        f.flush()
+        os.fsync(f.fileno())
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, os.path.join(directory, POINTER_FILE))
+
+
+def _prune(directory, newest):
+    # Mapped files of a removed version stay readable for workers still using them
+    for name in os.listdir(directory):
+        number = _version_number(name)
+        if number is not None and number <= newest - KEEP_VERSIONS:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
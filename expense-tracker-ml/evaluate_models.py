@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Parallel model selection for the expense categorizer
+
+Scores candidate pipelines with stratified k-fold cross-validation on the
+data train_model uses (the seed data plus every user correction) and can
+promote the best one as the published model:
+
+    python evaluate_models.py --folds 5 --output results.json
+    python evaluate_models.py --promote
+
+Fits run in a process pool with one worker per core. TF-IDF features are
+the part candidates share: each (vectorizer, fold) pair is fitted and
+transformed once, saved as sparse .npz matrices in a feature cache, and
+every classifier on that vectorizer loads them instead of re-tokenizing.
+A --cache-dir keeps the features for later runs on the same data.
+
+Predictions are scored the way they are served: a prediction less
+confident than the categorizer's min_confidence counts as 'Other'.
+Latency is per single description through the compact model the
+candidate would be published as.
+"""
+
+import argparse
+import concurrent.futures
+import functools
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+import compact_model
+
+DEFAULT_FOLDS = 5
+DEFAULT_LATENCY_SAMPLES = 200
+
+# The grid searched by default, as changes to the default pipeline
+VECTORIZER_GRID = {
+    'tfidf 2k': {'max_features': 2000},
+    'tfidf 10k': {'max_features': 10000},
+    'tfidf 2k unigram': {'max_features': 2000, 'ngram_range': [1, 1]},
+}
+CLASSIFIER_GRID = (
+    ('logistic_regression', {'C': 0.3}),
+    ('logistic_regression', {'C': 1.0}),
+    ('logistic_regression', {'C': 3.0}),
+    ('multinomial_nb', {'alpha': 0.1}),
+    ('multinomial_nb', {'alpha': 1.0}),
+)
+_SHORT_NAMES = {'logistic_regression': 'logreg', 'multinomial_nb': 'nb'}
+
+# Set in each worker process by _init_worker
+_thread_limits = None
+
+
+def candidate_specs(base):
+    """Pipeline specs of the default grid, by name; base is a spec like ExpenseCategorizer.default_pipeline"""
+    specs = {}
+    for vectorizer_name, vectorizer in VECTORIZER_GRID.items():
+        for classifier, params in CLASSIFIER_GRID:
+            # Logistic regression keeps the base settings (class weights,
+            # iterations); naive Bayes takes none of them
+            if classifier == base['classifier']:
+                params = dict(base['classifier_params'], **params)
+            name = f"{vectorizer_name} + {_SHORT_NAMES[classifier]} " + ' '.join(
+                f'{key}={value}' for key, value in params.items() if key in ('C', 'alpha'))
+            specs[name] = {
+                'vectorizer': dict(base['vectorizer'], **vectorizer),
+                'classifier': classifier,
+                'classifier_params': params,
+            }
+    return specs
+
+
+def assign_folds(labels, folds, seed=42):
+    """Fold number of every row, stratified so each fold has the same mix of categories"""
+    from sklearn.model_selection import StratifiedKFold
+
+    assignment = np.empty(len(labels), dtype=np.intp)
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    for fold, (_, test) in enumerate(splitter.split(np.zeros(len(labels)), labels)):
+        assignment[test] = fold
+    return assignment
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def _vectorizer_key(vectorizer):
+    """Cache key of an unfitted vectorizer: its parameters"""
+    return _digest(repr(sorted(vectorizer.get_params().items())))
+
+
+@functools.lru_cache(maxsize=4)
+def _load_dataset(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _save_atomically(directory, write):
+    """Fill a staging directory with write(path), then rename it into place.
+
+    Another worker or an earlier run may have produced it already; the
+    copy that got there first is kept.
+    """
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=os.path.dirname(directory))
+    try:
+        write(staging)
+        os.rename(staging, directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _init_worker():
+    # One BLAS/OpenMP thread per process: parallelism comes from the pool,
+    # and nested threads would only oversubscribe the cores
+    from threadpoolctl import threadpool_limits
+
+    global _thread_limits
+    _thread_limits = threadpool_limits(1)
+
+
+def _fit_features(dataset_path, feature_dir, vectorizer, fold):
+    """Fit a vectorizer on one fold's training rows and cache both transformed matrices"""
+    import scipy.sparse
+    from sklearn.base import clone
+
+    if os.path.isdir(feature_dir):
+        with open(os.path.join(feature_dir, 'meta.json')) as f:
+            return json.load(f)['seconds']
+    texts, _, folds = _load_dataset(dataset_path)
+    vectorizer = clone(vectorizer)
+    start = time.perf_counter()
+    train = vectorizer.fit_transform(texts[folds != fold])
+    seconds = time.perf_counter() - start
+    test = vectorizer.transform(texts[folds == fold])
+
+    def write(path):
+        scipy.sparse.save_npz(os.path.join(path, 'train.npz'), train)
+        scipy.sparse.save_npz(os.path.join(path, 'test.npz'), test)
+        with open(os.path.join(path, 'vectorizer.pkl'), 'wb') as f:
+            pickle.dump(vectorizer, f)
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'seconds': seconds}, f)
+
+    _save_atomically(feature_dir, write)
+    return seconds
+
+
+def _score(dataset_path, feature_dir, classifier, fold, classes, min_confidence, latency_samples):
+    """Fit a classifier on one fold's cached features and score it on the held-out rows"""
+    import scipy.sparse
+    from sklearn.base import clone
+    from sklearn.metrics import accuracy_score, f1_score
+    from sklearn.pipeline import Pipeline
+
+    texts, labels, folds = _load_dataset(dataset_path)
+    train = scipy.sparse.load_npz(os.path.join(feature_dir, 'train.npz'))
+    test = scipy.sparse.load_npz(os.path.join(feature_dir, 'test.npz'))
+    with open(os.path.join(feature_dir, 'vectorizer.pkl'), 'rb') as f:
+        vectorizer = pickle.load(f)
+
+    classifier = clone(classifier)
+    start = time.perf_counter()
+    classifier.fit(train, labels[folds != fold])
+    seconds = time.perf_counter() - start
+
+    probabilities = classifier.predict_proba(test)
+    best = probabilities.argmax(axis=1)
+    predicted = np.where(probabilities[np.arange(len(best)), best] < min_confidence,
+                         'Other', classifier.classes_[best])
+    actual = labels[folds == fold]
+
+    # Single-description latency of the model as it would be served
+    model = compact_model.to_compact(Pipeline([('tfidf', vectorizer), ('classifier', classifier)]))
+    samples = texts[folds == fold][:latency_samples]
+    model.predict_proba(samples[:1])
+    latencies = []
+    for text in samples:
+        start = time.perf_counter()
+        model.predict_proba([text])
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        'accuracy': float(accuracy_score(actual, predicted)),
+        'f1': [float(value) for value in f1_score(actual, predicted, labels=classes, average=None, zero_division=0)],
+        'classifier_seconds': seconds,
+        'latencies': latencies,
+    }
+
+
+def _summarize(name, spec, folds, classes):
+    latencies = sorted(latency for fold in folds for latency in fold['latencies'])
+    f1 = np.mean([fold['f1'] for fold in folds], axis=0)
+    accuracies = [fold['accuracy'] for fold in folds]
+    return {
+        'name': name,
+        'spec': spec,
+        'accuracy': statistics.mean(accuracies),
+        'accuracy_std': statistics.pstdev(accuracies),
+        'macro_f1': float(f1.mean()),
+        'f1': {label: float(value) for label, value in zip(classes, f1)},
+        # Per fold: fitting the vectorizer plus fitting the classifier
+        'train_seconds': statistics.mean(fold['feature_seconds'] + fold['classifier_seconds'] for fold in folds),
+        'latency_p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else None,
+        'latency_p99_ms': latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1000 if latencies else None,
+    }
+
+
+def evaluate(texts, labels, pipelines, specs=None, folds=DEFAULT_FOLDS, workers=None, cache_dir=None,
+             min_confidence=0.3, latency_samples=DEFAULT_LATENCY_SAMPLES, seed=42):
+    """Cross-validate unfitted TF-IDF pipelines, by name, on preprocessed texts.
+
+    Returns a summary per candidate, best first: mean accuracy (ties go
+    to macro F1), per-class F1, training seconds per fold and p50/p99
+    latency of a single prediction. specs, by the same names, are kept in
+    the summaries so the winner can be trained again.
+    """
+    texts = np.asarray(texts, dtype=object)
+    labels = np.asarray(labels, dtype=object)
+    classes = sorted(set(labels))
+    assignment = assign_folds(labels, folds, seed)
+    specs = specs or {}
+
+    temporary = None
+    if cache_dir is None:
+        cache_dir = temporary = tempfile.mkdtemp(prefix='evaluate-models-')
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        # Everything cached is keyed by the data and the fold assignment
+        dataset_key = _digest('\n'.join(texts), '\n'.join(labels), assignment.tobytes().hex())
+        dataset_path = os.path.join(cache_dir, f'dataset-{dataset_key}.pkl')
+        if not os.path.exists(dataset_path):
+            fd, staging = tempfile.mkstemp(prefix='.staging-', dir=cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((texts, labels, assignment), f)
+            os.replace(staging, dataset_path)
+
+        # Candidates sharing vectorizer parameters share features
+        by_vectorizer = {}
+        for name, pipeline in pipelines.items():
+            vectorizer, classifier = pipeline.steps[0][1], pipeline.steps[-1][1]
+            key = _vectorizer_key(vectorizer)
+            by_vectorizer.setdefault(key, (vectorizer, []))[1].append((name, classifier))
+
+        results = {name: [] for name in pipelines}
+        with concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count(), initializer=_init_worker) as pool:
+            pending = {}
+            for key, (vectorizer, _) in by_vectorizer.items():
+                for fold in range(folds):
+                    feature_dir = os.path.join(cache_dir, f'features-{dataset_key}-{key}-{fold}')
+                    future = pool.submit(_fit_features, dataset_path, feature_dir, vectorizer, fold)
+                    pending[future] = ('features', key, fold, feature_dir)
+
+            # Each fold's classifiers start as soon as its features are cached,
+            # so no core waits for the slowest vectorizer
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    task, key, fold, context = pending.pop(future)
+                    if task == 'score':
+                        results[key].append(dict(future.result(), feature_seconds=context))
+                        continue
+                    for name, classifier in by_vectorizer[key][1]:
+                        scored = pool.submit(_score, dataset_path, context, classifier, fold, classes,
+                                             min_confidence, latency_samples)
+                        pending[scored] = ('score', name, fold, future.result())
+    finally:
+        if temporary:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    summaries = [_summarize(name, specs.get(name), scores, classes) for name, scores in results.items()]
+    summaries.sort(key=lambda summary: (-summary['accuracy'], -summary['macro_f1'], summary['train_seconds']))
+    return summaries
+
+
+def print_report(summaries):
+    classes = list(summaries[0]['f1']) if summaries else []
+    width = max([len(summary['name']) for summary in summaries] + [9])
+    print(f"{'candidate':<{width}}  {'accuracy':>15}  {'macro F1':>8}  {'train s':>8}  {'p50 ms':>7}  {'p99 ms':>7}")
+    for summary in summaries:
+        print(f"{summary['name']:<{width}}  {summary['accuracy']:>8.2%} ± {summary['accuracy_std']:<5.2%} "
+              f"{summary['macro_f1']:>8.3f}  {summary['train_seconds']:>8.2f}  "
+              f"{summary['latency_p50_ms']:>7.3f}  {summary['latency_p99_ms']:>7.3f}")
+    print()
+    print(f"{'F1 by category':<{width}}  " + '  '.join(f'{label[:8]:>8}' for label in classes))
+    for summary in summaries:
+        print(f"{summary['name']:<{width}}  " + '  '.join(f'{summary["f1"][label]:>8.3f}' for label in classes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cross-validate candidate categorizer pipelines')
+    parser.add_argument('--database', help='SQLite database with the corrections (default: expenses.db)')
+    parser.add_argument('--folds', type=int, default=DEFAULT_FOLDS, help='cross-validation folds')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--cache-dir', help='keep cached fold features here for later runs (default: a temporary directory)')
+    parser.add_argument('--latency-samples', type=int, default=DEFAULT_LATENCY_SAMPLES,
+                        help='single-description predictions timed per fold')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--promote', action='store_true',
+                        help='train the best candidate on all the data and publish it as the model')
+    args = parser.parse_args(argv)
+
+    # Deferred so --help doesn't pay for loading Flask and scikit-learn
+    import app as app_module
+
+    categorizer = app_module.categorizer
+    # The online categorizer trains its own hashing pipeline, not these specs
+    if args.promote and isinstance(categorizer, app_module.OnlineExpenseCategorizer):
+        parser.error('--promote needs CATEGORIZER_MODE=batch; the online categorizer does not train pipeline specs')
+
+    if args.database:
+        app_module.DATABASE = args.database
+    app_module.init_db()
+
+    conn = app_module.connect_db()
+    corrections = app_module.load_corrections(conn)
+    conn.close()
+    training_data = categorizer.prepare_initial_data() + corrections
+    texts = [categorizer.preprocess_text(description) for description, _ in training_data]
+    labels = [category for _, category in training_data]
+
+    specs = candidate_specs(app_module.ExpenseCategorizer.default_pipeline)
+    pipelines = {name: app_module.build_pipeline(spec) for name, spec in specs.items()}
+    workers = args.workers or os.cpu_count()
+    print(f"🔬 Evaluating {len(specs)} candidates on {len(texts):,} rows "
+          f"({len(corrections):,} corrections), {args.folds} folds, {workers} workers")
+    start = time.perf_counter()
+    summaries = evaluate(texts, labels, pipelines, specs, args.folds, workers, args.cache_dir,
+                         categorizer.min_confidence, args.latency_samples)
+    print(f"✅ Evaluated in {time.perf_counter() - start:.1f}s\n")
+    print_report(summaries)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summaries, f, indent=2)
+
+    if args.promote:
+        best = summaries[0]
+        print(f"\n🚀 Promoting {best['name']} ({best['accuracy']:.2%})...")
+        categorizer.train_model(corrections, spec=best['spec'])
+        print(f"✅ Published version {categorizer.model.version} to {categorizer.model_path}")
+    return summaries
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Streaming import of bank statements (CSV, OFX or QIF) into the expense tracker
+
+Every stage is a generator, so memory use stays flat however large the
+statement is: rows are parsed lazily, categorized in chunks with one
+vectorized prediction per chunk, and written with one executemany and
+commit per chunk. Rows already imported are skipped using a hash of
+(date, amount, description).
+"""
+
+import argparse
+import csv
+import functools
+import hashlib
+import itertools
+import os
+import time
+from datetime import datetime
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Header names used by common bank exports, matched case-insensitively
+DATE_COLUMNS = ('date', 'transaction date', 'posted date', 'posting date', 'booking date')
+DESCRIPTION_COLUMNS = ('description', 'name', 'payee', 'merchant', 'memo', 'details')
+AMOUNT_COLUMNS = ('amount', 'debit', 'withdrawal', 'debit amount')
+# Columns holding only money going out, whatever sign the bank writes
+DEBIT_COLUMNS = ('debit', 'withdrawal', 'debit amount')
+# Sign of spending in a plain amount column: 'positive' as in the app's own
+# CSV export and many card statements, 'negative' as in most bank accounts
+AMOUNT_SIGNS = ('positive', 'negative')
+CATEGORY_COLUMNS = ('category',)
+
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y', '%m/%d/%y', '%Y%m%d', '%d.%m.%Y', "%m/%d'%Y", "%m/%d'%y")
+
+
+# Statements repeat the same few hundred dates, so strptime runs once per distinct value
+@functools.lru_cache(maxsize=4096)
+def parse_date(value):
+    """Normalize a statement date to the 'YYYY-MM-DD HH:MM:SS' form SQLite uses"""
+    value = value.strip()
+    # OFX dates look like 20240105120000.000[-5:EST]; the first 8 digits are enough
+    if value[:8].isdigit():
+        value = value[:8]
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError(f'Unrecognized date: {value!r}')
+
+
+def parse_amount(value):
+    """Parse '$1,234.50', '-12.00' or '(12.00)' into a signed amount; parentheses mean negative"""
+    value = value.strip().replace(',', '').replace('$', '')
+    if value.startswith('(') and value.endswith(')'):
+        return -float(value[1:-1])
+    return float(value)
+
+
+def _find_column(fieldnames, candidates):
+    lowered = {name.strip().lower(): name for name in fieldnames if name}
+    for candidate in candidates:
+        if candidate in lowered:
+            return lowered[candidate]
+    return None
+
+
+def parse_csv(stream, amount_sign='positive'):
+    """Yield expense dicts from a CSV export with a header row.
+
+    amount_sign is the sign spending has in a plain amount column (see
+    AMOUNT_SIGNS); rows of the other sign are credits. A debit column only
+    holds spending, whatever its sign.
+    """
+    if amount_sign not in AMOUNT_SIGNS:
+        raise ValueError(f"amount_sign must be one of {', '.join(AMOUNT_SIGNS)}")
+    reader = csv.DictReader(stream)
+    fieldnames = reader.fieldnames or []
+    date_column = _find_column(fieldnames, DATE_COLUMNS)
+    description_column = _find_column(fieldnames, DESCRIPTION_COLUMNS)
+    amount_column = _find_column(fieldnames, AMOUNT_COLUMNS)
+    category_column = _find_column(fieldnames, CATEGORY_COLUMNS)
+    if not (date_column and description_column and amount_column):
+        raise ValueError('CSV needs date, description and amount columns')
+
+    debits_only = amount_column.strip().lower() in DEBIT_COLUMNS
+    sign = 1 if amount_sign == 'positive' else -1
+    for row in reader:
+        if not (row.get(amount_column) or '').strip():
+            continue
+        category = (row.get(category_column) or '').strip() if category_column else ''
+        amount = parse_amount(row[amount_column])
+        yield {
+            'date': parse_date(row[date_column]),
+            'description': row[description_column].strip(),
+            'amount': abs(amount) if debits_only else sign * amount,
+            'category': category or None,
+        }
+
+
+def _ofx_tokens(stream, chunk_size=65536):
+    """Yield (tag, value) pairs from OFX, whether SGML (unclosed tags) or XML"""
+    buffer = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += chunk
+        parts = buffer.split('<')
+        # The last part may be cut off mid-token unless the stream is done
+        buffer = parts.pop() if chunk else ''
+        for part in parts + ([buffer] if not chunk and buffer else []):
+            tag, _, value = part.partition('>')
+            if tag:
+                yield tag.strip().upper(), value.strip()
+        if not chunk:
+            return
+
+
+def parse_ofx(stream):
+    """Yield expense dicts from the STMTTRN records of an OFX/QFX statement; TRNAMT is negative for debits"""
+    transaction = None
+    for tag, value in _ofx_tokens(stream):
+        if tag == 'STMTTRN':
+            transaction = {}
+        elif tag == '/STMTTRN' and transaction is not None:
+            if transaction.get('TRNAMT') and transaction.get('DTPOSTED'):
+                yield {
+                    'date': parse_date(transaction['DTPOSTED']),
+                    'description': transaction.get('NAME') or transaction.get('MEMO', ''),
+                    'amount': -parse_amount(transaction['TRNAMT']),
+                    'category': None,
+                }
+            transaction = None
+        elif transaction is not None and value:
+            transaction[tag] = value
+
+
+def parse_qif(stream):
+    """Yield expense dicts from a QIF file (D=date, T=amount, negative when spent, P=payee, M=memo, L=category)"""
+    record = {}
+    for line in stream:
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('!'):
+            continue
+        code, value = line[0], line[1:].strip()
+        if code == '^':
+            if record.get('T') and record.get('D'):
+                yield {
+                    'date': parse_date(record['D']),
+                    'description': record.get('P') or record.get('M', ''),
+                    'amount': -parse_amount(record['T']),
+                    'category': record.get('L') or None,
+                }
+            record = {}
+        else:
+            record[code] = value
+
+
+PARSERS = {
+    'csv': parse_csv,
+    'ofx': parse_ofx,
+    'qfx': parse_ofx,
+    'qif': parse_qif,
+}
+
+
+def detect_format(filename):
+    """Guess the statement format from a file name"""
+    extension = os.path.splitext(filename or '')[1].lstrip('.').lower()
+    return extension if extension in PARSERS else 'csv'
+
+
+def import_hash(expense):
+    """Dedup key for an imported expense"""
+    key = f"{expense['date']}|{expense['amount']:.2f}|{expense['description']}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_expenses(conn, categorizer, expenses, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Categorize and insert expenses chunk by chunk.
+
+    expenses is any iterable of dicts with date, description, amount and an
+    optional category, where the amount is money spent: negative amounts
+    are credits (refunds, deposits) and are skipped. progress, if given, is
+    called with the running stats after every chunk. Returns the final
+    stats; 'corrections' counts inserted rows whose statement category
+    differs from the prediction.
+    """
+    stats = {'rows': 0, 'inserted': 0, 'duplicates': 0, 'credits': 0, 'corrections': 0, 'seconds': 0.0}
+    started = time.perf_counter()
+
+    for chunk in _chunks(expenses, chunk_size):
+        stats['rows'] += len(chunk)
+        expenses_in_chunk = [expense for expense in chunk if expense['amount'] >= 0]
+        stats['credits'] += len(chunk) - len(expenses_in_chunk)
+        chunk = expenses_in_chunk
+
+        categorizer.merchants.sync(conn)
+        predictions = categorizer.predict_categories([expense['description'] for expense in chunk])
+
+        rows = []
+        for expense, (predicted_category, _) in zip(chunk, predictions):
+            user_category = expense.get('category')
+            if user_category not in categorizer.categories:
+                user_category = None
+            user_corrected = bool(user_category and user_category != predicted_category)
+            rows.append((expense['description'], expense['amount'], user_category or predicted_category,
+                         predicted_category, user_corrected, expense['date'], import_hash(expense),
+                         categorizer.preprocess_text(expense['description'])))
+
+        cursor = conn.executemany('''
+            INSERT OR IGNORE INTO expenses
+                (description, amount, category, predicted_category, user_corrected, date, import_hash,
+                 normalized_description)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        # rowcount sums direct changes only: ignored duplicates and the rows
+        # touched by the rollup triggers are not counted
+        inserted = cursor.rowcount if rows else 0
+        corrections = 0
+        if inserted and any(row[4] for row in rows):
+            # Only corrections that were inserted are new labelled data; the
+            # transaction holds the write lock, so the new ids are contiguous
+            last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            corrections = conn.execute(
+                'SELECT COUNT(*) FROM expenses WHERE id > ? AND id <= ? AND user_corrected',
+                (last_id - inserted, last_id)).fetchone()[0]
+        conn.commit()
+        # Corrections in this chunk categorize the same descriptions in later ones
+        if corrections:
+            categorizer.merchants.sync(conn, force=True)
+
+        stats['inserted'] += inserted
+        stats['corrections'] += corrections
+        stats['duplicates'] += len(chunk) - inserted
+        stats['seconds'] = time.perf_counter() - started
+        if progress:
+            progress(dict(stats))
+
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Import a CSV, OFX or QIF bank statement',
+        epilog='Only spending is imported; credits such as refunds and deposits are skipped and counted. '
+               'In a CSV amount column spending is positive, as in the app\'s own export, unless '
+               '--amount-sign negative says the statement writes it negative. Amounts in a debit/withdrawal '
+               'column are always spending. OFX and QIF amounts are negative for spending.')
+    parser.add_argument('statement', help='path to the statement file')
+    parser.add_argument('--format', choices=sorted(PARSERS), help='statement format (default: from extension)')
+    parser.add_argument('--amount-sign', choices=AMOUNT_SIGNS, default='positive',
+                        help='sign of spending in a CSV amount column (default: positive)')
+    parser.add_argument('--database', help='SQLite database to import into (default: expenses.db)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='rows per categorize/insert chunk')
+    args = parser.parse_args(argv)
+
+    # Deferred so --help doesn't pay for loading Flask and scikit-learn
+    import app as app_module
+
+    if args.database:
+        app_module.DATABASE = args.database
+    app_module.init_db()
+
+    statement_format = args.format or detect_format(args.statement)
+    parse = PARSERS[statement_format]
+    if parse is parse_csv:
+        parse = functools.partial(parse_csv, amount_sign=args.amount_sign)
+    conn = app_module.connect_db()
+
+    def report(stats):
+        print(f"  {stats['rows']:>10,} rows  {stats['inserted']:>10,} new  "
+              f"{stats['duplicates']:>8,} duplicates  {stats['credits']:>8,} credits  "
+              f"{stats['rows'] / stats['seconds']:>9,.0f} rows/s",
+              flush=True)
+
+    print(f"📥 Importing {args.statement} ({statement_format})")
+    with open(args.statement, encoding='utf-8-sig', newline='') as stream:
+        stats = import_expenses(conn, app_module.categorizer, parse(stream),
+                                args.chunk_size, report)
+    conn.close()
+
+    # Statement categories that disagree with the model retrain it once, at the end
+    if stats['corrections']:
+        print(f"🧠 Retraining on {stats['corrections']:,} corrections...")
+        app_module.retrain_model()
+
+    print(f"✅ Imported {stats['inserted']:,} of {stats['rows']:,} rows "
+          f"({stats['duplicates']:,} duplicates, {stats['credits']:,} credits skipped) in {stats['seconds']:.1f}s")
+    return stats
+
+
+if __name__ == "__main__":
+    main()
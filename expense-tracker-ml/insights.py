@@ -0,0 +1,277 @@
+"""
+Vectorized spending insights over the whole expenses table
+
+The table is loaded once into a pandas DataFrame (dates as datetime64,
+categories and merchants as categoricals) and every insight is computed
+from its columns with NumPy and pandas group-bys, never by looping over
+rows in Python. Descriptions are normalized into merchant keys once per
+distinct description, also with vectorized string operations.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+SECONDS_PER_DAY = 86400
+
+# A category needs this many expenses before its spread means anything
+MIN_OUTLIER_SAMPLES = 10
+IQR_FACTOR = 1.5
+
+# Recurring charge cadences as (name, typical gap in days, tolerance in days)
+CADENCES = (
+    ('weekly', 7, 1),
+    ('biweekly', 14, 2),
+    ('monthly', 30.4, 3.5),
+    ('quarterly', 91.3, 7),
+    ('yearly', 365.25, 15),
+)
+# Largest relative spread of the gaps, and of the amounts, for a merchant
+# to count as a recurring charge
+MAX_GAP_VARIATION = 0.25
+MAX_AMOUNT_VARIATION = 0.25
+
+_NOT_LETTERS = re.compile(r'[^a-z]+')
+
+
+def normalize_description(description):
+    """Merchant key of a description: letters only, so store numbers and reference codes drop out"""
+    return ' '.join(_NOT_LETTERS.sub(' ', (description or '').lower()).split())
+
+
+def normalize_descriptions(descriptions):
+    """normalize_description over a Series of strings, as vectorized string operations"""
+    return descriptions.str.lower().str.replace(_NOT_LETTERS.pattern, ' ', regex=True).str.strip()
+
+
+def load_expenses(conn, after_id=0):
+    """Read the expense columns the insights need into a DataFrame.
+
+    Only rows with an id above after_id are read, so a frame can be
+    extended with the expenses added since it was loaded.
+    """
+    rows = conn.execute('''
+        SELECT id, date, amount, category, description
+        FROM expenses
+        WHERE id > ?
+    ''', (after_id,)).fetchall()
+    frame = pd.DataFrame.from_records(rows, columns=['id', 'date', 'amount', 'category', 'description'])
+
+    # Normalize each distinct description once, then map every row to its merchant
+    description_codes, distinct = pd.factorize(frame['description'])
+    merchant_codes, merchants = pd.factorize(normalize_descriptions(pd.Series(distinct)))
+
+    frame = frame.assign(
+        id=frame['id'].astype(np.int64),
+        # Unparseable dates become NaT and the row is left out
+        date=pd.to_datetime(frame['date'], format='ISO8601', errors='coerce').astype('datetime64[us]'),
+        amount=frame['amount'].astype(np.float64),
+        category=frame['category'].astype('category'),
+        merchant=pd.Categorical.from_codes(merchant_codes[description_codes], merchants),
+    )
+    return frame[frame['date'].notna()].reset_index(drop=True)
+
+
+def extend_expenses(frame, new):
+    """Append newly loaded expenses to a frame, merging the categoricals"""
+    if not len(frame) or not len(new):
+        return new if len(new) else frame
+    columns = {
+        name: pd.api.types.union_categoricals([frame[name], new[name]])
+        for name in ('category', 'merchant')
+    }
+    return pd.concat([frame, new], ignore_index=True).assign(**columns)
+
+
+def _day_numbers(frame):
+    """Days since the epoch of every expense"""
+    return frame['date'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+
+def _iso(day):
+    return str(np.datetime64(int(np.floor(day)), 'D'))
+
+
+def _money(values):
+    return [round(float(value), 2) for value in values]
+
+
+def rolling_spend(frame, as_of, days=90):
+    """Daily spend with trailing 7 and 30 day sums, and weekly totals, up to as_of"""
+    end = int(np.datetime64(as_of, 'D').astype(np.int64))
+    # 29 extra days so the first 30-day window in range is complete
+    start = end - days + 1
+    first = start - 29
+    day_numbers = _day_numbers(frame)
+    window = (day_numbers >= first) & (day_numbers <= end)
+    daily = np.bincount(day_numbers[window] - first, weights=frame['amount'].to_numpy()[window],
+                        minlength=end - first + 1)
+
+    cumulative = np.concatenate(([0.0], np.cumsum(daily)))
+    offsets = np.arange(start - first, end - first + 1)
+    rolling_7 = cumulative[offsets + 1] - cumulative[offsets - 6]
+    rolling_30 = cumulative[offsets + 1] - cumulative[offsets - 29]
+
+    # Weeks start on Monday; day 0 (1970-01-01) was a Thursday
+    weeks = -(-days // 7)
+    last_week = (end + 3) // 7
+    week_numbers = (day_numbers + 3) // 7
+    in_weeks = (week_numbers > last_week - weeks) & (week_numbers <= last_week)
+    weekly = np.bincount(week_numbers[in_weeks] - (last_week - weeks + 1),
+                         weights=frame['amount'].to_numpy()[in_weeks], minlength=weeks)
+
+    return {
+        'daily': [
+            {'date': _iso(start + offset), 'total': total, 'rolling_7d': r7, 'rolling_30d': r30}
+            for offset, total, r7, r30 in zip(range(days), _money(daily[29:]), _money(rolling_7), _money(rolling_30))
+        ],
+        'weekly': [
+            {'week_start': _iso((last_week - weeks + 1 + offset) * 7 - 3), 'total': total}
+            for offset, total in enumerate(_money(weekly))
+        ],
+    }
+
+
+def month_over_month(frame, as_of, months=6):
+    """Per-category monthly totals for the last months, with the change from each previous month"""
+    periods = pd.period_range(end=pd.Period(as_of, 'M'), periods=months + 1, freq='M')
+    month = frame['date'].dt.to_period('M')
+    recent = month >= periods[0]
+    table = (frame.loc[recent, 'amount']
+             .groupby([month[recent], frame.loc[recent, 'category']], observed=True).sum()
+             .unstack(fill_value=0.0)
+             .reindex(periods, fill_value=0.0))
+    change = table.diff().iloc[1:]
+    previous = table.shift().iloc[1:]
+    change_pct = (change / previous.where(previous != 0)) * 100
+    table = table.iloc[1:]
+
+    # Biggest spenders this month first
+    order = table.iloc[-1].sort_values(ascending=False, kind='stable').index if len(table.columns) else []
+    return {
+        'months': [str(period) for period in table.index],
+        'categories': [
+            {
+                'category': category,
+                'totals': _money(table[category]),
+                'change': _money(change[category]),
+                'change_pct': [None if np.isnan(value) else round(float(value), 1) for value in change_pct[category]],
+            }
+            for category in order
+        ],
+    }
+
+
+def outliers(frame, z_threshold=3.0, limit=20):
+    """Unusually large expenses for their category, by z-score and by the IQR fence.
+
+    Returns the number flagged and the most recent ones, up to limit.
+    """
+    grouped = frame.groupby('category', observed=False)['amount']
+    stats = pd.DataFrame({
+        'mean': grouped.mean(),
+        'std': grouped.std(),
+        'count': grouped.size(),
+        'q1': grouped.quantile(0.25),
+        'q3': grouped.quantile(0.75),
+    }).reindex(frame['category'].cat.categories)
+    stats.loc[stats['count'] < MIN_OUTLIER_SAMPLES, ['std', 'q1', 'q3']] = np.nan
+
+    # Per-row statistics by category code
+    codes = frame['category'].cat.codes.to_numpy()
+    amounts = frame['amount'].to_numpy()
+    mean = stats['mean'].to_numpy()[codes]
+    std = stats['std'].to_numpy()[codes]
+    q1 = stats['q1'].to_numpy()[codes]
+    q3 = stats['q3'].to_numpy()[codes]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_scores = np.where(std > 0, (amounts - mean) / std, np.nan)
+    fence = q3 + IQR_FACTOR * (q3 - q1)
+    by_z = z_scores > z_threshold
+    by_iqr = amounts > fence
+    flagged = np.flatnonzero(by_z | by_iqr)
+
+    dates = frame['date'].to_numpy()
+    recent = flagged[np.lexsort((-frame['id'].to_numpy()[flagged], -dates[flagged].astype(np.int64)))][:limit]
+    rows = frame.iloc[recent]
+    return {
+        'count': int(len(flagged)),
+        'expenses': [
+            {
+                'id': int(row_id),
+                'date': str(date),
+                'description': description,
+                'category': category,
+                'amount': round(float(amount), 2),
+                'category_mean': round(float(mean[index]), 2),
+                'z_score': None if np.isnan(z_scores[index]) else round(float(z_scores[index]), 2),
+                'methods': [name for name, hit in (('zscore', by_z[index]), ('iqr', by_iqr[index])) if hit],
+            }
+            for index, row_id, date, description, category, amount in zip(
+                recent, rows['id'], rows['date'], rows['description'], rows['category'], rows['amount'])
+        ],
+    }
+
+
+def recurring_charges(frame, min_occurrences=3):
+    """Merchants charged at a regular cadence for a steady amount, e.g. subscriptions and bills"""
+    if not len(frame):
+        return []
+    # Charges of each merchant together and in date order, so every merchant
+    # is one contiguous run and per-merchant figures are sums over runs
+    merchant_codes = frame['merchant'].cat.codes.to_numpy()
+    days = frame['date'].to_numpy(dtype='datetime64[s]').astype(np.int64) / SECONDS_PER_DAY
+    order = np.lexsort((days, merchant_codes))
+    merchant_codes, days, amounts = merchant_codes[order], days[order], frame['amount'].to_numpy()[order]
+    starts = np.flatnonzero(np.concatenate(([True], merchant_codes[1:] != merchant_codes[:-1])))
+    ends = np.append(starts[1:], len(order)) - 1
+    occurrences = ends - starts + 1
+
+    # Gaps between consecutive charges; the first charge of each run has none
+    gaps = np.diff(days, prepend=days[0])
+    gaps[starts] = 0.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gap = (days[ends] - days[starts]) / (occurrences - 1)
+        gap_std = np.sqrt(np.maximum(np.add.reduceat(gaps ** 2, starts) / (occurrences - 1) - gap ** 2, 0.0))
+        amount = np.add.reduceat(amounts, starts) / occurrences
+        amount_std = np.sqrt(np.maximum(np.add.reduceat(amounts ** 2, starts) / occurrences - amount ** 2, 0.0))
+        monthly_cost = amount * 30.4 / gap
+
+    cadence = np.full(len(starts), -1)
+    for index, (_, typical, tolerance) in reversed(list(enumerate(CADENCES))):
+        cadence[np.abs(gap - typical) <= tolerance] = index
+    recurring = np.flatnonzero((occurrences >= min_occurrences) & (cadence >= 0)
+                               & (gap_std <= MAX_GAP_VARIATION * gap)
+                               & (amount_std <= MAX_AMOUNT_VARIATION * amount))
+    recurring = recurring[np.argsort(-monthly_cost[recurring], kind='stable')]
+
+    merchants = frame['merchant'].cat.categories
+    categories = frame['category'].to_numpy()
+    dates = frame['date'].to_numpy()
+    return [
+        {
+            'merchant': merchants[merchant_codes[starts[run]]],
+            # The category of the latest charge
+            'category': categories[order[ends[run]]],
+            'cadence': CADENCES[cadence[run]][0],
+            'occurrences': int(occurrences[run]),
+            'amount': round(float(amount[run]), 2),
+            'monthly_cost': round(float(monthly_cost[run]), 2),
+            'last_charged': str(pd.Timestamp(dates[order[ends[run]]])),
+            'next_expected': _iso(days[ends[run]] + gap[run]),
+        }
+        for run in recurring
+    ]
+
+
+def compute_insights(frame, as_of, days=90, months=6, z_threshold=3.0, limit=20):
+    """Every insight for the dashboard, as JSON-ready dicts"""
+    return {
+        'as_of': str(as_of),
+        'expense_count': int(len(frame)),
+        **rolling_spend(frame, as_of, days),
+        'month_over_month': month_over_month(frame, as_of, months),
+        'outliers': outliers(frame, z_threshold, limit),
+        'recurring': recurring_charges(frame),
+    }
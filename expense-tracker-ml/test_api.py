@@ -0,0 +1,801 @@
+#!/usr/bin/env python3
+"""
+Offline API tests using the Flask test client (no live server needed)
+"""
+
+import sys
+import os
+import asyncio
+import concurrent.futures
+import csv
+import gzip
+import io
+import json
+import shutil
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+# Add the current directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as app_module
+import asgi
+
+BUNDLED_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'expense_model')
+
+
+@pytest.fixture
+def client(tmp_path):
+    """Test client backed by a throwaway database and model directory"""
+    app_module.DATABASE = str(tmp_path / 'expenses.db')
+    model_path = tmp_path / 'models' / 'expense_model'
+    shutil.copytree(BUNDLED_MODEL, model_path)
+    app_module.categorizer = app_module.ExpenseCategorizer()
+    app_module.categorizer.model_path = str(model_path)
+    app_module.trainer.debounce_seconds = 0
+    app_module.init_db()
+    yield app_module.app.test_client()
+    # Don't let a retrain from this test run against the next test's database
+    app_module.trainer.wait_idle(timeout=30)
+
+
+def test_batch_json_array(client):
+    resp = client.post('/api/expenses/batch', json=[
+        {'description': 'Starbucks coffee', 'amount': 4.5},
+        {'description': 'Uber ride to airport', 'amount': 32},
+        {'description': 'Netflix monthly subscription', 'amount': 15.99, 'category': 'Bills'},
+    ])
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['inserted'] == 3
+    assert data['corrections'] == 1
+    assert [e['category'] for e in data['expenses']] == ['Food', 'Transport', 'Bills']
+
+    expenses = client.get('/api/expenses').get_json()
+    stored = {e['id']: e for e in expenses}
+    for expense in data['expenses']:
+        assert stored[expense['id']]['description'] == expense['description']
+
+
+def test_batch_ndjson_stream(client):
+    body = '\n'.join(json.dumps({'description': d, 'amount': 10}) for d in ['Rent payment', 'Doctor appointment'])
+    resp = client.post('/api/expenses/batch', data=body + '\n', content_type='application/x-ndjson')
+    assert resp.status_code == 200
+    assert [e['category'] for e in resp.get_json()['expenses']] == ['Bills', 'Healthcare']
+
+
+def test_batch_rejects_non_array(client):
+    resp = client.post('/api/expenses/batch', json={'description': 'Coffee'})
+    assert resp.status_code == 400
+
+
+def test_batch_rejects_malformed_items(client):
+    body = json.dumps({'description': 'Coffee', 'amount': 3}) + '\n{"description": "Tea", "amount":\n'
+    resp = client.post('/api/expenses/batch', data=body, content_type='application/x-ndjson')
+    assert resp.status_code == 400
+    assert resp.get_json()['index'] == 1
+
+    for bad in ({'amount': 'twelve'}, {'amount': None}, {'date': 'next tuesday'},
+                {'category': ['Food']}, {'category': {'name': 'Food'}}):
+        resp = client.post('/api/expenses/batch', json=[
+            {'description': 'Coffee', 'amount': 3},
+            {'description': 'Lunch', 'amount': 12, **bad},
+        ])
+        assert resp.status_code == 400, bad
+        assert resp.get_json()['index'] == 1
+    # Nothing from a rejected batch is stored
+    assert client.get('/api/expenses').get_json() == []
+
+
+def test_batch_normalizes_dates(client):
+    resp = client.post('/api/expenses/batch', json=[
+        {'description': 'Coffee', 'amount': 3, 'date': '01/05/2024'},
+        {'description': 'Lunch', 'amount': 12, 'date': '2024-01-06T12:30:00'},
+    ])
+    assert resp.status_code == 200
+    stored = sorted(expense['date'] for expense in client.get('/api/expenses').get_json())
+    assert stored == ['2024-01-05 00:00:00', '2024-01-06 12:30:00']
+
+
+def test_write_queue_group_commits_inserts(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'WRITE_QUEUE', True)
+    monkeypatch.setattr(app_module, 'WRITE_QUEUE_MAX_ROWS', 10)
+    monkeypatch.setattr(app_module, 'WRITE_QUEUE_MAX_WAIT_MS', 200)
+    results = {}
+
+    def post(n):
+        resp = app_module.app.test_client().post('/api/expenses', json={
+            'description': f'Webhook charge {n}', 'amount': n, 'category': 'Shopping'})
+        results[n] = resp.get_json()
+
+    threads = [threading.Thread(target=post, args=(n,)) for n in range(25)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue = app_module._write_queues.pop(app_module.DATABASE)
+    queue.close()
+
+    # Full batches go as soon as they fill, the remainder after the wait
+    assert queue.rows == 25
+    assert queue.batches <= 5
+    # Every caller got the id its own row was stored under
+    stored = {e['id']: e for e in client.get('/api/expenses?limit=100').get_json()}
+    assert len({result['id'] for result in results.values()}) == 25
+    for n, result in results.items():
+        assert stored[result['id']]['description'] == f'Webhook charge {n}'
+        assert stored[result['id']]['amount'] == n
+
+
+def test_predict_top_k(client):
+    resp = client.get('/api/predict?q=Starbucks%20coffee&top_k=3')
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['category'] == 'Food'
+    assert len(data['alternatives']) == 3
+    assert data['alternatives'][0] == {'category': 'Food', 'probability': data['confidence']}
+    probabilities = [alt['probability'] for alt in data['alternatives']]
+    assert probabilities == sorted(probabilities, reverse=True)
+    # Nothing is written to the database
+    assert client.get('/api/expenses').get_json() == []
+
+
+def test_corrections_retrain_once_in_background(client):
+    client.get('/api/predict?q=warm%20up')
+    version = client.get('/api/model/status').get_json()['model_version']
+
+    app_module.trainer.debounce_seconds = 0.5
+    # Distinct descriptions: a repeated one is categorized from its first correction
+    for n in range(5):
+        resp = client.post('/api/expenses', json={'description': f'Costco gas {n}', 'amount': 40, 'category': 'Transport'})
+        assert resp.status_code == 200
+
+    status = client.get('/api/model/status').get_json()
+    assert status['pending_corrections'] == 5
+    assert status['model_version'] == version
+
+    assert app_module.trainer.wait_idle(timeout=30)
+    status = client.get('/api/model/status').get_json()
+    assert status['pending_corrections'] == 0
+    assert status['model_version'] == version + 1
+    assert status['training_seconds'] > 0
+
+
+def test_prediction_cache_hits_and_invalidation(client):
+    app_module.categorizer.cache = app_module.PredictionCache(max_size=2)
+    for q in ['Starbucks coffee', 'STARBUCKS  coffee!', 'Uber ride', 'Rent payment']:
+        client.get('/api/predict', query_string={'q': q})
+
+    stats = client.get('/api/model/cache').get_json()
+    # The second Starbucks lookup normalizes to the same key
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['size']) == (1, 3, 1, 2)
+
+    app_module.categorizer.train_model()
+    client.get('/api/predict', query_string={'q': 'Rent payment'})
+    stats = client.get('/api/model/cache').get_json()
+    assert stats['invalidations'] == 1
+    assert stats['size'] == 1
+    assert stats['model_version'] == app_module.categorizer.model_version
+
+
+def test_corrected_descriptions_skip_the_model(client):
+    first = client.post('/api/expenses', json={'description': 'Costco gas', 'amount': 40, 'category': 'Transport'})
+    assert first.get_json()['user_corrected'] and first.get_json()['prediction_source'] == 'model'
+
+    # The same description, however it is spelled, now comes from the correction
+    again = client.post('/api/expenses', json={'description': 'COSTCO  Gas!', 'amount': 35}).get_json()
+    assert (again['category'], again['confidence'], again['prediction_source']) == ('Transport', 1.0, 'merchant')
+    assert not again['user_corrected']
+    batch = client.post('/api/expenses/batch', json=[
+        {'description': 'costco gas', 'amount': 30}, {'description': 'Starbucks coffee', 'amount': 4}
+    ]).get_json()['expenses']
+    assert [e['prediction_source'] for e in batch] == ['merchant', 'model']
+    assert client.get('/api/predict?q=Costco%20gas').get_json()['source'] == 'merchant'
+
+    # Setting a category afterwards replaces the learned one, even if it is not a correction
+    client.put(f"/api/expenses/{again['id']}", json={'category': 'Shopping'})
+    assert client.get('/api/predict?q=Costco%20gas').get_json()['category'] == 'Shopping'
+
+    # A new process loads the index from the database
+    model_path = app_module.categorizer.model_path
+    app_module.categorizer = app_module.ExpenseCategorizer()
+    app_module.categorizer.model_path = model_path
+    prediction = client.get('/api/predict?q=costco%20gas').get_json()
+    assert (prediction['category'], prediction['source']) == ('Shopping', 'merchant')
+    assert client.get('/api/model/cache').get_json()['merchants'] == {
+        'size': 1, 'hits': 1, 'misses': 0, 'hit_rate': 1.0}
+
+
+def test_connections_are_pooled_and_use_wal(client):
+    pool = app_module._get_pool()
+    for _ in range(3):
+        assert client.get('/api/budgets').status_code == 200
+        assert client.post('/api/budgets', json={'category': 'Food', 'budget': 200}).status_code == 200
+    # Every request handed its connection back, and the pool reused one
+    assert pool._idle.qsize() == 1
+
+    conn = pool.acquire()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+    pool.release(conn)
+
+
+def _seed(client, count):
+    """Insert count expenses spread over a few days, several sharing a timestamp"""
+    items = [
+        {'description': f'Coffee {n}', 'amount': n, 'category': 'Food' if n % 2 else 'Transport',
+         'date': f'2024-03-{1 + n // 4:02d} 12:00:00'}
+        for n in range(count)
+    ]
+    return client.post('/api/expenses/batch', json=items).get_json()['expenses']
+
+
+def test_keyset_pagination_walks_every_row_once(client):
+    seeded = _seed(client, 23)
+    seen = []
+    cursor = None
+    while True:
+        query = {'limit': 5, 'fields': 'id,date'}
+        if cursor:
+            query['cursor'] = cursor
+        resp = client.get('/api/expenses', query_string=query)
+        page = resp.get_json()
+        assert all(set(expense) == {'id', 'date'} for expense in page)
+        seen.extend(page)
+        cursor = resp.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert sorted(e['id'] for e in seen) == sorted(e['id'] for e in seeded)
+    assert seen == sorted(seen, key=lambda e: (e['date'], e['id']), reverse=True)
+
+
+def test_expense_filters(client):
+    _seed(client, 23)
+    page = client.get('/api/expenses', query_string={
+        'category': 'Food', 'date_from': '2024-03-02', 'date_to': '2024-03-03', 'min_amount': 5, 'max_amount': 10
+    }).get_json()
+    assert sorted(e['amount'] for e in page) == [5, 7, 9]
+    corrected = client.get('/api/expenses?user_corrected=true').get_json()
+    # Coffee is predicted as Food, so the 12 rows filed under Transport are corrections
+    assert len(corrected) == 12
+    assert client.get('/api/expenses?fields=id,password').status_code == 400
+    assert client.get('/api/expenses?cursor=garbage').status_code == 400
+    assert client.get('/api/expenses?date_from=March').status_code == 400
+
+
+def test_search(client):
+    client.post('/api/expenses/batch', json=[
+        {'description': 'Amazon Marketplace order', 'amount': 40, 'date': '2024-01-01 10:00:00'},
+        {'description': 'AMAZON.COM*Prime', 'amount': 15, 'date': '2024-02-01 10:00:00', 'category': 'Bills'},
+        {'description': 'Whole Foods Market', 'amount': 70, 'date': '2024-01-05 10:00:00'},
+        {'description': 'Foods of the whole world', 'amount': 12, 'date': '2024-01-06 10:00:00'},
+        {'description': "McDonald's #123", 'amount': 9, 'date': '2024-01-02 10:00:00'},
+        {'description': 'KFC downtown', 'amount': 11, 'date': '2024-01-03 10:00:00'},
+    ])
+
+    def search(**query):
+        resp = client.get('/api/expenses/search', query_string={'fields': 'description', **query})
+        assert resp.status_code == 200, resp.get_json()
+        return [e['description'] for e in resp.get_json()]
+
+    assert sorted(search(q='amazon')) == ['AMAZON.COM*Prime', 'Amazon Marketplace order']
+    assert search(q='marketpl*') == ['Amazon Marketplace order']
+    assert search(q='"whole foods"') == ['Whole Foods Market']
+    assert sorted(search(q='whole foods')) == ['Foods of the whole world', 'Whole Foods Market']
+    # Query syntax in user input is searched for literally
+    assert search(q='amazon.com*') == ['AMAZON.COM*Prime']
+    assert search(q='NEAR(amazon') == []
+    # Normalized text: both burger chains are 'fast food restaurant'
+    assert search(q='mcdonalds') == []
+    assert sorted(search(q='mcdonalds', normalized='true')) == ['KFC downtown', "McDonald's #123"]
+
+    assert search(q='amazon', category='Bills') == ['AMAZON.COM*Prime']
+    assert search(q='amazon', date_to='2024-01-31') == ['Amazon Marketplace order']
+    assert search(q='amazon', sort='date') == ['AMAZON.COM*Prime', 'Amazon Marketplace order']
+
+    # Both ways of paging visit every match once
+    for sort, param, header in (('rank', 'offset', 'X-Next-Offset'), ('date', 'cursor', 'X-Next-Cursor')):
+        seen = []
+        query = {'q': 'amazon', 'limit': 1, 'sort': sort}
+        while True:
+            resp = client.get('/api/expenses/search', query_string=query)
+            seen.extend(e['id'] for e in resp.get_json())
+            if header not in resp.headers:
+                break
+            query[param] = resp.headers[header]
+        assert sorted(seen) == [1, 2]
+
+    assert client.get('/api/expenses/search?q=').status_code == 400
+    assert client.get('/api/expenses/search?q=***').status_code == 400
+    assert client.get('/api/expenses/search?q=amazon&sort=price').status_code == 400
+    assert client.get('/api/expenses/search?q=amazon&cursor=abc').status_code == 400
+
+    conn = app_module.connect_db()
+    conn.execute("INSERT INTO expenses_fts (expenses_fts, rank) VALUES ('integrity-check', 1)")
+    conn.close()
+
+
+def test_export_streams_ndjson_and_csv(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'EXPORT_FETCH_SIZE', 4)
+    _seed(client, 23)
+    listing = client.get('/api/expenses?limit=1000').get_json()
+
+    resp = client.get('/api/expenses/export?format=ndjson')
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert [json.loads(line) for line in resp.get_data(as_text=True).splitlines()] == listing
+
+    resp = client.get('/api/expenses/export', query_string={'format': 'csv', 'fields': 'id,amount', 'category': 'Food'})
+    assert resp.mimetype == 'text/csv'
+    rows = list(csv.reader(io.StringIO(resp.get_data(as_text=True))))
+    assert rows[0] == ['id', 'amount']
+    assert [int(row[0]) for row in rows[1:]] == [e['id'] for e in listing if e['category'] == 'Food']
+
+    assert client.get('/api/expenses/export?format=xlsx').status_code == 400
+    resp = client.get('/api/expenses/export?fields=id,password')
+    assert resp.status_code == 400
+    assert resp.get_json() == client.get('/api/expenses?fields=id,password').get_json()
+
+
+def test_export_parquet_row_groups(client, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(app_module, 'EXPORT_FETCH_SIZE', 4)
+    monkeypatch.setattr(app_module, 'PARQUET_ROW_GROUP_SIZE', 10)
+    _seed(client, 23)
+    listing = client.get('/api/expenses?limit=1000').get_json()
+
+    resp = client.get('/api/expenses/export?format=parquet')
+    assert resp.status_code == 200
+    frame = pd.read_parquet(io.BytesIO(resp.get_data()))
+    assert frame['id'].tolist() == [e['id'] for e in listing]
+    assert frame['user_corrected'].tolist() == [bool(e['user_corrected']) for e in listing]
+
+
+def test_legacy_database_is_upgraded_in_place(tmp_path):
+    database = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(database)
+    conn.execute('''
+        CREATE TABLE expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            description TEXT NOT NULL,
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            predicted_category TEXT,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            user_corrected BOOLEAN DEFAULT FALSE
+        )
+    ''')
+    conn.execute("INSERT INTO expenses (description, amount, category, date) VALUES ('Rent', 900, 'Bills', '2023-07-01 09:00:00')")
+    conn.commit()
+    conn.close()
+
+    app_module.DATABASE = database
+    # check-rollups migrates first, so it checks the backfilled rollups
+    # instead of failing on tables the old schema lacks
+    result = app_module.app.test_cli_runner().invoke(args=['check-rollups'])
+    assert result.exit_code == 0 and 'Rollups are consistent' in result.output
+    app_module.init_db()  # Already current: nothing to do
+
+    conn = sqlite3.connect(database)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(app_module.MIGRATIONS)
+    assert conn.execute('SELECT description, month FROM expenses').fetchall() == [('Rent', '2023-07')]
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_expenses_date', 'idx_expenses_category_date', 'idx_expenses_corrected', 'idx_expenses_month'} <= indexes
+    # Existing rows are normalized and indexed for search
+    assert conn.execute(
+        "SELECT rowid FROM expenses_fts WHERE expenses_fts MATCH 'normalized_description : payment'"
+    ).fetchall() == [(1,)]
+    conn.close()
+
+
+def test_analytics_queries_use_indexes(client):
+    _seed(client, 10)
+    pool = app_module._get_pool()
+    conn = pool.acquire()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    pool.release(conn)  # The pool is LIFO, so the next request gets this connection
+
+    assert client.get('/api/analytics').status_code == 200
+    conn.set_trace_callback(None)
+
+    queries = [sql for sql in statements if sql.strip().upper().startswith('SELECT')]
+    queries.append('SELECT description, category FROM expenses WHERE user_corrected = TRUE')
+    assert len(queries) >= 3
+    for sql in queries:
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+        # Small rollup tables may be scanned; the expenses table never is
+        assert 'SCAN expenses' not in plan, (sql, plan)
+
+
+def test_rollups_stay_consistent(client):
+    seeded = _seed(client, 12)
+    client.post('/api/expenses', json={'description': 'Uber ride', 'amount': 18.25})
+    client.put(f"/api/expenses/{seeded[0]['id']}", json={'category': 'Shopping'})
+    conn = app_module.connect_db()
+    conn.execute("UPDATE expenses SET amount = amount * 2, date = '2023-12-31 08:00:00' WHERE id = ?", (seeded[1]['id'],))
+    conn.execute('DELETE FROM expenses WHERE id = ?', (seeded[2]['id'],))
+    conn.commit()
+    assert app_module.check_rollups(conn) == []
+
+    analytics = client.get('/api/analytics').get_json()
+    total = conn.execute('SELECT SUM(amount), COUNT(*) FROM expenses').fetchone()
+    assert abs(analytics['total_expenses'] - total[0]) < 1e-6
+    assert analytics['expense_count'] == total[1]
+    assert analytics['monthly'][-1]['month'] == '2023-12'
+
+    # Damage the rollups, detect it, and repair them from the CLI
+    conn.execute('UPDATE category_totals SET total = 0')
+    conn.execute("DELETE FROM period_totals WHERE period = 'monthly' AND period_start = '2023-12-01'")
+    conn.commit()
+    mismatches = app_module.check_rollups(conn)
+    assert {'table': 'period_totals', 'period': 'monthly', 'category': 'Food', 'period_start': '2023-12-01',
+            'stored': None, 'expected': (2.0, 1)} in mismatches
+    runner = app_module.app.test_cli_runner()
+    assert runner.invoke(args=['check-rollups']).exit_code != 0
+    assert runner.invoke(args=['rebuild-rollups']).exit_code == 0
+    assert app_module.check_rollups(conn) == []
+    conn.close()
+
+
+def test_budget_status(client):
+    items = [
+        {'description': 'Groceries', 'amount': 70, 'category': 'Food', 'date': '2024-02-20 10:00:00'},
+        {'description': 'Groceries', 'amount': 30, 'category': 'Food', 'date': '2024-03-02 10:00:00'},
+        {'description': 'Lunch', 'amount': 20, 'category': 'Food', 'date': '2024-03-09 13:00:00'},
+        {'description': 'Uber ride', 'amount': 15, 'category': 'Transport', 'date': '2024-03-03 09:00:00'},  # Sunday
+        {'description': 'Uber ride', 'amount': 12, 'category': 'Transport', 'date': '2024-03-04 09:00:00'},  # Monday
+    ]
+    created = client.post('/api/expenses/batch', json=items).get_json()['expenses']
+    assert client.post('/api/budgets', json={'category': 'Food', 'budget': 100, 'rollover': True}).status_code == 200
+    assert client.post('/api/budgets', json={'category': 'Transport', 'budget': 14, 'period': 'weekly'}).status_code == 200
+    assert client.post('/api/budgets', json={'category': 'Bills', 'budget': 5, 'period': 'yearly'}).status_code == 400
+    conn = app_module.connect_db()
+    conn.execute("UPDATE budgets SET created_date = '2024-01-15 00:00:00'")
+    conn.commit()
+
+    status = client.get('/api/budgets/status?date=2024-03-10').get_json()
+    assert status['date'] == '2024-03-10'
+    food, transport = status['budgets']
+    assert (food['period_start'], food['period_end'], food['days_elapsed'], food['days_in_period']) == \
+        ('2024-03-01', '2024-03-31', 10, 31)
+    # 30 left over from February, and only February, on top of the 100 budget
+    assert (food['carried_over'], food['available'], food['spent'], food['remaining']) == (30, 130, 50, 80)
+    assert food['carried_over_from'] == '2024-02-01'
+    assert food['burn_rate'] == 5 and food['projected_spend'] == 155
+    assert food['projected_overspend'] == 25 and food['status'] == 'at_risk'
+    # Weeks start on Monday, so Sunday's ride belongs to the previous week
+    assert (transport['period_start'], transport['period_end']) == ('2024-03-04', '2024-03-10')
+    assert (transport['carried_over'], transport['spent'], transport['status']) == (0, 12, 'on_track')
+    assert transport['carried_over_from'] is None
+
+    # Edits move spend between periods and categories incrementally
+    client.put(f"/api/expenses/{created[2]['id']}", json={'category': 'Transport'})
+    conn.execute("UPDATE expenses SET date = '2024-03-05 09:00:00' WHERE id = ?", (created[3]['id'],))
+    conn.commit()
+    assert app_module.check_rollups(conn) == []
+    conn.close()
+    food, transport = client.get('/api/budgets/status?date=2024-03-10').get_json()['budgets']
+    assert food['spent'] == 30
+    assert (transport['spent'], transport['remaining'], transport['status']) == (47, -33, 'over')
+    assert client.get('/api/budgets/status?date=March').status_code == 400
+
+
+def test_insights(client):
+    items = [
+        {'description': f'NETFLIX.COM {month}', 'amount': 15.49, 'category': 'Entertainment',
+         'date': f'2024-{month:02d}-{3 + month % 2:02d} 08:00:00'}
+        for month in range(1, 7)
+    ] + [
+        {'description': f'Lunch #{n}', 'amount': 10 + n % 5, 'category': 'Food', 'date': f'2024-05-{1 + n:02d} 12:00:00'}
+        for n in range(20)
+    ] + [{'description': 'Anniversary dinner', 'amount': 400, 'category': 'Food', 'date': '2024-06-01 20:00:00'}]
+    client.post('/api/expenses/batch', json=items)
+
+    response = client.get('/api/analytics/insights?date=2024-06-10&days=14&months=2')
+    assert response.status_code == 200
+    insights = response.get_json()
+    assert insights['expense_count'] == len(items)
+    assert [day['date'] for day in insights['daily']][::13] == ['2024-05-28', '2024-06-10']
+    # The 30 days to June 10 take in the dinner, June's Netflix and the lunches from May 12 on
+    assert insights['daily'][-1]['rolling_7d'] == 0 and insights['daily'][-1]['rolling_30d'] == 400 + 15.49 + 110
+    assert insights['weekly'][-1] == {'week_start': '2024-06-10', 'total': 0}
+    assert insights['month_over_month']['months'] == ['2024-05', '2024-06']
+    food = next(row for row in insights['month_over_month']['categories'] if row['category'] == 'Food')
+    assert food['totals'] == [240, 400] and food['change'] == [240, 160]
+    assert food['change_pct'] == [None, 66.7]
+    assert insights['outliers']['count'] == 1
+    assert insights['outliers']['expenses'][0]['description'] == 'Anniversary dinner'
+    assert [(charge['merchant'], charge['cadence'], charge['occurrences']) for charge in insights['recurring']] == \
+        [('netflix com', 'monthly', 6)]
+
+    # Repeated requests are served from the cache until the expenses change,
+    # whether by an insert (read incrementally) or an edit (full reload)
+    assert client.get('/api/analytics/insights?date=2024-06-10&days=14&months=2').get_json() == insights
+    client.post('/api/expenses/batch', json=[{'description': 'Groceries', 'amount': 60, 'category': 'Food',
+                                              'date': '2024-06-09 10:00:00'}])
+    insights = client.get('/api/analytics/insights?date=2024-06-10&days=14&months=2').get_json()
+    assert insights['expense_count'] == len(items) + 1 and insights['daily'][-1]['rolling_7d'] == 60
+    netflix = client.get('/api/expenses?category=Entertainment').get_json()[0]
+    client.put(f"/api/expenses/{netflix['id']}", json={'category': 'Bills'})
+    insights = client.get('/api/analytics/insights?date=2024-06-10&days=14&months=2').get_json()
+    assert insights['recurring'][0]['category'] == 'Bills'
+
+    assert client.get('/api/analytics/insights?days=0').status_code == 400
+    assert client.get('/api/analytics/insights?date=June').status_code == 400
+
+
+def test_insights_reload_a_recreated_database(client):
+    _seed(client, 5)
+    assert client.get('/api/analytics/insights').get_json()['expense_count'] == 5
+
+    # A new database at the same path restarts the ids; its rows must not be
+    # appended to the frame loaded from the old one
+    app_module._pools.pop(app_module.DATABASE)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(app_module.DATABASE + suffix):
+            os.remove(app_module.DATABASE + suffix)
+    app_module.init_db()
+    _seed(client, 1)
+    assert client.get('/api/analytics/insights').get_json()['expense_count'] == 1
+
+
+def test_conditional_and_compressed_responses(client):
+    _seed(client, 60)
+    first = client.get('/api/expenses?limit=50')
+    etag = first.headers['ETag']
+    assert etag.startswith('W/"') and first.headers['Cache-Control'] == 'no-cache'
+    assert 'Accept-Encoding' in first.headers['Vary'] and 'Content-Encoding' not in first.headers
+
+    # Revalidation skips the view and sends no body; repeats reuse the cached body
+    not_modified = client.get('/api/expenses?limit=50', headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304 and not_modified.data == b''
+    repeat = client.get('/api/expenses?limit=50')
+    assert repeat.data == first.data and repeat.headers['X-Next-Cursor'] == first.headers['X-Next-Cursor']
+    compressed = client.get('/api/expenses?limit=50', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == first.data and len(compressed.data) < len(first.data) / 3
+    small = client.get('/api/categories', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'expense_tracker_response_cache_total{result="not_modified"}' in metrics
+    assert 'expense_tracker_response_cache_total{result="hit"}' in metrics
+
+    # Writes to expenses or budgets change the ETag of every cached endpoint
+    analytics_etag = client.get('/api/analytics').headers['ETag']
+    client.post('/api/expenses', json={'description': 'Uber ride', 'amount': 18.25})
+    fresh = client.get('/api/expenses?limit=50', headers={'If-None-Match': etag})
+    assert fresh.status_code == 200 and fresh.headers['ETag'] != etag
+    assert fresh.get_json()[0]['description'] == 'Uber ride'
+    budgets_etag = client.get('/api/budgets').headers['ETag']
+    client.post('/api/budgets', json={'category': 'Food', 'budget': 300})
+    budgets = client.get('/api/budgets', headers={'If-None-Match': budgets_etag})
+    assert budgets.status_code == 200 and budgets.get_json()[0]['budget'] == 300
+    assert client.get('/api/analytics', headers={'If-None-Match': analytics_etag}).status_code == 200
+
+
+CSV_STATEMENT = """Transaction Date,Description,Amount,Category
+01/05/2024,STARBUCKS STORE #1234,4.50,
+01/06/2024,UBER *TRIP,23.10,
+01/07/2024,Costco gas,"45.00",Transport
+"""
+
+OFX_STATEMENT = """OFXHEADER:100
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240105120000.000[-5:EST]<TRNAMT>-15.99<NAME>NETFLIX.COM</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240106<TRNAMT>-120.00<NAME>Electric bill payment</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+QIF_STATEMENT = """!Type:Bank
+D01/08/2024
+T-60.00
+PDoctor appointment
+^
+D01/09/2024
+T-12.00
+PPizza Hut
+^
+"""
+
+
+def test_import_csv_upload_and_dedup(client):
+    upload = {'file': (io.BytesIO(CSV_STATEMENT.encode()), 'statement.csv')}
+    stats = client.post('/api/import', data=upload, content_type='multipart/form-data').get_json()
+    assert (stats['rows'], stats['inserted'], stats['duplicates'], stats['corrections']) == (3, 3, 0, 1)
+
+    expenses = client.get('/api/expenses?fields=description,amount,category,date').get_json()
+    assert expenses[0] == {'description': 'Costco gas', 'amount': 45.0, 'category': 'Transport',
+                           'date': '2024-01-07 00:00:00'}
+
+    # Importing an overlapping statement again only adds what is new. The
+    # user has since moved Costco gas to Shopping, so the statement still
+    # disagrees with the prediction, but that row is a duplicate: it is not
+    # counted as a correction and nothing retrains
+    costco = client.get('/api/expenses?category=Transport').get_json()[0]
+    client.put(f"/api/expenses/{costco['id']}", json={'category': 'Shopping'})
+    upload = {'file': (io.BytesIO((CSV_STATEMENT + '01/08/2024,Rent payment,900,\n').encode()), 'statement.csv')}
+    stats = client.post('/api/import', data=upload, content_type='multipart/form-data').get_json()
+    assert (stats['rows'], stats['inserted'], stats['duplicates'], stats['corrections']) == (4, 1, 3, 0)
+
+
+def test_import_ofx_and_qif_bodies(client):
+    stats = client.post('/api/import?format=ofx', data=OFX_STATEMENT).get_json()
+    assert stats['inserted'] == 2
+    stats = client.post('/api/import?format=qif', data=QIF_STATEMENT).get_json()
+    assert stats['inserted'] == 2
+
+    expenses = client.get('/api/expenses?fields=description,category,date').get_json()
+    assert [(e['description'], e['category']) for e in expenses] == [
+        ('Pizza Hut', 'Food'), ('Doctor appointment', 'Healthcare'),
+        ('Electric bill payment', 'Bills'), ('NETFLIX.COM', 'Entertainment'),
+    ]
+    assert expenses[-1]['date'] == '2024-01-05 00:00:00'
+    assert client.post('/api/import?format=csv', data='no,useful,columns\n1,2,3\n').status_code == 400
+
+
+def test_import_skips_credits(client):
+    statement = CSV_STATEMENT + '01/08/2024,Refund STARBUCKS,-4.50,\n'
+    stats = client.post('/api/import?format=csv', data=statement).get_json()
+    assert (stats['rows'], stats['inserted'], stats['credits']) == (4, 3, 1)
+    # A bank statement writing spending as negative says so
+    bank = 'Date,Description,Amount\n01/08/2024,Refund UBER,23.10\n01/09/2024,Landlord rent,(1500.00)\n'
+    stats = client.post('/api/import?format=csv&sign=negative', data=bank).get_json()
+    assert (stats['rows'], stats['inserted'], stats['credits']) == (2, 1, 1)
+    assert client.post('/api/import?format=csv&sign=credit', data=bank).status_code == 400
+    ofx = OFX_STATEMENT.replace('</BANKTRANLIST>', '<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240107'
+                                                   '<TRNAMT>15.99<NAME>NETFLIX.COM refund</STMTTRN></BANKTRANLIST>')
+    stats = client.post('/api/import?format=ofx', data=ofx).get_json()
+    assert (stats['inserted'], stats['credits']) == (2, 1)
+    stats = client.post('/api/import?format=qif', data=QIF_STATEMENT + 'D01/10/2024\nT250.00\nPTax refund\n^\n').get_json()
+    assert (stats['inserted'], stats['credits']) == (2, 1)
+
+    amounts = {e['description']: e['amount'] for e in client.get('/api/expenses?limit=100').get_json()}
+    assert not {'Refund STARBUCKS', 'Refund UBER', 'Tax refund'} & set(amounts)
+    assert amounts['Landlord rent'] == 1500.0 and amounts['NETFLIX.COM'] == 15.99
+
+    # A debit column only holds spending, whatever its sign
+    debits = 'Date,Payee,Debit\n01/11/2024,Verizon Wireless,80.00\n01/12/2024,Comcast,-60.00\n'
+    stats = client.post('/api/import?format=csv', data=debits).get_json()
+    assert (stats['inserted'], stats['credits']) == (2, 0)
+
+
+def test_exported_csv_imports_back(client, tmp_path):
+    _seed(client, 6)
+    exported = client.get('/api/expenses/export?format=csv').get_data(as_text=True)
+    fields = 'description,amount,category,date'
+    originals = sorted(client.get(f'/api/expenses?fields={fields}').get_json(), key=lambda e: e['description'])
+
+    app_module.DATABASE = str(tmp_path / 'restored.db')
+    app_module.init_db()
+    stats = client.post('/api/import?format=csv', data=exported).get_json()
+    assert (stats['rows'], stats['inserted'], stats['credits']) == (6, 6, 0)
+    restored = client.get(f'/api/expenses?fields={fields}').get_json()
+    assert sorted(restored, key=lambda e: e['description']) == originals
+
+
+def test_metrics_and_server_timing(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'SERVER_TIMING', True)
+    resp = client.get('/api/predict?q=Starbucks%20coffee')
+    phases = dict(part.split(';dur=') for part in resp.headers['Server-Timing'].split(', '))
+    assert {'preprocess', 'vectorize', 'classify', 'total'} <= set(phases)
+    assert float(phases['total']) >= float(phases['classify']) > 0
+    assert 'db' in client.get('/api/expenses').headers['Server-Timing']
+
+    monkeypatch.setattr(app_module, 'SERVER_TIMING', False)
+    assert 'Server-Timing' not in client.get('/api/expenses/1', method='PUT', json={}).headers
+    resp = client.get('/metrics')
+    assert resp.mimetype == 'text/plain'
+    text = resp.get_data(as_text=True)
+    assert 'http_requests_total{method="GET",route="/api/predict",status="200"}' in text
+    assert 'http_requests_total{method="PUT",route="/api/expenses/<int:expense_id>",status="200"}' in text
+    assert 'expense_tracker_phase_duration_seconds_bucket{phase="classify",le="+Inf"}' in text
+    assert 'expense_tracker_prediction_cache_lookups_total{result="miss"}' in text
+    assert f'expense_tracker_model_version {app_module.categorizer.model_version}\n' in text
+
+
+def _asgi_request(asgi_app, method, path, body=b''):
+    """Drive an ASGI app in-process, sending the body in two parts; returns (status, headers, body)"""
+    async def run():
+        path_info, _, query = path.partition('?')
+        scope = {'type': 'http', 'method': method, 'path': path_info, 'query_string': query.encode(),
+                 'headers': [(b'content-type', b'application/json')] if body else []}
+        parts = [{'type': 'http.request', 'body': body[:len(body) // 2], 'more_body': True},
+                 {'type': 'http.request', 'body': body[len(body) // 2:], 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return parts.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await asgi_app(scope, receive, send)
+        return sent[0]['status'], dict(sent[0]['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+    return asyncio.run(run())
+
+
+def test_asgi_serving_with_backpressure(client):
+    asgi_app = asgi.AsgiApp(inference_pool='thread', inference_workers=1, inference_queue_depth=2,
+                            inference_timeout=0.2, training_pool='thread')
+    try:
+        status, _, body = _asgi_request(asgi_app, 'GET', '/api/predict?q=Starbucks%20coffee')
+        assert status == 200 and json.loads(body)['category'] == 'Food'
+        status, _, _ = _asgi_request(asgi_app, 'POST', '/api/expenses',
+                                     json.dumps({'description': 'Uber ride', 'amount': 18.25}).encode())
+        assert status == 200
+        status, headers, body = _asgi_request(asgi_app, 'GET', '/api/expenses?limit=5')
+        assert headers[b'content-type'] == b'application/json' and json.loads(body)[0]['category'] == 'Transport'
+
+        # With the only inference worker busy, a prediction waits in the queue
+        # until its timeout; once the queue is full the next one is refused
+        gate = threading.Event()
+        asgi_app.inference.submit(gate.wait)
+        status, _, body = _asgi_request(asgi_app, 'GET', '/api/predict?q=coffee')
+        assert status == 504 and 'did not answer' in json.loads(body)['error']
+        status, headers, _ = _asgi_request(asgi_app, 'GET', '/api/predict?q=coffee')
+        assert status == 503 and headers[b'retry-after'] == b'1'
+        gate.set()
+        asgi_app.inference.executor.submit(lambda: None).result()  # The single worker has drained
+
+        # A view that does not start responding in time is answered for it
+        asgi_app.inference.timeout, asgi_app.timeout = 5, 0.1
+        gate = threading.Event()
+        asgi_app.inference.submit(gate.wait)
+        status, _, body = _asgi_request(asgi_app, 'GET', '/api/predict?q=coffee')
+        assert status == 504 and 'No response' in json.loads(body)['error']
+        gate.set()
+        asgi_app.timeout = 5
+        assert _asgi_request(asgi_app, 'GET', '/api/predict?q=coffee')[0] == 200
+        assert 'expense_tracker_pool_rejected_total{pool="inference"}' in client.get('/metrics').get_data(as_text=True)
+    finally:
+        asgi_app.shutdown()
+    assert not isinstance(app_module.categorizer, asgi.PooledCategorizer)
+
+
+def test_asgi_online_corrections_reach_predictions(client, tmp_path, monkeypatch):
+    categorizer = app_module.OnlineExpenseCategorizer()
+    categorizer.model_path = str(tmp_path / 'models' / 'expense_model_online.pkl')
+    monkeypatch.setattr(app_module, 'CATEGORIZER_MODE', 'online')
+    monkeypatch.setattr(app_module, 'categorizer', categorizer)
+    asgi_app = asgi.AsgiApp(inference_pool='process', inference_workers=1, training_pool='thread')
+    try:
+        def predict(description):
+            status, _, body = _asgi_request(asgi_app, 'GET', f'/api/predict?q={description.replace(" ", "%20")}')
+            assert status == 200
+            return json.loads(body)
+
+        assert predict('costco gas station')['category'] == 'Shopping'
+        # Predictions run where corrections are learned, not in another process
+        assert isinstance(asgi_app.inference.executor, concurrent.futures.ThreadPoolExecutor)
+        status, _, _ = _asgi_request(asgi_app, 'POST', '/api/expenses', json.dumps(
+            {'description': 'Costco gas', 'amount': 45, 'category': 'Transport'}).encode())
+        assert status == 200
+        prediction = predict('costco gas station')
+        assert (prediction['category'], prediction['source']) == ('Transport', 'model')
+    finally:
+        asgi_app.shutdown()
+
+
+def test_cold_start_predicts_without_sklearn():
+    report = app_module.profile_startup(runs=1)[0]
+    assert report['heavy_modules'] == []
+    assert report['timings']['time to first prediction'] > 0
+
+
+def test_evaluate_models_in_online_mode(client, monkeypatch):
+    import evaluate_models
+
+    monkeypatch.setattr(app_module, 'categorizer', app_module.OnlineExpenseCategorizer())
+    summaries = evaluate_models.main(['--folds', '2', '--workers', '1', '--latency-samples', '5'])
+    assert len(summaries) == len(evaluate_models.candidate_specs(app_module.ExpenseCategorizer.default_pipeline))
+    # Evaluating works; publishing a spec the online categorizer would ignore does not
+    with pytest.raises(SystemExit):
+        evaluate_models.main(['--promote'])
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, '-q']))
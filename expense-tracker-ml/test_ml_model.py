@@ -5,11 +5,78 @@ Test script for the improved ML expense categorization model
 
 import sys
 import os
+import pickle
+import tempfile
+import threading
 
 # Add the current directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import ExpenseCategorizer
+import numpy as np
+
+import compact_model
+import evaluate_models
+from app import ExpenseCategorizer, OnlineExpenseCategorizer, build_pipeline
+
+# Test cases with expected categories
+TEST_CASES = [
+    # Food tests
+    ("McDonald's lunch", "Food"),
+    ("Starbucks coffee", "Food"), 
+    ("Grocery shopping at Walmart", "Food"),
+    ("Pizza delivery", "Food"),
+    ("Restaurant dinner", "Food"),
+    ("Whole Foods market", "Food"),
+    ("Bar drinks", "Food"),
+    
+    # Transport tests
+    ("Uber ride to airport", "Transport"),
+    ("Gas at Shell station", "Transport"),
+    ("Parking meter downtown", "Transport"),
+    ("Car oil change", "Transport"),
+    ("Flight to New York", "Transport"),
+    ("Metro card refill", "Transport"),
+    ("Taxi fare", "Transport"),
+    
+    # Entertainment tests
+    ("Netflix monthly subscription", "Entertainment"),
+    ("Movie theater tickets", "Entertainment"),
+    ("Concert at venue", "Entertainment"),
+    ("Video game purchase", "Entertainment"),
+    ("Gym membership", "Entertainment"),
+    ("Book at Barnes Noble", "Entertainment"),
+    
+    # Shopping tests
+    ("Amazon online purchase", "Shopping"),
+    ("Clothes at Target", "Shopping"),
+    ("Best Buy electronics", "Shopping"),
+    ("Home Depot supplies", "Shopping"),
+    ("Birthday gift", "Shopping"),
+    ("New shoes", "Shopping"),
+    
+    # Bills tests
+    ("Electric bill payment", "Bills"),
+    ("Internet bill Comcast", "Bills"),
+    ("Cell phone bill Verizon", "Bills"),
+    ("Rent payment", "Bills"),
+    ("Car insurance premium", "Bills"),
+    ("Credit card payment", "Bills"),
+    
+    # Healthcare tests
+    ("Doctor appointment", "Healthcare"),
+    ("Pharmacy prescription", "Healthcare"),
+    ("Dental cleaning", "Healthcare"),
+    ("Eye exam", "Healthcare"),
+    ("Hospital visit", "Healthcare"),
+    ("Physical therapy", "Healthcare"),
+    
+    # Other tests
+    ("Bank ATM fee", "Other"),
+    ("Charity donation", "Other"),
+    ("Pet veterinarian", "Other"),
+    ("Legal consultation", "Other"),
+    ("Investment transfer", "Other"),
+]
 
 def test_ml_model():
     """Test the improved ML model with various expense descriptions"""
@@ -19,65 +86,7 @@ def test_ml_model():
     
     categorizer = ExpenseCategorizer()
     
-    # Test cases with expected categories
-    test_cases = [
-        # Food tests
-        ("McDonald's lunch", "Food"),
-        ("Starbucks coffee", "Food"), 
-        ("Grocery shopping at Walmart", "Food"),
-        ("Pizza delivery", "Food"),
-        ("Restaurant dinner", "Food"),
-        ("Whole Foods market", "Food"),
-        ("Bar drinks", "Food"),
-        
-        # Transport tests
-        ("Uber ride to airport", "Transport"),
-        ("Gas at Shell station", "Transport"),
-        ("Parking meter downtown", "Transport"),
-        ("Car oil change", "Transport"),
-        ("Flight to New York", "Transport"),
-        ("Metro card refill", "Transport"),
-        ("Taxi fare", "Transport"),
-        
-        # Entertainment tests
-        ("Netflix monthly subscription", "Entertainment"),
-        ("Movie theater tickets", "Entertainment"),
-        ("Concert at venue", "Entertainment"),
-        ("Video game purchase", "Entertainment"),
-        ("Gym membership", "Entertainment"),
-        ("Book at Barnes Noble", "Entertainment"),
-        
-        # Shopping tests
-        ("Amazon online purchase", "Shopping"),
-        ("Clothes at Target", "Shopping"),
-        ("Best Buy electronics", "Shopping"),
-        ("Home Depot supplies", "Shopping"),
-        ("Birthday gift", "Shopping"),
-        ("New shoes", "Shopping"),
-        
-        # Bills tests
-        ("Electric bill payment", "Bills"),
-        ("Internet bill Comcast", "Bills"),
-        ("Cell phone bill Verizon", "Bills"),
-        ("Rent payment", "Bills"),
-        ("Car insurance premium", "Bills"),
-        ("Credit card payment", "Bills"),
-        
-        # Healthcare tests
-        ("Doctor appointment", "Healthcare"),
-        ("Pharmacy prescription", "Healthcare"),
-        ("Dental cleaning", "Healthcare"),
-        ("Eye exam", "Healthcare"),
-        ("Hospital visit", "Healthcare"),
-        ("Physical therapy", "Healthcare"),
-        
-        # Other tests
-        ("Bank ATM fee", "Other"),
-        ("Charity donation", "Other"),
-        ("Pet veterinarian", "Other"),
-        ("Legal consultation", "Other"),
-        ("Investment transfer", "Other"),
-    ]
+    test_cases = TEST_CASES
     
     correct_predictions = 0
     total_tests = len(test_cases)
@@ -131,6 +140,240 @@ def test_ml_model():
     
     return accuracy
 
+def evaluate(categorizer):
+    """Fraction of TEST_CASES the categorizer gets right"""
+    predictions = categorizer.predict_categories([description for description, _ in TEST_CASES])
+    correct = sum(predicted == expected for (predicted, _), (_, expected) in zip(predictions, TEST_CASES))
+    return correct / len(TEST_CASES)
+
+def test_online_model():
+    """The online categorizer stays accurate and learns corrections incrementally"""
+    baseline = evaluate(ExpenseCategorizer())
+    
+    with tempfile.TemporaryDirectory() as model_dir:
+        categorizer = OnlineExpenseCategorizer(refit_every=3)
+        categorizer.model_path = os.path.join(model_dir, 'expense_model_online.pkl')
+        categorizer.train_model()
+        
+        accuracy = evaluate(categorizer)
+        print(f"batch accuracy {baseline:.1%}, online accuracy {accuracy:.1%}")
+        assert accuracy >= baseline - 0.05
+        
+        version = categorizer.model_version
+        assert categorizer.predict_category("Costco gas")[0] != "Transport"
+        assert not categorizer.learn_corrections([("Costco gas", "Transport")])
+        assert not categorizer.learn_corrections([("Costco gas", "Transport")])
+        assert categorizer.learn_corrections([("Costco gas", "Transport")])  # refit is due
+        assert categorizer.model_version == version + 3
+        assert categorizer.predict_category("Costco gas")[0] == "Transport"
+        assert evaluate(categorizer) >= baseline - 0.05
+
+def test_compact_model():
+    """The compact artifact predicts exactly like the pipeline it came from"""
+    categorizer = ExpenseCategorizer()
+    descriptions = [categorizer.preprocess_text(description) for description, _ in TEST_CASES] + ['', 'the of']
+    
+    with tempfile.TemporaryDirectory() as model_dir:
+        pipeline = categorizer._build_pipeline()
+        pipeline.fit(*zip(*categorizer.prepare_initial_data()))
+        
+        # A pickle from an older release is converted on first load
+        categorizer.model_path = os.path.join(model_dir, 'expense_model')
+        with open(categorizer.model_path + '.pkl', 'wb') as f:
+            pickle.dump(pipeline, f)
+        assert categorizer.load_model()
+        model = categorizer.model
+        assert model.version == 1
+        assert list(model.classes_) == list(pipeline.classes_)
+        assert np.allclose(model.predict_proba(descriptions), pipeline.predict_proba(descriptions), atol=1e-12)
+        
+        # Each retrain publishes a new version and old ones are pruned
+        for _ in range(compact_model.KEEP_VERSIONS + 1):
+            categorizer.train_model()
+        assert categorizer.model.version == compact_model.KEEP_VERSIONS + 2
+        assert compact_model.current_version(categorizer.model_path) == f'v{categorizer.model.version}'
+        assert len([name for name in os.listdir(categorizer.model_path) if name.startswith('v')]) == compact_model.KEEP_VERSIONS
+
+def test_workers_pick_up_published_model():
+    """A categorizer in another worker switches to a newly published model"""
+    with tempfile.TemporaryDirectory() as model_dir:
+        trainer, worker = ExpenseCategorizer(), ExpenseCategorizer(reload_interval=0)
+        trainer.model_path = worker.model_path = os.path.join(model_dir, 'expense_model')
+        trainer.train_model()
+        
+        worker.predict_category("Costco gas")
+        assert worker.model.version == 1
+        assert worker.predict_category("Costco gas")[0] != "Transport"
+        
+        trainer.train_model([("Costco gas", "Transport")] * 20)
+        assert worker.predict_category("Costco gas")[0] == "Transport"
+        assert worker.model.version == 2
+        
+        # With a long interval the stamp is not checked again yet
+        worker.reload_interval = 3600
+        worker.predict_category("Costco gas")
+        trainer.train_model()
+        worker.predict_category("Costco gas")
+        assert worker.model.version == 2
+
+def test_online_corrections_are_published():
+    """Online updates leave the installed weights alone and reach other workers"""
+    with tempfile.TemporaryDirectory() as model_dir:
+        learner = OnlineExpenseCategorizer(reload_interval=0, save_delay=0.05)
+        worker = OnlineExpenseCategorizer(reload_interval=0)
+        learner.model_path = worker.model_path = os.path.join(model_dir, 'expense_model_online.pkl')
+        learner.train_model()
+        assert worker.predict_category("costco gas station")[0] == "Shopping"
+        
+        before = learner.model.named_steps['classifier']
+        weights = before.coef_.copy()
+        learner.learn_corrections([("Costco gas", "Transport")])
+        save = learner._save_timer
+        after = learner.model.named_steps['classifier']
+        assert after is not before and np.array_equal(before.coef_, weights)
+        assert learner.predict_category("costco gas station")[0] == "Transport"
+        
+        # Published once the save delay has passed, without a refit
+        save.join(5)
+        assert worker.predict_category("costco gas station")[0] == "Transport"
+        version = learner.model_version
+        learner.predict_category("coffee")
+        assert learner.model_version == version  # Its own save is not reloaded
+
+def _hammer(predict, retrain, predictors=8, retrains=3):
+    """Predict from several threads while two others retrain; returns the errors raised"""
+    categories = set(ExpenseCategorizer().categories)
+    errors = []
+    stop = threading.Event()
+    
+    def predicting():
+        try:
+            while not stop.is_set():
+                for category, confidence in predict():
+                    assert category in categories and 0 <= confidence <= 1
+        except Exception as e:
+            errors.append(e)
+    
+    def retraining():
+        try:
+            for _ in range(retrains):
+                retrain()
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=predicting) for _ in range(predictors)]
+    for thread in threads:
+        thread.start()
+    trainers = [threading.Thread(target=retraining) for _ in range(2)]
+    for thread in trainers:
+        thread.start()
+    for thread in trainers:
+        thread.join()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return errors
+
+def test_concurrent_predictions_during_retrains():
+    """Readers never fail or block on a retrain, and no torn artifact is left behind"""
+    descriptions = [description for description, _ in TEST_CASES]
+    
+    with tempfile.TemporaryDirectory() as model_dir:
+        categorizer = ExpenseCategorizer(reload_interval=0)
+        categorizer.model_path = os.path.join(model_dir, 'expense_model')
+        
+        # Concurrent first requests train exactly once
+        first = [threading.Thread(target=categorizer.predict_category, args=("coffee",)) for _ in range(8)]
+        for thread in first:
+            thread.start()
+        for thread in first:
+            thread.join()
+        assert compact_model.current_version(categorizer.model_path) == 'v1'
+        
+        errors = _hammer(lambda: categorizer.predict_categories(descriptions), categorizer.train_model)
+        assert errors == []
+        assert categorizer.model.version == 7
+        assert evaluate(categorizer) > 0.8
+        
+        # Only complete, loadable versions and no leftover temporary files
+        names = sorted(os.listdir(categorizer.model_path))
+        assert names == ['CURRENT', 'v5', 'v6', 'v7']
+        for name in names[1:]:
+            assert sorted(os.listdir(os.path.join(categorizer.model_path, name))) == [
+                'coef.npy', 'idf.npy', 'intercept.npy', 'meta.json', 'terms.npy']
+    
+    with tempfile.TemporaryDirectory() as model_dir:
+        categorizer = OnlineExpenseCategorizer(refit_every=10 ** 6, reload_interval=0)
+        categorizer.model_path = os.path.join(model_dir, 'expense_model_online.pkl')
+        categorizer.train_model()
+        
+        def predict_and_correct():
+            categorizer.learn_corrections([("Costco gas", "Transport")])
+            return categorizer.predict_categories(descriptions)
+        
+        errors = _hammer(predict_and_correct, categorizer.train_model)
+        assert errors == []
+        assert os.listdir(model_dir) == ['expense_model_online.pkl']
+        with open(categorizer.model_path, 'rb') as f:
+            assert list(pickle.load(f).classes_) == sorted(categorizer.categories)
+
+def test_preprocess_text():
+    """Merchant normalization matches whole words only and never re-substitutes"""
+    categorizer = ExpenseCategorizer()
+    
+    cases = [
+        ("McDonald's lunch", "fast food restaurant s lunch"),
+        ("Bar drinks", "bar drinks drinks"),
+        ("Barnes & Noble", "barnes noble"),
+        ("Comcast cable", "comcast cable"),
+        ("Trader Joe's", "grocery store s"),
+        ("Trader Joes", "grocery store"),
+        ("  Electric   bill!! ", "electricity bill bill"),
+        ("", ""),
+    ]
+    
+    for description, expected in cases:
+        assert categorizer.preprocess_text(description) == expected, description
+
+def test_evaluate_and_promote():
+    """Candidates are cross-validated on cached features, and a promoted one survives retrains"""
+    categorizer = ExpenseCategorizer()
+    training_data = categorizer.prepare_initial_data()
+    texts = [categorizer.preprocess_text(description) for description, _ in training_data]
+    labels = [category for _, category in training_data]
+    specs = {name: spec for name, spec in evaluate_models.candidate_specs(categorizer.default_pipeline).items()
+             if name.startswith('tfidf 2k +')}
+    pipelines = {name: build_pipeline(spec) for name, spec in specs.items()}
+    
+    with tempfile.TemporaryDirectory() as cache_dir:
+        summaries = evaluate_models.evaluate(texts, labels, pipelines, specs, folds=3, workers=2, cache_dir=cache_dir)
+        assert sorted(summary['name'] for summary in summaries) == sorted(specs)
+        assert [summary['accuracy'] for summary in summaries] == sorted(
+            (summary['accuracy'] for summary in summaries), reverse=True)
+        for summary in summaries:
+            assert set(summary['f1']) == set(categorizer.categories)
+            assert summary['train_seconds'] > 0 and summary['latency_p50_ms'] > 0
+        
+        # Every candidate shares one vectorizer, so each fold was featurized once
+        assert len([name for name in os.listdir(cache_dir) if name.startswith('features-')]) == 3
+        again = evaluate_models.evaluate(texts, labels, pipelines, specs, folds=3, workers=1, cache_dir=cache_dir)
+        assert [summary['accuracy'] for summary in again] == [summary['accuracy'] for summary in summaries]
+    
+    with tempfile.TemporaryDirectory() as model_dir:
+        categorizer.model_path = os.path.join(model_dir, 'expense_model')
+        spec = specs['tfidf 2k + nb alpha=0.1']
+        categorizer.train_model(spec=spec)
+        pipeline = build_pipeline(spec).fit(texts, labels)
+        assert np.allclose(categorizer.model.predict_proba(texts), pipeline.predict_proba(texts), atol=1e-12)
+        
+        # Retraining, here or in a fresh process, keeps the promoted configuration
+        categorizer.train_model([("Costco gas", "Transport")])
+        restarted = ExpenseCategorizer()
+        restarted.model_path = categorizer.model_path
+        assert restarted.pipeline_spec() == spec
+        restarted.train_model()
+        assert restarted.model.meta['pipeline_spec'] == spec
+
 if __name__ == "__main__":
     accuracy = test_ml_model()
     